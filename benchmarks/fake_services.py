@@ -0,0 +1,351 @@
+"""
+Local stand-ins for the subset of the Spotify, Qobuz and Soundcloud APIs used by cabot and streamrip.
+
+Every API request can be delayed, throttled (429) or failed (503) at random, audio files and covers are served as is.
+The services run in a background thread, as streamrip downloads files with blocking requests.
+"""
+import asyncio
+import random
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from aiohttp import web
+
+
+SPOTIFY_PLAYLIST_ID = "fakeplaylist"
+SOUNDCLOUD_PLAYLIST_ID = 1
+QOBUZ_ID_OFFSET = 100000
+SOUNDCLOUD_ID_OFFSET = 200000
+QOBUZ_SECRET_TEST_ID = "19512574" # Track streamrip requests to validate the app secret
+
+# region Catalogue
+
+@dataclass(slots=True)
+class FakeTrack :
+    index: int
+    on_qobuz: bool
+    duration_ms: int = 200000
+
+    @property
+    def isrc(self) -> str :
+        return f"FAKE{self.index:08d}"
+
+    @property
+    def title(self) -> str :
+        return f"Track {self.index}"
+
+    @property
+    def artist(self) -> str :
+        return f"Artist {self.index % 10}"
+
+    @property
+    def album(self) -> str :
+        return f"Album {self.index // 10}"
+
+    @property
+    def qobuz_id(self) -> int :
+        return QOBUZ_ID_OFFSET + self.index
+
+    @property
+    def soundcloud_id(self) -> int :
+        return SOUNDCLOUD_ID_OFFSET + self.index
+
+
+def make_catalogue(tracks: int, missing_ratio: float=0., seed: int=0) -> list[FakeTrack] :
+    """
+    `missing_ratio` of the tracks are missing from Qobuz, and only found on Soundcloud.
+    """
+
+    rng = random.Random(seed)
+    return [FakeTrack(i, rng.random() >= missing_ratio) for i in range(tracks)]
+
+# endregion
+
+
+# region Services
+
+@dataclass
+class FaultConfig :
+    latency: float = 0.       # Seconds added to every API request
+    jitter: float = 0.        # Random extra latency, up to this many seconds
+    error_rate: float = 0.    # Share of API requests failing with 503
+    throttle_rate: float = 0. # Share of API requests throttled with 429
+    seed: int = 0
+
+
+@dataclass
+class FakeServices :
+    catalogue: list[FakeTrack]
+    flac: bytes
+    wav: bytes
+    cover: bytes
+    faults: FaultConfig = field(default_factory=FaultConfig)
+    requests: Counter = field(default_factory=Counter)
+    statuses: Counter = field(default_factory=Counter)
+    base_url: str = ""
+
+    # region |---| Helpers
+
+    def _by_qobuz_id(self, qobuz_id: str) -> FakeTrack | None :
+
+        index = int(qobuz_id) - QOBUZ_ID_OFFSET
+        if not (0 <= index < len(self.catalogue)) or not self.catalogue[index].on_qobuz :
+            return None
+
+        return self.catalogue[index]
+
+    def _qobuz_track(self, track: FakeTrack) -> dict :
+        return {
+            "id": track.qobuz_id,
+            "title": track.title,
+            "isrc": track.isrc,
+            "performers": f"{track.artist}, MainArtist",
+            "performer": {"name": track.artist},
+            "streamable": True,
+            "track_number": 1,
+            "media_number": 1,
+            "duration": track.duration_ms // 1000,
+            "maximum_bit_depth": 16,
+            "maximum_sampling_rate": 44.1,
+            "album": {
+                "qobuz_id": track.index // 10,
+                "title": track.album,
+                "tracks_count": 10,
+                "genres_list": [],
+                "release_date_original": "2020-01-01",
+                "artist": {"name": track.artist},
+                "label": {"name": "Fake"},
+                "image": {size: f"{self.base_url}/covers/{track.index}_600.jpg" for size in ("large", "small", "thumbnail")},
+                "maximum_bit_depth": 16,
+                "maximum_sampling_rate": 44.1,
+            },
+        }
+
+    def _soundcloud_track(self, track: FakeTrack) -> dict :
+        return {
+            "id": track.soundcloud_id,
+            "title": track.title,
+            "duration": track.duration_ms,
+            "permalink_url": f"{self.base_url}/soundcloud/files/{track.soundcloud_id}.wav",
+            "streamable": True,
+            "policy": "ALLOW",
+            "downloadable": False,
+            "has_downloads_left": False,
+            "user": {"username": track.artist},
+            "media": {"transcodings": [{"format": {"protocol": "hls", "mime_type": "audio/mpeg"},
+                                        "url": f"{self.base_url}/soundcloud/stream/{track.soundcloud_id}"}]},
+        }
+
+    @staticmethod
+    def _page(key: str, items: list[dict]) -> dict :
+        return {key: {"items": items, "total": len(items), "limit": 500, "offset": 0}}
+
+    # endregion
+
+    # region |---| Faults
+
+    @web.middleware
+    async def _faults(self, request: web.Request, handler) -> web.StreamResponse :
+
+        service, endpoint = request.path.strip("/").split("/", 1)
+        grouped = ("/files/" in request.path) or (service == "covers") # Counted together
+        self.requests[(service, "files" if grouped else endpoint)] += 1
+
+        # Files and covers are served as is
+        if grouped :
+            response = await handler(request)
+            self.statuses[response.status] += 1
+            return response
+
+        await asyncio.sleep(self.faults.latency + self._rng.uniform(0, self.faults.jitter))
+
+        draw = self._rng.random()
+        if draw < self.faults.throttle_rate :
+            response = web.json_response({"message": "Too many requests"}, status=429, headers={"Retry-After": "0"})
+        elif draw < self.faults.throttle_rate + self.faults.error_rate :
+            response = web.json_response({"message": "Service unavailable"}, status=503)
+        else :
+            response = await handler(request)
+
+        self.statuses[response.status] += 1
+
+        return response
+
+    # endregion
+
+    # region |---| Spotify
+
+    async def _spotify_token(self, request: web.Request) -> web.Response :
+        return web.json_response({"access_token": "fake", "token_type": "Bearer", "expires_in": 3600})
+
+    async def _spotify_playlist(self, request: web.Request) -> web.Response :
+        return web.json_response({"name": "Fake playlist", "snapshot_id": f"snapshot-{len(self.catalogue)}"})
+
+    async def _spotify_playlist_items(self, request: web.Request) -> web.Response :
+
+        offset = int(request.query.get("offset", 0))
+        limit = int(request.query.get("limit", 100))
+
+        items = [{"track": {"name": t.title,
+                            "duration_ms": t.duration_ms,
+                            "album": {"name": t.album},
+                            "artists": [{"name": t.artist}],
+                            "external_ids": {"isrc": t.isrc}}}
+                 for t in self.catalogue[offset:offset + limit]]
+        next_page = f"{request.url}" if offset + limit < len(self.catalogue) else None
+
+        return web.json_response({"items": items, "next": next_page})
+
+    # endregion
+
+    # region |---| Qobuz
+
+    async def _qobuz_login(self, request: web.Request) -> web.Response :
+        return web.json_response({"user": {"credential": {"parameters": {"lossless_streaming": True}}}, "user_auth_token": "fake"})
+
+    async def _qobuz_track_get(self, request: web.Request) -> web.Response :
+
+        track = self._by_qobuz_id(request.query["track_id"])
+        if track is None :
+            return web.json_response({"message": "No result"}, status=404)
+
+        return web.json_response(self._qobuz_track(track))
+
+    async def _qobuz_file_url(self, request: web.Request) -> web.Response :
+
+        track_id = request.query["track_id"]
+        if (track_id != QOBUZ_SECRET_TEST_ID) and (self._by_qobuz_id(track_id) is None) :
+            return web.json_response({"message": "No result"}, status=404)
+
+        return web.json_response({"url": f"{self.base_url}/qobuz/files/{track_id}.flac", "restrictions": []})
+
+    async def _qobuz_track_search(self, request: web.Request) -> web.Response :
+
+        query = request.query["query"]
+        found = [self._qobuz_track(t) for t in self.catalogue
+                 if t.on_qobuz and ((query == t.isrc) or (query == f"{t.title} {t.artist}"))]
+
+        return web.json_response(self._page("tracks", found[:1]))
+
+    async def _qobuz_album_search(self, request: web.Request) -> web.Response :
+        return web.json_response(self._page("albums", []))
+
+    async def _qobuz_artist_search(self, request: web.Request) -> web.Response :
+        return web.json_response(self._page("artists", []))
+
+    async def _qobuz_album_get(self, request: web.Request) -> web.Response :
+
+        album_id = int(request.query["album_id"])
+        tracks = [self._qobuz_track(t) for t in self.catalogue if t.on_qobuz and (t.index // 10 == album_id)]
+        if not tracks :
+            return web.json_response({"message": "No result"}, status=404)
+
+        return web.json_response(tracks[0]["album"] | {"tracks": {"items": tracks, "total": len(tracks)}})
+
+    async def _qobuz_artist_page(self, request: web.Request) -> web.Response :
+
+        artist_id = int(request.query["artist_id"])
+        tracks = [self._qobuz_track(t) for t in self.catalogue if t.on_qobuz and (t.index % 10 == artist_id)]
+
+        return web.json_response({"id": artist_id,
+                                  "name": {"display": f"Artist {artist_id}"},
+                                  "top_tracks": tracks})
+
+    async def _qobuz_file(self, request: web.Request) -> web.Response :
+        return web.Response(body=self.flac, content_type="audio/flac")
+
+    # endregion
+
+    # region |---| Soundcloud
+
+    async def _soundcloud_resolve(self, request: web.Request) -> web.Response :
+        return web.json_response({"kind": "playlist", "id": SOUNDCLOUD_PLAYLIST_ID})
+
+    async def _soundcloud_playlist(self, request: web.Request) -> web.Response :
+        return web.json_response({"id": SOUNDCLOUD_PLAYLIST_ID,
+                                  "title": "Fake Soundcloud playlist",
+                                  "tracks": [self._soundcloud_track(t) for t in self.catalogue]})
+
+    async def _soundcloud_search(self, request: web.Request) -> web.Response :
+
+        query = request.query["q"]
+        found = [self._soundcloud_track(t) for t in self.catalogue if query == f"{t.title} - {t.artist}"]
+
+        return web.json_response({"collection": found[:1]})
+
+    async def _soundcloud_file(self, request: web.Request) -> web.Response :
+        return web.Response(body=self.wav, content_type="audio/wav")
+
+    # endregion
+
+    async def _cover(self, request: web.Request) -> web.Response :
+        return web.Response(body=self.cover, content_type="image/jpeg")
+
+    def make_app(self) -> web.Application :
+
+        self._rng = random.Random(self.faults.seed)
+
+        app = web.Application(middlewares=[self._faults])
+        app.router.add_post("/spotify/token", self._spotify_token)
+        app.router.add_get(f"/spotify/v1/playlists/{SPOTIFY_PLAYLIST_ID}", self._spotify_playlist)
+        app.router.add_get(f"/spotify/v1/playlists/{SPOTIFY_PLAYLIST_ID}/items", self._spotify_playlist_items)
+        app.router.add_get("/qobuz/api.json/0.2/user/login", self._qobuz_login)
+        app.router.add_get("/qobuz/api.json/0.2/track/get", self._qobuz_track_get)
+        app.router.add_get("/qobuz/api.json/0.2/track/getFileUrl", self._qobuz_file_url)
+        app.router.add_get("/qobuz/api.json/0.2/track/search", self._qobuz_track_search)
+        app.router.add_get("/qobuz/api.json/0.2/album/search", self._qobuz_album_search)
+        app.router.add_get("/qobuz/api.json/0.2/artist/search", self._qobuz_artist_search)
+        app.router.add_get("/qobuz/api.json/0.2/album/get", self._qobuz_album_get)
+        app.router.add_get("/qobuz/api.json/0.2/artist/page", self._qobuz_artist_page)
+        app.router.add_get("/qobuz/files/{name}", self._qobuz_file)
+        app.router.add_get("/soundcloud/resolve", self._soundcloud_resolve)
+        app.router.add_get(f"/soundcloud/playlists/{SOUNDCLOUD_PLAYLIST_ID}", self._soundcloud_playlist)
+        app.router.add_get("/soundcloud/search/tracks", self._soundcloud_search)
+        app.router.add_get("/soundcloud/files/{name}", self._soundcloud_file)
+        app.router.add_get("/covers/{name}", self._cover)
+
+        return app
+
+# endregion
+
+
+# region Server
+
+class FakeServicesServer :
+    """
+    Serves `services` on a free local port, from a background thread, as long as the context is open.
+    """
+
+    def __init__(self, services: FakeServices) -> None :
+        self.services = services
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._runner = None
+
+    async def _start(self) -> str :
+
+        self._runner = web.AppRunner(self.services.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+
+        host, port = self._runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> FakeServices :
+
+        self._thread.start()
+        self.services.base_url = asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+        return self.services
+
+    def __exit__(self, *_) -> None :
+
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+        return
+
+# endregion
@@ -0,0 +1,295 @@
+"""
+Benchmarks of the convert, tag and scan hot paths on synthetic libraries.
+
+    python -m benchmarks.hot_paths --tracks 1000
+    python -m benchmarks.hot_paths --tracks 1000 --save-baseline
+
+Each stage runs in its own process, on a fresh copy of the library, so that peak RSS is measured per stage.
+Throughput and peak RSS are compared to `baseline.json` (same number of tracks), regressions make the run fail.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+from typing import Callable
+import numpy as np
+from mutagen.aiff import AIFF
+from mutagen.flac import FLAC
+from mutagen.id3 import TXXX
+from src.features import database
+from src.features.convert import (
+    _convert_to_xxx,
+    sanitize_metadata,
+    convert_batch_to_aiff,
+    convert_batch_to_mp3,
+    convert_batch_to_formats,
+    shutdown_conversion_pools,
+)
+from src.features.rip import tag_track_id
+from src.features.update import (
+    scan_playlist,
+    remove_deleted_tracks,
+)
+
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_TOLERANCE = 0.25 # Slower or bigger by more than 25% is a regression
+REMOVED_RATIO = 0.1 # Share of the playlist removed by the clean stage
+SAMPLE_RATE = 44100
+
+# region Library
+
+def _isrc(i: int) -> str :
+    return f"BENCH{i:07d}"
+
+
+def make_source_flac(folder: Path, duration: float) -> Path :
+    """
+    Stereo white noise, 16 bits.
+    """
+
+    samples = (np.random.default_rng(0).uniform(-0.5, 0.5, (int(duration * SAMPLE_RATE), 2)) * 32767).astype("<i2")
+
+    wav_path = folder / "source.wav"
+    with wave.open(str(wav_path), "wb") as f :
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.tobytes())
+
+    flac_path = _convert_to_xxx(".flac", wav_path, folder)
+    os.remove(wav_path)
+
+    return flac_path
+
+
+def make_flac_library(source: Path, folder: Path, tracks: int) -> None :
+    """
+    Tagged like Qobuz downloads, with metadata sanitize_metadata has to fix.
+    """
+
+    os.makedirs(folder, exist_ok=True)
+
+    for i in range(tracks) :
+        track = folder / f"{i:05d} - Track {i}.flac"
+        shutil.copy(source, track)
+
+        song_data = FLAC(track)
+        song_data["TITLE"] = f"Track {i} – ☆"
+        song_data["ARTIST"] = "Bench Artist"
+        song_data["ISRC"] = _isrc(i)
+        song_data["description"] = "A long description " * 20
+        song_data.save()
+
+    return
+
+
+def make_aiff_library(source: Path, folder: Path, tracks: int) -> None :
+    """
+    Tagged like converted tracks.
+    """
+
+    os.makedirs(folder, exist_ok=True)
+
+    aiff_source = _convert_to_xxx(".aiff", source, source.parent)
+    for i in range(tracks) :
+        track = folder / f"{i:05d} - Track {i}.aiff"
+        shutil.copy(aiff_source, track)
+
+        song_data = AIFF(track)
+        if song_data.tags is None :
+            song_data.add_tags()
+        song_data.tags.add(TXXX(encoding=3, desc="COMMENT", text=_isrc(i)))
+        song_data.save()
+
+    os.remove(aiff_source)
+
+    return
+
+# endregion
+
+
+# region Stages
+
+def _tag(workdir: Path, tracks: int, jobs: int|None) -> None :
+    for song in (workdir / "FLAC").iterdir() :
+        tag_track_id(song, _isrc(int(song.name[:5])))
+
+
+def _sanitize(workdir: Path, tracks: int, jobs: int|None) -> None :
+    for song in (workdir / "FLAC").iterdir() :
+        sanitize_metadata(song)
+
+
+def _convert_aiff(workdir: Path, tracks: int, jobs: int|None) -> None :
+    convert_batch_to_aiff(workdir / "FLAC", [".flac"], workdir / "AIFF", jobs)
+
+
+def _convert_mp3(workdir: Path, tracks: int, jobs: int|None) -> None :
+    convert_batch_to_mp3(workdir / "FLAC", [".flac"], workdir / "MP3", jobs)
+
+
+def _convert_formats(workdir: Path, tracks: int, jobs: int|None) -> None :
+    convert_batch_to_formats(workdir / "FLAC", [".flac"], {".aiff": workdir / "AIFF", ".mp3": workdir / "MP3"}, jobs)
+
+
+def _scan_cold(workdir: Path, tracks: int, jobs: int|None) -> None :
+    scan_playlist(workdir / "playlist" / "AIFF")
+
+
+def _scan_warm(workdir: Path, tracks: int, jobs: int|None) -> None :
+    scan_playlist(workdir / "playlist" / "AIFF")
+
+
+def _clean(workdir: Path, tracks: int, jobs: int|None) -> None :
+    remove_deleted_tracks(workdir / "playlist", {_isrc(i) for i in range(int(tracks * REMOVED_RATIO))})
+
+
+# Stage: (run, library it needs, is the index built beforehand)
+STAGES: dict[str, tuple[Callable[[Path, int, int|None], None], str, bool]] = {
+    "tag": (_tag, "flac", False),
+    "sanitize": (_sanitize, "flac", False),
+    "convert_aiff": (_convert_aiff, "flac", False),
+    "convert_mp3": (_convert_mp3, "flac", False),
+    "convert_formats": (_convert_formats, "flac", False),
+    "scan_cold": (_scan_cold, "aiff", False),
+    "scan_warm": (_scan_warm, "aiff", True),
+    "clean": (_clean, "aiff", True),
+}
+
+# endregion
+
+
+# region Run
+
+def _run_stage(stage: str, workdir: Path, tracks: int, jobs: int|None, results: multiprocessing.Queue) -> None :
+    """
+    Runs in a fresh process.
+    """
+
+    database.DATABASE_PATH = workdir / "cabot.db"
+
+    run, _, indexed = STAGES[stage]
+    if indexed :
+        scan_playlist(workdir / "playlist" / "AIFF")
+
+    start = time.perf_counter()
+    run(workdir, tracks, jobs)
+    duration = time.perf_counter() - start
+
+    shutdown_conversion_pools()
+    database.close_connections()
+
+    # Max resident set of this process and of its workers (ffmpeg...), in kB on Linux
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    results.put((duration, peak_rss))
+
+    return
+
+
+def benchmark_stage(stage: str, source: Path, root: Path, tracks: int, jobs: int|None) -> dict[str, float] :
+
+    workdir = root / stage
+    _, library, _ = STAGES[stage]
+    if library == "flac" :
+        make_flac_library(source, workdir / "FLAC", tracks)
+    else :
+        make_aiff_library(source, workdir / "playlist" / "AIFF", tracks)
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_run_stage, args=(stage, workdir, tracks, jobs, results))
+    process.start()
+    duration, peak_rss = results.get()
+    process.join()
+
+    shutil.rmtree(workdir)
+
+    return {
+        "seconds": round(duration, 3),
+        "tracks_per_second": round(tracks / duration, 2),
+        "peak_rss_mb": round(peak_rss / 1024, 1),
+    }
+
+
+def find_regressions(
+        results: dict[str, dict[str, float]],
+        baseline: dict[str, dict[str, float]],
+        tolerance: float=DEFAULT_TOLERANCE) -> list[str] :
+
+    regressions = []
+    for stage, result in results.items() :
+
+        if stage not in baseline :
+            continue
+
+        reference = baseline[stage]
+        if result["tracks_per_second"] < reference["tracks_per_second"] * (1 - tolerance) :
+            regressions.append(f"{stage} : {result['tracks_per_second']} tracks/s (baseline {reference['tracks_per_second']})")
+        if result["peak_rss_mb"] > reference["peak_rss_mb"] * (1 + tolerance) :
+            regressions.append(f"{stage} : {result['peak_rss_mb']} MB peak RSS (baseline {reference['peak_rss_mb']})")
+
+    return regressions
+
+
+def parse_arguments() -> argparse.Namespace :
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.hot_paths", description="Benchmark the convert, tag and scan hot paths.")
+    parser.add_argument("--tracks", type=int, default=100, help="Size of the synthetic library (100 to 10000 tracks).")
+    parser.add_argument("--duration", type=float, default=10., help="Duration of each synthetic track, in seconds.")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of parallel conversions (defaults to the number of cores).")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES), help="Stages to run.")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="Baseline to compare to.")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the baseline for this number of tracks.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Tolerated slow down / memory increase before reporting a regression.")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__' :
+
+    arguments = parse_arguments()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="cabot_bench_") as root :
+
+        root = Path(root)
+        source = make_source_flac(root, arguments.duration)
+
+        for stage in arguments.stages :
+            print(f"Benchmarking {stage}...", end="\r")
+            results[stage] = benchmark_stage(stage, source, root, arguments.tracks, arguments.jobs)
+            print(f"{stage:<16} {results[stage]['seconds']:>9.2f} s {results[stage]['tracks_per_second']:>10.1f} tracks/s {results[stage]['peak_rss_mb']:>8.1f} MB")
+
+    baselines = json.loads(arguments.baseline.read_text()) if arguments.baseline.exists() else {}
+    key = str(arguments.tracks)
+
+    if arguments.save_baseline :
+        baselines[key] = baselines.get(key, {}) | results
+        arguments.baseline.write_text(json.dumps(baselines, indent=4))
+        print(f"Baseline saved to {arguments.baseline}.")
+        sys.exit(0)
+
+    if key not in baselines :
+        print(f"No baseline for {arguments.tracks} tracks.")
+        sys.exit(0)
+
+    regressions = find_regressions(results, baselines[key], arguments.tolerance)
+    if regressions :
+        print("Regressions :")
+        for regression in regressions :
+            print(f"   -> {regression}")
+        sys.exit(1)
+
+    print("No regression.")
+
+# endregion
@@ -0,0 +1,232 @@
+"""
+Full synchronization of a synthetic playlist against the local stand-in services (see `fake_services.py`).
+
+    python -m benchmarks.load --tracks 200 --latency 0.05 --throttle-rate 0.05 --missing-ratio 0.1
+
+Nothing reaches Spotify, Qobuz nor Soundcloud : their base URLs are redirected to the stand-ins for the run.
+"""
+import argparse
+import dataclasses
+import json
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from types import MappingProxyType
+from unittest import mock
+import aiohttp
+import streamrip.client.qobuz
+import streamrip.client.soundcloud
+from ffmpeg import FFmpeg
+from spotipy import Spotify
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials
+from streamrip.client.qobuz import QobuzClient
+from streamrip.client.soundcloud import SoundcloudClient
+from src.features import database, rip
+from src.features.config import (
+    DEFAULT_CABOT_CONFIG_PATH,
+    load_cabot_config,
+)
+from src.features.convert import shutdown_conversion_pools
+from src.features.scheduler import (
+    QOBUZ_SCHEDULER,
+    SOUNDCLOUD_SCHEDULER,
+)
+from src.features.trace import TRACER
+from src.features.update import update_playlists
+from .fake_services import (
+    SPOTIFY_PLAYLIST_ID,
+    FakeServices,
+    FakeServicesServer,
+    FaultConfig,
+    make_catalogue,
+)
+from .hot_paths import make_source_flac
+
+
+# region Media
+
+def make_media(folder: Path, duration: float) -> tuple[bytes, bytes, bytes] :
+    """
+    Returns the FLAC, WAV and JPEG cover served by the stand-ins.
+    """
+
+    flac_path = make_source_flac(folder, duration)
+
+    wav_path = folder / "source.wav"
+    FFmpeg().option("y").input(str(flac_path)).output(str(wav_path)).execute()
+
+    cover_path = folder / "cover.jpg"
+    FFmpeg().option("y").input("color=c=gray:s=64x64", f="lavfi").output(str(cover_path), vframes=1).execute()
+
+    return flac_path.read_bytes(), wav_path.read_bytes(), cover_path.read_bytes()
+
+# endregion
+
+
+# region Redirections
+
+def redirect_to(base_url: str) -> ExitStack :
+    """
+    Points every client cabot uses to the stand-ins.
+    """
+
+    class FakeSpotify(Spotify) :
+        def __init__(self, *args, **kwargs) -> None :
+            super().__init__(*args, **kwargs)
+            self.prefix = f"{base_url}/spotify/v1/"
+
+    class FakeSpotifyClientCredentials(SpotifyClientCredentials) :
+        OAUTH_TOKEN_URL = f"{base_url}/spotify/token"
+
+        def __init__(self, *args, **kwargs) -> None :
+            # The fake token must not end up in spotipy's `.cache` file
+            super().__init__(*args, cache_handler=MemoryCacheHandler(), **kwargs)
+
+    async def _fake_app_id_and_secrets(self) -> tuple[str, list[str]] :
+        return "123456789", ["fakesecret"]
+
+    async def _fake_soundcloud_tokens(self) -> tuple[str, str] :
+        return "fakeclientid", "1"
+
+    async def _fake_announce_success(self) -> bool :
+        return True
+
+    async def _fake_download(url: str, audioFormat: str, filenameStyle: str, folder_path: str) -> Path :
+        """
+        Stands in for pybalt.
+        """
+
+        path = Path(folder_path) / f"{url.rsplit('/', 1)[-1]}"
+        async with aiohttp.ClientSession() as session :
+            async with session.get(url) as response :
+                response.raise_for_status()
+                path.write_bytes(await response.read())
+
+        return path
+
+    stack = ExitStack()
+    stack.enter_context(mock.patch.object(rip, "Spotify", FakeSpotify))
+    stack.enter_context(mock.patch.object(rip, "SpotifyClientCredentials", FakeSpotifyClientCredentials))
+    stack.enter_context(mock.patch.object(streamrip.client.qobuz, "QOBUZ_BASE_URL", f"{base_url}/qobuz/api.json/0.2"))
+    stack.enter_context(mock.patch.object(QobuzClient, "_get_app_id_and_secrets", _fake_app_id_and_secrets))
+    stack.enter_context(mock.patch.object(streamrip.client.soundcloud, "BASE", f"{base_url}/soundcloud"))
+    stack.enter_context(mock.patch.object(SoundcloudClient, "_refresh_tokens", _fake_soundcloud_tokens))
+    stack.enter_context(mock.patch.object(SoundcloudClient, "_announce_success", _fake_announce_success))
+    stack.enter_context(mock.patch.object(rip, "download", _fake_download))
+
+    return stack
+
+# endregion
+
+
+# region Run
+
+def run_load(
+        root: Path,
+        tracks: int,
+        faults: FaultConfig=FaultConfig(),
+        missing_ratio: float=0.,
+        duration: float=1.,
+        source: str="spotify",
+        **overrides) -> dict :
+    """
+    Synchronizes a synthetic playlist of `tracks` tracks (from `source`) into `root`.
+    `overrides` are passed to the config (jobs, max_api_requests...).
+    Returns the run statistics.
+    """
+
+    catalogue = make_catalogue(tracks, missing_ratio, faults.seed)
+    services = FakeServices(catalogue, *make_media(root, duration), faults=faults)
+
+    with FakeServicesServer(services), redirect_to(services.base_url), ExitStack() as stack :
+
+        stack.enter_context(mock.patch.object(database, "DATABASE_PATH", root / "cabot.db"))
+        stack.enter_context(mock.patch.dict(rip._CACHE_SPOTIFY_PLAYLIST, clear=True))
+        stack.enter_context(mock.patch.dict(rip._CACHE_SOUNDCLOUD_PLAYLIST, clear=True))
+
+        url = {"spotify": f"https://open.spotify.com/playlist/{SPOTIFY_PLAYLIST_ID}",
+               "soundcloud": f"{services.base_url}/soundcloud/fake-playlist"}[source]
+
+        cabot_config = load_cabot_config(DEFAULT_CABOT_CONFIG_PATH,
+                                         tmp_folder=root / "tmp",
+                                         playlists_folder=root / "playlists",
+                                         **overrides)
+        cabot_config = dataclasses.replace(cabot_config,
+                                           qobuz_email="fake",
+                                           qobuz_token="fake",
+                                           spotify_client_id="fake",
+                                           spotify_client_secret="fake",
+                                           playlists=MappingProxyType({"load": MappingProxyType({source: url})}))
+
+        retries = QOBUZ_SCHEDULER.retries + SOUNDCLOUD_SCHEDULER.retries
+        TRACER.clear()
+
+        start = time.perf_counter()
+        try :
+            update_playlists(cabot_config)
+        finally :
+            shutdown_conversion_pools()
+            database.close_connections()
+        seconds = time.perf_counter() - start
+
+    playlist_path = root / "playlists" / "load"
+    synchronized = len(list((playlist_path / "AIFF").glob("*.aiff")))
+    fallback = len(list((playlist_path / "fallback" / "AIFF").glob("*.aiff")))
+
+    return {
+        "tracks": tracks,
+        "synchronized": synchronized,
+        "fallback": fallback,
+        "seconds": round(seconds, 2),
+        "tracks_per_second": round((synchronized + fallback) / seconds, 2),
+        "requests": {f"{service}/{endpoint}": count for (service, endpoint), count in sorted(services.requests.items())},
+        "statuses": dict(services.statuses),
+        "retries": QOBUZ_SCHEDULER.retries + SOUNDCLOUD_SCHEDULER.retries - retries,
+    }
+
+
+def parse_arguments() -> argparse.Namespace :
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load", description="Synchronize a synthetic playlist against local stand-in services.")
+    parser.add_argument("--tracks", type=int, default=100, help="Number of tracks of the playlist.")
+    parser.add_argument("--source", choices=["spotify", "soundcloud"], default="spotify", help="Source of the playlist.")
+    parser.add_argument("--duration", type=float, default=10., help="Duration of each track, in seconds.")
+    parser.add_argument("--missing-ratio", type=float, default=0., help="Share of the tracks missing from Qobuz (found on Soundcloud).")
+    parser.add_argument("--latency", type=float, default=0., help="Latency of every API request, in seconds.")
+    parser.add_argument("--jitter", type=float, default=0., help="Random extra latency, in seconds.")
+    parser.add_argument("--error-rate", type=float, default=0., help="Share of API requests failing with 503.")
+    parser.add_argument("--throttle-rate", type=float, default=0., help="Share of API requests throttled with 429.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of parallel conversions.")
+    parser.add_argument("--max-api-requests", type=int, default=None, help="Maximum concurrent API requests.")
+    parser.add_argument("--max-downloads", type=int, default=None, help="Maximum concurrent downloads.")
+    parser.add_argument("--trace", type=Path, metavar="PATH", default=None, help="Write the timing spans of the run to PATH.")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__' :
+
+    arguments = parse_arguments()
+
+    faults = FaultConfig(arguments.latency, arguments.jitter, arguments.error_rate, arguments.throttle_rate, arguments.seed)
+    with tempfile.TemporaryDirectory(prefix="cabot_load_") as root :
+        stats = run_load(Path(root),
+                         arguments.tracks,
+                         faults,
+                         arguments.missing_ratio,
+                         arguments.duration,
+                         arguments.source,
+                         jobs=arguments.jobs,
+                         max_api_requests=arguments.max_api_requests,
+                         max_downloads=arguments.max_downloads)
+
+    print(json.dumps(stats, indent=4))
+    print("")
+    TRACER.print_summary()
+    if arguments.trace is not None :
+        TRACER.export(arguments.trace)
+
+# endregion
@@ -5,11 +5,6 @@ CWD=$(pwd)
 SCRIPT_DIR="$(dirname "$(readlink -f "$0")")"
 cd $SCRIPT_DIR 
 
-playlists=""
-for arg in "$@"; do
-    playlists="$playlists;$arg"
-done
-
-python -m src.main $playlists
+python -m src.main "$@"
 
 cd $CWD
\ No newline at end of file
@@ -2,8 +2,9 @@ import shutil
 from pathlib import Path
 import json
 import toml
-from streamrip.config import DEFAULT_CONFIG_PATH
-from typing import Any
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Callable, Mapping
 
 # region Utils
 def get_project_root() -> Path :
@@ -21,31 +22,159 @@ def get_project_root() -> Path :
 CABOT = get_project_root()
 DEFAULT_CABOT_CONFIG_PATH = CABOT / "default_config.json"
 CONFIG_PATH = CABOT / "config.json"
-CONFIG_CORRESPONDANCE = {
-    ("qobuz", "email"): ("qobuz", "email_or_userid"),
-    ("qobuz", "token"): ("qobuz", "password_or_token"),
-    ("tmp_folder",): ("downloads", "folder")
-}
+
+DEFAULT_RESOLUTION_TTL_DAYS = 30
+DEFAULT_MISSING_RECHECK_DAYS = 7
+DEFAULT_SOUNDCLOUD_CONCURRENCY = 4
+DEFAULT_SOUNDCLOUD_TIMEOUT = 300 # seconds
+DEFAULT_MAX_API_REQUESTS = 25
+DEFAULT_MAX_DOWNLOADS = 6
 
 # endregion
 
 
 # region Cabot
-def get_cabot_config_value(keys: list[str]) -> Any :
+@dataclass(frozen=True)
+class CabotConfig :
+    """
+    Validated snapshot of `config.json` (and CLI overrides), loaded once per run.
+    """
+
+    qobuz_email: str
+    qobuz_token: str
+    qobuz_quality: int
+    spotify_client_id: str
+    spotify_client_secret: str
+    tmp_folder: Path
+    playlists_folder: Path
+    mp3_copy: bool
+    playlists: Mapping[str, Mapping[str, str]]
+    analyse_key: bool = True
+    resolution_cache_ttl_days: float = DEFAULT_RESOLUTION_TTL_DAYS
+    missing_recheck_days: float = DEFAULT_MISSING_RECHECK_DAYS
+    soundcloud_concurrency: int = DEFAULT_SOUNDCLOUD_CONCURRENCY
+    soundcloud_timeout: float = DEFAULT_SOUNDCLOUD_TIMEOUT
+    jobs: int|None = None
+    parallel: int = 1
+    max_api_requests: int = DEFAULT_MAX_API_REQUESTS
+    max_downloads: int = DEFAULT_MAX_DOWNLOADS
+    metrics_file: Path|None = None
+    metrics_port: int|None = None
+
+
+# region |---| Parsers
+def _parse_bool(value: Any) -> bool :
+
+    # Older configs store booleans as strings, and bool("False") is True
+    if isinstance(value, str) :
+        assert value.lower() in ("true", "false"), f"{value} is not a boolean."
+        return value.lower() == "true"
+
+    assert isinstance(value, bool), f"{value} is not a boolean."
+
+    return value
+
+
+def _parse_folder(value: Any) -> Path :
+    assert str(value), "Folders can't be empty, please fill `config.json` correctly."
+    return Path(value)
+
+
+def _parse_positive(parse: Callable[[Any], Any]) -> Callable[[Any], Any] :
+
+    def _parse(value: Any) -> Any :
+        value = parse(value)
+        assert value > 0, f"{value} should be positive."
+        return value
+
+    return _parse
+
+
+def _parse_optional(parse: Callable[[Any], Any]) -> Callable[[Any], Any] :
+    return lambda value: None if value is None else parse(value)
+
+
+def _parse_playlists(value: Any) -> Mapping[str, Mapping[str, str]] :
+
+    assert isinstance(value, dict), "`playlists` should map playlist names to their sources."
+    for playlist, sources in value.items() :
+        assert isinstance(sources, dict) and sources, f"{playlist} has no source."
+        for source in sources :
+            assert source in ("spotify", "soundcloud"), f"{playlist} : unknown source {source}."
+
+    return MappingProxyType({playlist: MappingProxyType(dict(sources)) for playlist, sources in value.items()})
+
+# endregion
+
+
+_NO_DEFAULT = object()
+_CONFIG_FIELDS = {
+    # Field: (keys in config.json, parser, default)
+    "qobuz_email": (["qobuz", "email"], str, _NO_DEFAULT),
+    "qobuz_token": (["qobuz", "token"], str, _NO_DEFAULT),
+    "qobuz_quality": (["qobuz", "quality"], int, _NO_DEFAULT),
+    "spotify_client_id": (["spotify", "client_id"], str, _NO_DEFAULT),
+    "spotify_client_secret": (["spotify", "client_secret"], str, _NO_DEFAULT),
+    "tmp_folder": (["tmp_folder"], _parse_folder, _NO_DEFAULT),
+    "playlists_folder": (["playlists_folder"], _parse_folder, _NO_DEFAULT),
+    "mp3_copy": (["mp3_copy"], _parse_bool, _NO_DEFAULT),
+    "playlists": (["playlists"], _parse_playlists, _NO_DEFAULT),
+    "analyse_key": (["analyse_key"], _parse_bool, True),
+    "resolution_cache_ttl_days": (["resolution_cache_ttl_days"], float, DEFAULT_RESOLUTION_TTL_DAYS),
+    "missing_recheck_days": (["missing_recheck_days"], float, DEFAULT_MISSING_RECHECK_DAYS),
+    "soundcloud_concurrency": (["soundcloud_concurrency"], _parse_positive(int), DEFAULT_SOUNDCLOUD_CONCURRENCY),
+    "soundcloud_timeout": (["soundcloud_timeout"], _parse_positive(float), DEFAULT_SOUNDCLOUD_TIMEOUT),
+    "jobs": (["jobs"], _parse_optional(_parse_positive(int)), None),
+    "parallel": (["parallel"], _parse_positive(int), 1),
+    "max_api_requests": (["max_api_requests"], _parse_positive(int), DEFAULT_MAX_API_REQUESTS),
+    "max_downloads": (["max_downloads"], _parse_positive(int), DEFAULT_MAX_DOWNLOADS),
+    "metrics_file": (["metrics", "file"], _parse_optional(Path), None),
+    "metrics_port": (["metrics", "port"], _parse_optional(_parse_positive(int)), None),
+}
+
+
+def _get_value(config_data: dict, keys: list[str], default: Any) -> Any :
+    """
+    `default` is returned for missing optional keys, missing keys are an error otherwise.
+    """
 
-    with open(CONFIG_PATH, 'r') as f :
-        config_data = json.load(f)
-    
     tmp_dict_or_value = config_data
     for key in keys :
         assert isinstance(tmp_dict_or_value, dict)
-        assert key in tmp_dict_or_value
+        if (key not in tmp_dict_or_value) and (default is not _NO_DEFAULT) :
+            return default
+        assert key in tmp_dict_or_value, f"`{'.'.join(keys)}` is missing, please fill `config.json` correctly."
         tmp_dict_or_value = tmp_dict_or_value[key]
 
     return tmp_dict_or_value
 
 
-def set_cabot_config_value(keys: list[str], value: str) -> None :
+def load_cabot_config(path: Path|None=None, **overrides: Any) -> CabotConfig :
+    """
+    Reads and validates `config.json` once.
+    `overrides` (CLI options) replace the matching fields, unless None.
+    """
+
+    unknown = set(overrides) - set(_CONFIG_FIELDS)
+    assert not unknown, f"Unknown config fields : {', '.join(sorted(unknown))}."
+
+    with open(path or CONFIG_PATH, 'r') as f :
+        config_data = json.load(f)
+
+    values = {}
+    for field, (keys, parse, default) in _CONFIG_FIELDS.items() :
+
+        if overrides.get(field) is not None :
+            value = overrides[field]
+        else :
+            value = _get_value(config_data, keys, default)
+
+        values[field] = value if value is None else parse(value)
+
+    return CabotConfig(**values)
+
+
+def set_cabot_config_value(keys: list[str], value: Any) -> None :
 
     with open(CONFIG_PATH, 'r') as f :
         config_data = json.load(f)
@@ -67,40 +196,61 @@ def set_cabot_config_value(keys: list[str], value: str) -> None :
 # endregion
 
 # region streamrip
-def set_streamrip_config_value(region: str, key: str, value: str) -> None :
+STREAMRIP_CONFIG_CORRESPONDANCE = {
+    "qobuz_email": ("qobuz", "email_or_userid"),
+    "qobuz_token": ("qobuz", "password_or_token"),
+    "tmp_folder": ("downloads", "folder"),
+}
 
-    config_data = toml.load(DEFAULT_CONFIG_PATH)
-    
-    if region not in config_data :
-        config_data[region] = {}
-    config_data[region][key] = value
-    
-    with open(DEFAULT_CONFIG_PATH, 'w') as f :
-        toml.dump(config_data, f)
-    
-    return
 
+def get_streamrip_config_path() -> Path :
 
-def apply_cabot_config_to_streamrip() -> None :
+    # Importing streamrip takes most of the startup time, only do it when needed
+    from streamrip.config import DEFAULT_CONFIG_PATH
 
-    for cabot_keys, (rip_region, rip_key) in CONFIG_CORRESPONDANCE.items() :
-        value = get_cabot_config_value(cabot_keys)
-        set_streamrip_config_value(rip_region, rip_key, value)
+    return Path(DEFAULT_CONFIG_PATH)
 
-    return
+
+def apply_cabot_config_to_streamrip(config: CabotConfig) -> bool :
+    """
+    Only rewrites streamrip's config when a mapped value changed.
+    Returns whether it was rewritten.
+    """
+
+    values = {(rip_region, rip_key): getattr(config, field) for field, (rip_region, rip_key) in STREAMRIP_CONFIG_CORRESPONDANCE.items()}
+    values[("qobuz", "use_auth_token")] = True
+
+    streamrip_config_path = get_streamrip_config_path()
+    config_data = toml.load(streamrip_config_path)
+
+    changed = False
+    for (rip_region, rip_key), value in values.items() :
+
+        value = str(value) if isinstance(value, Path) else value
+        if rip_region not in config_data :
+            config_data[rip_region] = {}
+
+        if config_data[rip_region].get(rip_key) != value :
+            config_data[rip_region][rip_key] = value
+            changed = True
+
+    if changed :
+        with open(streamrip_config_path, 'w') as f :
+            toml.dump(config_data, f)
+
+    return changed
 
 # endregion 
 
 
 # region default
-def initialize_config() -> None :
-    apply_cabot_config_to_streamrip()
-    set_streamrip_config_value("qobuz", "use_auth_token", "true")
+def initialize_config(config: CabotConfig) -> None :
+    apply_cabot_config_to_streamrip(config)
 
 def set_default_config() -> None :
     shutil.copy(DEFAULT_CABOT_CONFIG_PATH, CONFIG_PATH)
     set_cabot_config_value(["tmp_folder"], str(CABOT / "tmp_download"))
-    set_cabot_config_value(["mp3_copy"], "True")
-    initialize_config()
+    set_cabot_config_value(["mp3_copy"], True)
+    initialize_config(load_cabot_config())
 
 # endregion
@@ -1,7 +1,76 @@
 from ffmpeg import FFmpeg
 from pathlib import Path
+import io
 import os
+import time
+import struct
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import soundfile
+from mutagen import id3
+from mutagen.aiff import AIFF
 from mutagen.flac import FLAC
+from .trace import TRACER
+from .metrics import CONVERSION_SECONDS
+
+
+_CONVERSION_POOLS: dict[int, ProcessPoolExecutor] = {}
+_CONVERSION_POOLS_LOCK = threading.Lock()
+
+AIFF_BLOCK_FRAMES = 1 << 16
+
+# FFmpeg's mapping of the Vorbis comments to ID3v2.4 frames, the other comments end up in TXXX frames
+ID3_FRAME_BY_VORBIS_KEY = {
+    "TITLE": "TIT2",
+    "ARTIST": "TPE1",
+    "ALBUM": "TALB",
+    "ALBUMARTIST": "TPE2",
+    "ALBUM_ARTIST": "TPE2",
+    "COMPOSER": "TCOM",
+    "DATE": "TDRC",
+    "GENRE": "TCON",
+    "TRACKNUMBER": "TRCK",
+    "TRACK": "TRCK",
+    "DISCNUMBER": "TPOS",
+    "DISC": "TPOS",
+    "COPYRIGHT": "TCOP",
+    "LANGUAGE": "TLAN",
+    "PUBLISHER": "TPUB",
+    "PERFORMER": "TPE3",
+    "GROUPING": "TIT1",
+    "ENCODED_BY": "TENC",
+}
+# Text frames FFmpeg writes as is when they are used as Vorbis keys
+ID3_TEXT_FRAMES = {
+    "TALB", "TBPM", "TCOM", "TCON", "TCOP", "TDEN", "TDLY", "TDOR", "TDRC", "TDRL", "TDTG", "TENC", "TEXT", "TFLT",
+    "TIPL", "TIT1", "TIT2", "TIT3", "TKEY", "TLAN", "TLEN", "TMCL", "TMED", "TMOO", "TOAL", "TOFN", "TOLY", "TOPE",
+    "TOWN", "TPE1", "TPE2", "TPE3", "TPE4", "TPOS", "TPRO", "TPUB", "TRCK", "TRSN", "TRSO", "TSOA", "TSOP", "TSOT",
+    "TSRC", "TSST",
+}
+# Renamed by FFmpeg to ID3v2.3 frames, that ID3v2.4 lacks, hence TXXX
+ID3_TXXX_BY_VORBIS_KEY = {
+    "COMPILATION": "TCMP",
+    "LYRICS": "USLT",
+}
+# Dropped by FFmpeg (DESCRIPTION is its generic comment, ENCODER is replaced by its own)
+IGNORED_VORBIS_KEYS = {"DESCRIPTION", "ENCODER", "CREATION_TIME"}
+
+
+def sanitize_flac_tags(mutagen_audio: FLAC) -> None :
+    """
+    In place, saving is up to the caller.
+    """
+
+    for k, l in mutagen_audio.items().copy() :
+        mutagen_audio[k.upper()] = [v.encode("latin-1", errors="ignore").decode("latin-1", errors="replace")
+                                    for v in l]
+    
+    # 'description' metadata field is causing a tone of issues and is useless anyway
+    if "description" in mutagen_audio :
+        mutagen_audio["DESCRIPTION"] = ""
+
+    return
 
 
 def sanitize_metadata(song: Path) -> None :
@@ -11,69 +80,335 @@ def sanitize_metadata(song: Path) -> None :
     if song.suffix == ".flac" :
 
         mutagen_audio = FLAC(song)
-
-        for k, l in mutagen_audio.items().copy() :
-            mutagen_audio[k.upper()] = [v.encode("latin-1", errors="ignore").decode("latin-1", errors="replace")
-                                        for v in l]
-        
-        # 'description' metadata field is causing a tone of issues and is useless anyway
-        if "description" in mutagen_audio :
-            mutagen_audio["DESCRIPTION"] = ""
-        
+        sanitize_flac_tags(mutagen_audio)
         mutagen_audio.save()
     
     return
 
 
+# region Pool
+
+def default_jobs() -> int :
+    return os.cpu_count() or 1
+
+
+def get_conversion_pool(jobs: int|None=None) -> ProcessPoolExecutor :
+    """
+    Worker pools are kept alive for the whole run, so they are shared by every batch.
+    Workers are spawned rather than forked : the run is multithreaded by then (playlists, conversion pipeline,
+    event loops), and forking a multithreaded process can deadlock the child.
+    """
+
+    jobs = jobs or default_jobs()
+
+    with _CONVERSION_POOLS_LOCK :
+        if jobs not in _CONVERSION_POOLS :
+            _CONVERSION_POOLS[jobs] = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"))
+
+    return _CONVERSION_POOLS[jobs]
+
+
+def shutdown_conversion_pools() -> None :
+
+    with _CONVERSION_POOLS_LOCK :
+        for pool in _CONVERSION_POOLS.values() :
+            pool.shutdown()
+        _CONVERSION_POOLS.clear()
+
+    return
+
+# endregion
+
+
+# region In-process AIFF
+
+def _ieee_extended(value: int) -> bytes :
+    """
+    AIFF stores its sample rate as an 80-bit IEEE 754 extended float.
+    """
+
+    exponent = value.bit_length() - 1
+
+    return struct.pack(">HQ", 16383 + exponent, value << (63 - exponent))
+
+
+def _aiff_header(channels: int, frames: int, sample_rate: int, data_size: int) -> bytes :
+    """
+    FORM, COMM and SSND headers of a 16-bit PCM AIFF, the samples follow.
+    """
+
+    comm = struct.pack(">hIh", channels, frames, 16) + _ieee_extended(sample_rate)
+    form_size = 4 + (8 + len(comm)) + (8 + 8 + data_size)
+
+    return (struct.pack(">4sI4s", b"FORM", form_size, b"AIFF")
+            + struct.pack(">4sI", b"COMM", len(comm)) + comm
+            + struct.pack(">4sIII", b"SSND", 8 + data_size, 0, 0))
+
+
+def _id3_frames_from_flac(flac: FLAC) -> list[id3.Frame] :
+    """
+    The ID3 tags FFmpeg writes to the AIFF of `flac`, the cover being kept as is rather than re-encoded to PNG.
+    """
+
+    values_by_key: dict[str, list[str]] = {}
+    for key, value in (flac.tags or []) :
+        values_by_key.setdefault(key.upper(), []).append(value)
+
+    frames_by_id: dict[str, id3.Frame] = {}
+    for key, values in values_by_key.items() :
+
+        text = ";".join(values)
+        if (not text) or (key in IGNORED_VORBIS_KEYS) :
+            continue
+
+        frame_id = ID3_FRAME_BY_VORBIS_KEY.get(key, key if key in ID3_TEXT_FRAMES else None)
+        if frame_id is None :
+            desc = ID3_TXXX_BY_VORBIS_KEY.get(key, key)
+            frames_by_id[f"TXXX:{desc}"] = id3.TXXX(encoding=id3.Encoding.UTF8, desc=desc, text=[text])
+        else :
+            frames_by_id[frame_id] = id3.Frames[frame_id](encoding=id3.Encoding.UTF8, text=[text])
+
+    frames = list(frames_by_id.values())
+    if flac.pictures :
+        picture = flac.pictures[0]
+        frames.append(id3.APIC(encoding=id3.Encoding.UTF8, mime=picture.mime, type=picture.type, desc=picture.desc, data=picture.data))
+
+    return frames
+
+
+class _BlocksStream(io.RawIOBase) :
+    """
+    Readable stream over an iterator of byte blocks, to feed ffmpeg's stdin.
+    """
+
+    def __init__(self, blocks) -> None :
+        self._blocks = blocks
+        self._pending = b""
+
+    def readable(self) -> bool :
+        return True
+
+    def readinto(self, buffer) -> int :
+
+        while not self._pending :
+            self._pending = next(self._blocks, None)
+            if self._pending is None :
+                self._pending = b""
+                return 0
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+
+        return size
+
+
+def _flac_to_aiff(input_path: Path, output_path: Path, ffmpeg_output_paths: list[Path]|None=None) -> Path :
+    """
+    Decodes `input_path` and writes the AIFF container directly, without spawning ffmpeg.
+    Samples are the ones ffmpeg writes : 16-bit big-endian PCM, higher resolutions being truncated.
+    The decoded samples (full resolution) are piped to ffmpeg to encode `ffmpeg_output_paths` as well, the FLAC
+    only being read for its tags and cover : it is decoded once.
+    """
+
+    ffmpeg_output_paths = ffmpeg_output_paths or []
+
+    try :
+        with soundfile.SoundFile(input_path) as flac, open(output_path, "wb") as aiff :
+
+            # Frames count isn't always in STREAMINFO, the header is rewritten once the samples are
+            aiff.write(_aiff_header(flac.channels, 0, flac.samplerate, 0))
+
+            frames = 0
+            def _blocks() :
+                nonlocal frames
+                for block in flac.blocks(AIFF_BLOCK_FRAMES, dtype="int32", always_2d=True) :
+                    aiff.write((block >> 16).astype(">i2").tobytes())
+                    frames += len(block)
+                    yield block.astype("<i4").tobytes()
+
+            if ffmpeg_output_paths :
+                ffmpeg = (FFmpeg()
+                          .input("pipe:0", {"f": "s32le", "ar": flac.samplerate, "ac": flac.channels})
+                          .input(input_path))
+                for ffmpeg_output_path in ffmpeg_output_paths :
+                    ffmpeg = ffmpeg.output(ffmpeg_output_path, {"map": ["0:a", "1:v?"], "map_metadata": 1, "write_id3v2": 1})
+                ffmpeg.execute(_BlocksStream(_blocks()))
+            else :
+                for _ in _blocks() :
+                    pass
+
+            aiff.seek(0)
+            aiff.write(_aiff_header(flac.channels, frames, flac.samplerate, 2 * frames * flac.channels))
+
+        aiff_tags = AIFF(output_path)
+        aiff_tags.add_tags()
+        for frame in _id3_frames_from_flac(FLAC(input_path)) :
+            aiff_tags.tags.add(frame)
+        aiff_tags.save()
+    
+    except Exception :
+        for path in [output_path] + ffmpeg_output_paths :
+            if path.exists() :
+                os.remove(path)
+        raise
+
+    return output_path
+
+# endregion
+
+
 # region Generic
 
-def _convert_to_xxx(
-        format: str,
+def _convert_to_formats(
         input_path: Path,
-        output_folder: Path|None=None) -> Path :
+        output_folder_by_format: dict[str, Path|None],
+        sanitize: bool=True) -> list[Path] :
+    """
+    Encodes `input_path` to every requested format, ffmpeg ones in a single pass.
+    FLAC to AIFF being a mere rewrap, it is done in-process instead, the decoded samples being piped to ffmpeg
+    for the other formats : each source is decoded once.
+    Downloaded tracks are sanitized when tagged, `sanitize` is then pointless.
+    """
 
     assert input_path.is_file(), f"{input_path} n'est pas un fichier existant."
 
     file_name = input_path.stem
 
-    if output_folder :
-        output_path = output_folder / f"{file_name}{format}"
+    output_paths = []
+    for format, output_folder in output_folder_by_format.items() :
 
-        if not output_folder.is_dir() :
-            os.mkdir(output_folder)
-            
-    else :
-        output_path = input_path.parent / f"{file_name}{format}"
+        if output_folder :
+            output_path = output_folder / f"{file_name}{format}"
+
+            if not output_folder.is_dir() :
+                os.makedirs(output_folder, exist_ok=True)
+                
+        else :
+            output_path = input_path.parent / f"{file_name}{format}"
 
-    if output_path.exists() :
-        os.remove(output_path)
+        if output_path.exists() :
+            os.remove(output_path)
+        
+        output_paths.append(output_path)
     
     # Only sanitize FLAC for now, can easily add support for more format if necessary
-    sanitize_metadata(input_path)
+    if sanitize :
+        sanitize_metadata(input_path)
     
-    ffmpeg = FFmpeg().input(input_path).output(output_path, {"write_id3v2": 1})
-    
-    ffmpeg.execute()
+    ffmpeg_output_paths = [output_path for output_path in output_paths
+                           if not (input_path.suffix == ".flac" and output_path.suffix == ".aiff")]
+    in_process_output_paths = [output_path for output_path in output_paths if output_path not in ffmpeg_output_paths]
+
+    if in_process_output_paths :
+        _flac_to_aiff(input_path, in_process_output_paths[0], ffmpeg_output_paths)
+
+    elif ffmpeg_output_paths :
+        ffmpeg = FFmpeg().input(input_path)
+        for output_path in ffmpeg_output_paths :
+            ffmpeg = ffmpeg.output(output_path, {"write_id3v2": 1})
+        
+        ffmpeg.execute()
     
-    return output_path 
+    return output_paths 
 
 
-def _convert_batch_to_xxx(
+def _convert_to_xxx(
         format: str,
+        input_path: Path,
+        output_folder: Path|None=None) -> Path :
+
+    return _convert_to_formats(input_path, {format: output_folder})[0]
+
+
+def _try_convert_to_formats(
+        input_path: Path,
+        output_folder_by_format: dict[str, Path|None],
+        sanitize: bool=True) -> tuple[list[Path], str | None, tuple[int, float, float]] :
+    """
+    Errors are returned rather than raised, so one bad file doesn't abort the whole batch.
+    The worker's PID, start time and duration are returned as well, for the trace.
+    """
+
+    start = time.time()
+    counter = time.perf_counter()
+    try :
+        output_paths, error = _convert_to_formats(input_path, output_folder_by_format, sanitize), None
+    except Exception as e :
+        output_paths, error = [], f"{type(e).__name__}: {e}"
+
+    return output_paths, error, (os.getpid(), start, time.perf_counter() - counter)
+
+
+def convert_batch_to_formats(
         input_folder: Path,
         target_formats: list[str],
-        output_folder: Path|None=None) -> list[Path] :
+        output_folder_by_format: dict[str, Path|None],
+        jobs: int|None=None,
+        sanitize: bool=True) -> list[Path] :
+    """
+    Converts every `target_formats` file of `input_folder` to all the formats of `output_folder_by_format`,
+    see `_convert_to_formats`.
+    """
 
     assert input_folder.is_dir(), f"{input_folder} n'est pas un dossier existant."
 
+    files = [file for file in input_folder.iterdir() if any(file.suffix == s for s in target_formats)]
+
+    return convert_files_to_formats(files, output_folder_by_format, jobs, sanitize)
+
+
+def convert_files_to_formats(
+        files: list[Path],
+        output_folder_by_format: dict[str, Path|None],
+        jobs: int|None=None,
+        sanitize: bool=True) -> list[Path] :
+    """
+    Converts `files` in parallel, to every format of `output_folder_by_format`.
+    Returns the converted files, those that failed are reported and skipped.
+    """
+
+    if not files :
+        return []
+
+    for output_folder in output_folder_by_format.values() :
+        if output_folder and not output_folder.is_dir() :
+            os.makedirs(output_folder, exist_ok=True)
+
+    jobs = jobs or default_jobs()
+    if jobs == 1 :
+        results = [_try_convert_to_formats(file, output_folder_by_format, sanitize) for file in files]
+    else :
+        pool = get_conversion_pool(jobs)
+        futures = [pool.submit(_try_convert_to_formats, file, output_folder_by_format, sanitize) for file in files]
+        results = [future.result() for future in futures]
+
     handled_files = []
-    for file in input_folder.iterdir() :
+    for file, (output_paths, error, (pid, start, duration)) in zip(files, results) :
 
-        if any(file.suffix == s for s in target_formats) :
-            handled_files.append(_convert_to_xxx(format, file, output_folder))
+        TRACER.record("ffmpeg", "convert", start, duration,
+                      {"file": file.name, "formats": list(output_folder_by_format), "error": error},
+                      pid=pid, tid=pid, lane_name=f"Conversion worker {pid}")
+        CONVERSION_SECONDS.observe(duration, status="ok" if error is None else "error")
+
+        if error is not None :
+            print(f"Could not convert {file.name} to {', '.join(output_folder_by_format)} ({error})")
+            continue
+
+        handled_files.extend(output_paths)
     
     return handled_files
 
+
+def _convert_batch_to_xxx(
+        format: str,
+        input_folder: Path,
+        target_formats: list[str],
+        output_folder: Path|None=None,
+        jobs: int|None=None) -> list[Path] :
+
+    return convert_batch_to_formats(input_folder, target_formats, {format: output_folder}, jobs)
+
 # endregion
 
 # region Specific
@@ -89,9 +424,10 @@ def convert_to_aiff(
 def convert_batch_to_aiff(
         input_folder: Path,
         target_formats: list[str],
-        output_folder: Path|None=None) -> list[Path] :
+        output_folder: Path|None=None,
+        jobs: int|None=None) -> list[Path] :
 
-    return _convert_batch_to_xxx(".aiff", input_folder, target_formats, output_folder)
+    return _convert_batch_to_xxx(".aiff", input_folder, target_formats, output_folder, jobs)
 
 # endregion 
 
@@ -106,9 +442,10 @@ def convert_to_mp3(
 def convert_batch_to_mp3(
         input_folder: Path,
         target_formats: list[str],
-        output_folder: Path|None=None) -> list[Path] :
+        output_folder: Path|None=None,
+        jobs: int|None=None) -> list[Path] :
 
-    return _convert_batch_to_xxx(".mp3", input_folder, target_formats, output_folder)
+    return _convert_batch_to_xxx(".mp3", input_folder, target_formats, output_folder, jobs)
 
 # endregion 
 
@@ -0,0 +1,50 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+from .config import CABOT
+
+
+DATABASE_PATH = CABOT / "cabot.db"
+
+_CONNECTIONS: dict[Path, sqlite3.Connection] = {}
+_LOCK = threading.RLock()
+
+
+def get_connection(path: Path|None=None) -> sqlite3.Connection :
+
+    path = Path(path or DATABASE_PATH)
+
+    with _LOCK :
+        if path not in _CONNECTIONS :
+            connection = sqlite3.connect(path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            _CONNECTIONS[path] = connection
+
+    return _CONNECTIONS[path]
+
+
+@contextmanager
+def transaction(schema: str|None=None, path: Path|None=None) -> Iterator[sqlite3.Connection] :
+    """
+    Serialized access to cabot's persistent database, committed on exit.
+    `schema` (a CREATE TABLE IF NOT EXISTS statement) is ensured beforehand.
+    """
+
+    with _LOCK :
+        connection = get_connection(path)
+        with connection :
+            if schema :
+                connection.execute(schema)
+            yield connection
+
+
+def close_connections() -> None :
+
+    with _LOCK :
+        for connection in _CONNECTIONS.values() :
+            connection.close()
+        _CONNECTIONS.clear()
+
+    return
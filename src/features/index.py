@@ -0,0 +1,155 @@
+import os
+from pathlib import Path
+from .database import transaction
+from .rip import extract_track_id
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS library_index (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    track_id TEXT,
+    source TEXT NOT NULL,
+    formats TEXT NOT NULL
+)
+"""
+
+INDEXED_FORMAT = ".aiff"
+VARIANT_FOLDERS = {
+    ".mp3": "MP3",
+}
+
+# region Utils
+
+def _guess_source(folder: Path, track_id: str|None) -> str :
+
+    # Fallback folders only hold tracks ripped from Soundcloud
+    if folder.parent.name == "fallback" :
+        return "soundcloud"
+
+    # Soundcloud IDs are numeric, Spotify ISRCs are not
+    if track_id is not None and track_id.isdigit() :
+        return "soundcloud"
+
+    return "qobuz"
+
+
+def _list_variants(folder: Path) -> dict[str, set[str]] :
+    """
+    Stems of the derivative files (MP3 copies, ...) stored next to the indexed folder.
+    """
+
+    variants = {}
+    for format, variant_folder_name in VARIANT_FOLDERS.items() :
+
+        variant_folder = folder.parent / variant_folder_name
+        if not variant_folder.is_dir() :
+            variants[format] = set()
+            continue
+
+        variants[format] = {f.stem for f in variant_folder.iterdir() if f.suffix == format}
+
+    return variants
+
+# endregion
+
+
+# region Index
+
+def index_folder(folder: Path, persist: bool=True) -> dict[Path, str | None] :
+    """
+    Returns the track ID of every indexed song in `folder`.
+    Songs are validated by stat only, tags are read again only when size or mtime changed.
+    With `persist` off (plan mode), the index is read but not updated.
+    """
+
+    if not folder.is_dir() :
+        return {}
+
+    songs = {song: song.stat() for song in folder.iterdir() if song.suffix == INDEXED_FORMAT}
+    variants = _list_variants(folder)
+
+    with transaction(_SCHEMA) as db :
+        rows = db.execute("SELECT path, size, mtime_ns, track_id FROM library_index WHERE folder = ?",
+                          (str(folder),)).fetchall()
+
+    known = {Path(path): (size, mtime_ns, track_id) for path, size, mtime_ns, track_id in rows}
+
+    # Tags are read outside of the transaction, so a cold scan doesn't hold the database lock
+    track_id_by_song = {}
+    updated_rows = []
+    for song, stat in songs.items() :
+
+        if (song in known) and (known[song][:2] == (stat.st_size, stat.st_mtime_ns)) :
+            track_id = known[song][2]
+        else :
+            track_id = extract_track_id(song)
+
+        formats = [INDEXED_FORMAT] + [format for format, stems in variants.items() if song.stem in stems]
+
+        track_id_by_song[song] = track_id
+        updated_rows.append((str(song),
+                             str(folder),
+                             stat.st_size,
+                             stat.st_mtime_ns,
+                             track_id,
+                             _guess_source(folder, track_id),
+                             ",".join(formats)))
+
+    if not persist :
+        return track_id_by_song
+
+    with transaction(_SCHEMA) as db :
+
+        # Forget vanished songs
+        vanished = [(str(path),) for path in known if path not in songs]
+        db.executemany("DELETE FROM library_index WHERE path = ?", vanished)
+
+        db.executemany("INSERT OR REPLACE INTO library_index VALUES (?, ?, ?, ?, ?, ?, ?)", updated_rows)
+
+    return track_id_by_song
+
+
+def find_songs(track_ids: set[str]) -> dict[str, Path] :
+    """
+    Returns an indexed song for each known track ID, fallback folders excluded.
+    """
+
+    with transaction(_SCHEMA) as db :
+        rows = db.execute("SELECT track_id, path, folder FROM library_index WHERE track_id IS NOT NULL").fetchall()
+
+    song_by_track_id = {}
+    for track_id, path, folder in rows :
+        if (track_id in track_ids) and (Path(folder).parent.name != "fallback") and Path(path).is_file() :
+            song_by_track_id[track_id] = Path(path)
+
+    return song_by_track_id
+
+
+def is_indexed(track_id: str) -> bool :
+
+    with transaction(_SCHEMA) as db :
+        row = db.execute("SELECT 1 FROM library_index WHERE track_id = ? LIMIT 1", (track_id,)).fetchone()
+
+    return row is not None
+
+
+def forget_songs(songs: list[Path]) -> None :
+
+    with transaction(_SCHEMA) as db :
+        db.executemany("DELETE FROM library_index WHERE path = ?", [(str(song),) for song in songs])
+
+    return
+
+
+def remove_song(song: Path) -> None :
+
+    if song.exists() :
+        os.remove(song)
+    forget_songs([song])
+
+    return
+
+# endregion
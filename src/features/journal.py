@@ -0,0 +1,108 @@
+import time
+from pathlib import Path
+from .database import transaction
+
+
+_BATCHES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal_batches (
+    path TEXT PRIMARY KEY,
+    playlist TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    staged_at REAL NOT NULL
+)
+"""
+
+_DELETIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal_deletions (
+    path TEXT PRIMARY KEY,
+    playlist TEXT NOT NULL
+)
+"""
+
+# region Batches
+
+def record_staged_batch(
+        playlist: str,
+        staged_batch: Path,
+        destination: Path) -> None :
+    """
+    `staged_batch` is fully downloaded (and tagged), its tracks are to be converted to `destination`.
+    """
+
+    with transaction(_BATCHES_SCHEMA) as db :
+        db.execute("INSERT OR REPLACE INTO journal_batches VALUES (?, ?, ?, ?)",
+                   (str(staged_batch), playlist, str(destination), time.time()))
+
+    return
+
+
+def complete_batch(staged_batch: Path) -> None :
+
+    with transaction(_BATCHES_SCHEMA) as db :
+        db.execute("DELETE FROM journal_batches WHERE path = ?", (str(staged_batch),))
+
+    return
+
+
+def get_staged_batches(playlist: str) -> list[tuple[Path, Path]] :
+    """
+    Returns the batches of `playlist` downloaded but not converted yet, oldest first :
+        - Staged batch folder (Path)
+        - Destination playlist folder (Path)
+    """
+
+    with transaction(_BATCHES_SCHEMA) as db :
+        rows = db.execute("SELECT path, destination FROM journal_batches WHERE playlist = ? ORDER BY staged_at",
+                          (playlist,)).fetchall()
+
+    return [(Path(path), Path(destination)) for path, destination in rows]
+
+# endregion
+
+
+# region Deletions
+
+def record_deletions(playlist: str, songs: list[Path]) -> None :
+
+    with transaction(_DELETIONS_SCHEMA) as db :
+        db.executemany("INSERT OR REPLACE INTO journal_deletions VALUES (?, ?)", [(str(song), playlist) for song in songs])
+
+    return
+
+
+def complete_deletions(songs: list[Path]) -> None :
+
+    with transaction(_DELETIONS_SCHEMA) as db :
+        db.executemany("DELETE FROM journal_deletions WHERE path = ?", [(str(song),) for song in songs])
+
+    return
+
+
+def get_pending_deletions(playlist: str) -> list[Path] :
+
+    with transaction(_DELETIONS_SCHEMA) as db :
+        rows = db.execute("SELECT path FROM journal_deletions WHERE playlist = ?", (playlist,)).fetchall()
+
+    return [Path(path) for path, in rows]
+
+# endregion
+
+
+def clear_journal(playlist: str|None=None) -> None :
+    """
+    Forgets the journal of `playlist`, of every playlist if None.
+    """
+
+    with transaction(_BATCHES_SCHEMA) as db :
+        if playlist is None :
+            db.execute("DELETE FROM journal_batches")
+        else :
+            db.execute("DELETE FROM journal_batches WHERE playlist = ?", (playlist,))
+
+    with transaction(_DELETIONS_SCHEMA) as db :
+        if playlist is None :
+            db.execute("DELETE FROM journal_deletions")
+        else :
+            db.execute("DELETE FROM journal_deletions WHERE playlist = ?", (playlist,))
+
+    return
@@ -1,7 +1,28 @@
+import os
+import time
+import hashlib
 from pathlib import Path
+import numpy as np
+import soundfile
 from mutagen.flac import FLAC
+from .convert import (
+    default_jobs,
+    get_conversion_pool,
+)
+from .database import transaction
+from .trace import TRACER
+from .metrics import KEYS_ANALYSED
 
 
+_KEYS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS track_keys (
+    audio_md5 TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    analysed_at REAL NOT NULL
+)
+"""
+
+# Pitch class (C = 0), mode (minor = 0, major = 1) -> Camelot notation
 PITCH_CLASS_TO_CAMELOT = {
     ("0", "0"): "5A",
     ("0", "1"): "8B",
@@ -20,7 +41,7 @@ PITCH_CLASS_TO_CAMELOT = {
     ("7", "0"): "6A",
     ("7", "1"): "9B",
     ("8", "0"): "1A",
-    ("8", "1"): "11B",
+    ("8", "1"): "4B",
     ("9", "0"): "8A",
     ("9", "1"): "11B",
     ("10", "0"): "3A",
@@ -29,17 +50,251 @@ PITCH_CLASS_TO_CAMELOT = {
     ("11", "1"): "1B",
 }
 
+# Krumhansl-Kessler key profiles, tonic first
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
 
-def write_keys_in_flac(playlist_folder: Path, id_to_key_dict: dict[str, str]) -> None :
+ANALYSIS_SAMPLE_RATE = 11025
+FRAME_SIZE = 4096
+HOP_SIZE = 2048
+MIN_FREQUENCY = 65.4 # C2, lower bins are too coarse to tell semitones apart
+MAX_FREQUENCY = 2093. # C7, higher partials blur the chroma
+FRAMES_PER_BLOCK = 256
+TAPS_PER_DECIMATION = 8 # Low-pass FIR length, per decimated sample
 
-    if not playlist_folder.exists() :
-        return
+# region Detection
 
-    for song_path in playlist_folder.glob("*.flac") :
-        song_data = FLAC(song_path)
-        song_id = song_data["COMMENT"]
+def _key_profiles() -> np.ndarray :
+    """
+    The 24 profiles (12 minor then 12 major, by tonic), standardized.
+    """
+
+    profiles = np.array([np.roll(profile, tonic) for profile in (MINOR_PROFILE, MAJOR_PROFILE) for tonic in range(12)])
+
+    return (profiles - profiles.mean(axis=1, keepdims=True)) / profiles.std(axis=1, keepdims=True)
+
+
+def _low_pass(factor: int) -> np.ndarray :
+    """
+    Hamming-windowed sinc cut at the decimated Nyquist frequency.
+    What still aliases lands above `MAX_FREQUENCY`, out of the chroma.
+    """
+
+    n = np.arange(TAPS_PER_DECIMATION * factor + 1) - TAPS_PER_DECIMATION * factor / 2
+    taps = np.sinc(n / factor) * np.hamming(len(n))
+
+    return (taps / taps.sum()).astype(np.float32)
+
+
+def _load_mono(song: Path) -> tuple[np.ndarray, float] :
+    """
+    Downmixed, low-passed and decimated close to `ANALYSIS_SAMPLE_RATE`, block by block.
+    Returns the signal and its sample rate.
+    """
+
+    info = soundfile.info(song)
+    factor = max(1, info.samplerate // ANALYSIS_SAMPLE_RATE)
+    taps = _low_pass(factor)
+
+    # The filter runs over the previous block's last samples, as if the signal was filtered at once
+    history = np.zeros(len(taps) - 1, dtype=np.float32)
+    read = 0
+
+    blocks = []
+    for block in soundfile.blocks(song, blocksize=factor * HOP_SIZE * FRAMES_PER_BLOCK, dtype="float32", always_2d=True) :
+        extended = np.concatenate([history, block.mean(axis=1)])
+        history = extended[len(extended) - len(history):]
+
+        # Only the kept samples are filtered
+        first = -read % factor
+        windows = np.lib.stride_tricks.sliding_window_view(extended, len(taps))[first::factor]
+        blocks.append(windows @ taps)
+        read += len(block)
+
+    signal = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+
+    return signal, info.samplerate / factor
+
+
+def chroma(signal: np.ndarray, sample_rate: float) -> np.ndarray :
+    """
+    Spectral magnitude of `signal` folded onto the 12 pitch classes (C = 0), summed over the whole signal.
+    """
+
+    if len(signal) < FRAME_SIZE :
+        signal = np.pad(signal, (0, FRAME_SIZE - len(signal)))
+
+    frequencies = np.fft.rfftfreq(FRAME_SIZE, 1 / sample_rate)
+    in_range = (frequencies >= MIN_FREQUENCY) & (frequencies <= MAX_FREQUENCY)
+    pitch_classes = np.round(12 * np.log2(frequencies[in_range] / 440.) + 69).astype(int) % 12
+
+    window = np.hanning(FRAME_SIZE).astype(np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(signal, FRAME_SIZE)[::HOP_SIZE]
+
+    spectrum = np.zeros(in_range.sum())
+    for start in range(0, len(frames), FRAMES_PER_BLOCK) :
+        magnitudes = np.abs(np.fft.rfft(frames[start:start + FRAMES_PER_BLOCK] * window, axis=1))
+        spectrum += magnitudes[:, in_range].sum(axis=0)
+
+    return np.bincount(pitch_classes, weights=spectrum, minlength=12)
+
+
+def estimate_key(pitch_class_profile: np.ndarray) -> tuple[int, int] | None :
+    """
+    Correlates the chroma with every key profile.
+    Returns the pitch class (C = 0) and mode (minor = 0, major = 1) of the best one, None for silence.
+    """
+
+    if not pitch_class_profile.std() > 0 :
+        return None
+
+    standardized = (pitch_class_profile - pitch_class_profile.mean()) / pitch_class_profile.std()
+    best = int(np.argmax(_key_profiles() @ standardized))
+
+    return best % 12, best // 12
+
+
+def detect_key(song: Path) -> str | None :
+    """
+    Camelot key of `song`, None if it can't be told.
+    """
+
+    assert song.is_file(), f"{song} n'existe pas."
+
+    key = estimate_key(chroma(*_load_mono(song)))
+    if key is None :
+        return None
+
+    pitch_class, mode = key
+
+    return PITCH_CLASS_TO_CAMELOT[(str(pitch_class), str(mode))]
+
+
+def _try_detect_key(song: Path) -> tuple[str | None, str | None, tuple[int, float, float]] :
+    """
+    Errors are returned rather than raised, so one bad file doesn't abort the whole batch.
+    The worker's PID, start time and duration are returned as well, for the trace.
+    """
+
+    start = time.time()
+    counter = time.perf_counter()
+    try :
+        key, error = detect_key(song), None
+    except Exception as e :
+        key, error = None, f"{type(e).__name__}: {e}"
+
+    return key, error, (os.getpid(), start, time.perf_counter() - counter)
+
+# endregion
 
-        song_data["INITIALKEY"] = id_to_key_dict[song_id]
+
+# region Cache
+
+def audio_md5(song: Path) -> str :
+    """
+    MD5 of the decoded audio, stored in FLAC's STREAMINFO : retagging a track doesn't change it.
+    Falls back on the file's MD5 when the encoder left it blank.
+    """
+
+    md5_signature = FLAC(song).info.md5_signature
+    if md5_signature :
+        return f"{md5_signature:032x}"
+
+    with open(song, "rb") as f :
+        return hashlib.file_digest(f, "md5").hexdigest()
+
+
+def get_cached_keys(hashes: list[str]) -> dict[str, str] :
+
+    if not hashes :
+        return {}
+
+    with transaction(_KEYS_SCHEMA) as db :
+        rows = db.execute(f"SELECT audio_md5, key FROM track_keys WHERE audio_md5 IN ({', '.join('?' * len(hashes))})",
+                          hashes).fetchall()
+
+    return dict(rows)
+
+
+def save_keys(key_by_hash: dict[str, str]) -> None :
+
+    with transaction(_KEYS_SCHEMA) as db :
+        db.executemany("INSERT OR REPLACE INTO track_keys VALUES (?, ?, ?)",
+                       [(audio_hash, key, time.time()) for audio_hash, key in key_by_hash.items()])
+
+    return
+
+# endregion
+
+
+# region Batch
+
+def analyse_keys(songs: list[Path], jobs: int|None=None) -> dict[Path, str] :
+    """
+    Keys of `songs`, those analysed before (same audio) being read from the cache.
+    The others are analysed in parallel, the ones that failed are reported and skipped.
+    """
+
+    hash_by_song = {song: audio_md5(song) for song in songs}
+    cached = get_cached_keys(list(set(hash_by_song.values())))
+
+    key_by_song = {song: cached[audio_hash] for song, audio_hash in hash_by_song.items() if audio_hash in cached}
+    KEYS_ANALYSED.inc(len(key_by_song), cached="true")
+
+    to_analyse = [song for song in songs if song not in key_by_song]
+    if not to_analyse :
+        return key_by_song
+
+    jobs = jobs or default_jobs()
+    if jobs == 1 :
+        results = [_try_detect_key(song) for song in to_analyse]
+    else :
+        pool = get_conversion_pool(jobs)
+        futures = [pool.submit(_try_detect_key, song) for song in to_analyse]
+        results = [future.result() for future in futures]
+
+    analysed = {}
+    for song, (key, error, (pid, start, duration)) in zip(to_analyse, results) :
+
+        TRACER.record("detect_key", "key", start, duration,
+                      {"file": song.name, "key": key, "error": error},
+                      pid=pid, tid=pid, lane_name=f"Conversion worker {pid}")
+
+        if error is not None :
+            print(f"Could not analyse the key of {song.name} ({error})")
+            continue
+
+        if key is not None :
+            key_by_song[song] = key
+            analysed[hash_by_song[song]] = key
+
+    KEYS_ANALYSED.inc(len(to_analyse), cached="false")
+    save_keys(analysed)
+
+    return key_by_song
+
+
+def write_keys_in_flac(key_by_song: dict[Path, str]) -> None :
+
+    for song_path, key in key_by_song.items() :
+        song_data = FLAC(song_path)
+        song_data["INITIALKEY"] = key
         song_data.save()
-    
+
     return
+
+
+def analyse_keys_in_flac(playlist_folder: Path, jobs: int|None=None) -> dict[Path, str] :
+    """
+    Tags the FLAC tracks of `playlist_folder` with their Camelot key (INITIALKEY), before they are converted.
+    """
+
+    if not playlist_folder.exists() :
+        return {}
+
+    key_by_song = analyse_keys(list(playlist_folder.glob("*.flac")), jobs)
+    write_keys_in_flac(key_by_song)
+
+    return key_by_song
+
+# endregion
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+from .config import (
+    DEFAULT_MAX_API_REQUESTS,
+    DEFAULT_MAX_DOWNLOADS,
+)
+
+
+class ConcurrencyLimiter :
+    """
+    Caps how many operations run at once across every thread and event loop of the run.
+    Usable both as a context manager and as an async context manager.
+    """
+
+    def __init__(self, limit: int) -> None :
+        self._condition = threading.Condition()
+        self._limit = limit
+        self._active = 0
+
+    @property
+    def limit(self) -> int :
+        return self._limit
+
+    def set_limit(self, limit: int) -> None :
+
+        assert limit >= 1, f"{limit} n'est pas une limite valide."
+
+        with self._condition :
+            self._limit = limit
+            self._condition.notify_all()
+
+        return
+
+    def _try_acquire(self) -> bool :
+
+        with self._condition :
+            if self._active < self._limit :
+                self._active += 1
+                return True
+
+        return False
+
+    def _release(self) -> None :
+
+        with self._condition :
+            self._active -= 1
+            self._condition.notify_all()
+
+        return
+
+    def __enter__(self) -> None :
+
+        with self._condition :
+            self._condition.wait_for(lambda: self._active < self._limit)
+            self._active += 1
+
+    def __exit__(self, *_) -> None :
+        self._release()
+
+    async def __aenter__(self) -> None :
+
+        # Polling keeps the event loop free, whichever thread holds the slots
+        delay = 0.005
+        while not self._try_acquire() :
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, 0.1)
+
+    async def __aexit__(self, *_) -> None :
+        self._release()
+
+
+# Shared by every playlist being synchronized
+API_LIMITER = ConcurrencyLimiter(DEFAULT_MAX_API_REQUESTS)
+DOWNLOAD_LIMITER = ConcurrencyLimiter(DEFAULT_MAX_DOWNLOADS)
@@ -0,0 +1,252 @@
+import os
+import threading
+from bisect import bisect_left
+from pathlib import Path
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+CONVERSION_BUCKETS = (0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60., 120.)
+
+# region Metrics
+
+def _escape(value: str) -> str :
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str :
+
+    if not labels :
+        return ""
+
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class _Metric :
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...]=()) -> None :
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple[tuple[str, str], ...], object] = {}
+
+    def _key(self, labels: dict[str, object]) -> tuple[tuple[str, str], ...] :
+        assert set(labels) == set(self.labelnames), f"{self.name} expects the labels {', '.join(self.labelnames)}."
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def clear(self) -> None :
+
+        with self._lock :
+            self._values.clear()
+
+        return
+
+    def _samples(self) -> list[str] :
+        raise NotImplementedError
+
+    def render(self) -> str :
+
+        with self._lock :
+            samples = self._samples()
+
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + samples)
+
+
+class Counter(_Metric) :
+
+    type = "counter"
+
+    def inc(self, amount: float=1., **labels) -> None :
+
+        assert amount >= 0, f"{self.name} can't decrease."
+
+        key = self._key(labels)
+        with self._lock :
+            self._values[key] = self._values.get(key, 0.) + amount
+
+        return
+
+    def _samples(self) -> list[str] :
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric) :
+
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None :
+
+        key = self._key(labels)
+        with self._lock :
+            self._values[key] = value
+
+        return
+
+    def _samples(self) -> list[str] :
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram(_Metric) :
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...]=(), buckets: tuple[float, ...]=DEFAULT_BUCKETS) -> None :
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None :
+
+        key = self._key(labels)
+        with self._lock :
+            # Per bucket counts (the last one is +Inf), sum
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+        return
+
+    def _samples(self) -> list[str] :
+
+        samples = []
+        for key, (counts, total) in self._values.items() :
+
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts) :
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound}"
+                samples.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+
+            samples.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            samples.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+
+        return samples
+
+# endregion
+
+
+# region Registry
+
+class MetricsRegistry :
+    """
+    Metrics of the run, rendered in Prometheus' text format.
+    They are either written to a file (node_exporter's textfile collector) or served over HTTP while the run lasts.
+    """
+
+    def __init__(self) -> None :
+        self._metrics: list[_Metric] = []
+
+    def _register(self, metric: _Metric) -> _Metric :
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...]=()) -> Counter :
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: tuple[str, ...]=()) -> Gauge :
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...]=(), buckets: tuple[float, ...]=DEFAULT_BUCKETS) -> Histogram :
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def clear(self) -> None :
+
+        for metric in self._metrics :
+            metric.clear()
+
+        return
+
+    def render(self) -> str :
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+    def write_textfile(self, path: Path) -> None :
+        """
+        Written aside then renamed, so the collector never reads a partial file.
+        """
+
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_text(self.render())
+        os.replace(tmp_path, path)
+
+        return
+
+    def serve(self, port: int, host: str="127.0.0.1") :
+        """
+        Serves the metrics on http://host:port/metrics from a background thread.
+        Returns the server, to `shutdown()` at the end of the run.
+        """
+
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler) :
+
+            def do_GET(self) -> None :
+
+                if self.path.split("?")[0] not in ("/", "/metrics") :
+                    self.send_error(404)
+                    return
+
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_) -> None :
+                return
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        return server
+
+# endregion
+
+
+# region Cabot metrics
+
+METRICS = MetricsRegistry()
+
+TRACKS_RESOLVED = METRICS.counter("cabot_tracks_resolved_total",
+                                  "Spotify tracks searched on Qobuz, by outcome (matching strategy, not_found, known_missing, error).",
+                                  ("strategy", "cached"))
+API_REQUESTS = METRICS.counter("cabot_api_requests_total",
+                               "API requests sent, retries included, by service and status.",
+                               ("service", "status"))
+API_REQUEST_SECONDS = METRICS.histogram("cabot_api_request_seconds",
+                                        "Latency of the API requests, retries included.",
+                                        ("service",))
+API_ERRORS = METRICS.counter("cabot_api_errors_total",
+                             "API requests throttled, failed or still failing after every retry.",
+                             ("service", "kind"))
+DOWNLOADED_BYTES = METRICS.counter("cabot_downloaded_bytes_total",
+                                   "Bytes of audio downloaded.",
+                                   ("source",))
+CONVERSION_SECONDS = METRICS.histogram("cabot_conversion_seconds",
+                                       "Duration of each conversion of a source to all its formats (in-process AIFF and ffmpeg).",
+                                       ("status",),
+                                       CONVERSION_BUCKETS)
+KEYS_ANALYSED = METRICS.counter("cabot_keys_analysed_total",
+                                "Tracks whose key was detected, or read from the cache.",
+                                ("cached",))
+TRACKS_DELETED = METRICS.counter("cabot_tracks_deleted_total",
+                                 "Tracks removed from a playlist folder.",
+                                 ("playlist",))
+FALLBACK_TRACKS = METRICS.gauge("cabot_fallback_tracks",
+                                "Tracks of the last run not found on Qobuz, searched on Soundcloud instead.",
+                                ("playlist",))
+DOUBLE_FAILED_TRACKS = METRICS.gauge("cabot_double_failed_tracks",
+                                     "Tracks of the last run found neither on Qobuz nor on Soundcloud.",
+                                     ("playlist",))
+RUN_SECONDS = METRICS.gauge("cabot_run_duration_seconds",
+                            "Duration of the last run.")
+RUN_SUCCESS = METRICS.gauge("cabot_run_success",
+                            "Whether the last run completed (1) or failed (0).")
+RUN_TIMESTAMP = METRICS.gauge("cabot_run_timestamp_seconds",
+                              "Unix time the last run ended at.")
+
+# endregion
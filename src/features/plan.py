@@ -0,0 +1,166 @@
+import asyncio
+from dataclasses import dataclass, field
+from pathlib import Path
+from .config import CabotConfig
+from .rip import (
+    fetch_spotify_playlist,
+    fetch_soundcloud_playlist,
+    spotify_track_key,
+    spotify_tracks_to_sync,
+)
+from .index import (
+    index_folder,
+    find_songs,
+)
+from .store import (
+    get_store_folder,
+    get_stored_track_ids,
+)
+
+
+# Average bitrates (kbps) of the downloaded files, by Qobuz quality
+BITRATE_BY_QUALITY = {
+    1: 320,     # MP3
+    2: 900,     # FLAC 16 bits / 44.1 kHz
+    3: 2300,    # FLAC 24 bits / 96 kHz
+    4: 4600,    # FLAC 24 bits / 192 kHz
+}
+SOUNDCLOUD_BITRATE = 1411 # WAV 16 bits / 44.1 kHz
+DEFAULT_TRACK_DURATION = 240000 # 4 min, when unknown
+MASS_DELETION_RATIO = 0.2 # Warn when a run would delete more than 20% of a playlist
+
+# region Plan
+
+@dataclass(slots=True)
+class PlaylistPlan :
+    playlist: str
+    to_download: list[str] = field(default_factory=list)
+    to_link: list[str] = field(default_factory=list)
+    to_delete: list[Path] = field(default_factory=list)
+    satisfied: int = 0
+    settled: int = 0
+    downloaded: int = 0
+    download_bytes: int = 0
+
+    @property
+    def mass_deletion(self) -> bool :
+        return len(self.to_delete) > MASS_DELETION_RATIO * max(1, self.downloaded)
+
+
+def _estimate_bytes(duration_ms: int|None, bitrate: int) -> int :
+    return int((duration_ms or DEFAULT_TRACK_DURATION) / 1000 * bitrate * 1000 / 8)
+
+
+def _linkable(track_ids: set[str], stored: set[str]) -> set[str] :
+    """
+    Tracks of `track_ids` other playlists already downloaded.
+    """
+    return (track_ids & stored) | set(find_songs(track_ids - stored))
+
+
+def _unused_songs(folder: Path, wanted: set[str]) -> list[Path] :
+    """
+    Songs `remove_deleted_tracks` would delete : untagged or not wanted anymore.
+    """
+    return [song for song, song_id in index_folder(folder, persist=False).items() if (song_id is None) or (song_id not in wanted)]
+
+
+def plan_one_playlist(cabot_config: CabotConfig, playlist: str) -> PlaylistPlan :
+    """
+    What `update_one_playlist` would do, from playlists metadata and the local scan only.
+    Nothing is downloaded, converted nor deleted, and neither the Spotify snapshots nor the index are saved.
+    """
+
+    plan = PlaylistPlan(playlist)
+
+    playlist_path = cabot_config.playlists_folder / playlist.replace("/", " ")
+    fallback_path = playlist_path / "fallback"
+
+    # Local scan, without removing untagged songs
+    memory_success = {song_id for song_id in index_folder(playlist_path / "AIFF", persist=False).values() if song_id is not None}
+    memory_fallback = {song_id for song_id in index_folder(fallback_path / "AIFF", persist=False).values() if song_id is not None}
+    plan.downloaded = len(memory_success) + len(memory_fallback)
+
+    # Tracks other playlists already downloaded
+    stored = get_stored_track_ids(get_store_folder(cabot_config.playlists_folder))
+
+    wanted = set()
+    for source, url in cabot_config.playlists[playlist].items() :
+
+        tracks = {}
+        if source == "spotify" :
+            bitrate = BITRATE_BY_QUALITY.get(cabot_config.qobuz_quality, BITRATE_BY_QUALITY[2])
+            spotify_playlist = fetch_spotify_playlist(cabot_config, url, persist=False)
+            for item in spotify_playlist["tracks"]["items"] :
+                tracks[spotify_track_key(item["track"])] = (item["track"]["name"], item["track"].get("duration_ms"))
+
+            # As `update_one_playlist` : linked first, then only the tracks added or not settled yet
+            linkable = _linkable(set(tracks) - memory_success, stored)
+            to_sync = spotify_tracks_to_sync(cabot_config, spotify_playlist, memory_success | linkable, memory_fallback)
+            to_download = {spotify_track_key(item["track"]) for item in to_sync}
+
+        elif source == "soundcloud" :
+            bitrate = SOUNDCLOUD_BITRATE
+            for track in asyncio.run(fetch_soundcloud_playlist(url))["tracks"] :
+                tracks[str(track["id"]).split("|")[0]] = (track["title"], track.get("duration"))
+
+            linkable = _linkable(set(tracks) - memory_success - memory_fallback, stored)
+            to_download = set(tracks) - memory_success - memory_fallback - linkable
+
+        wanted |= set(tracks)
+
+        downloaded = set(tracks) & (memory_success | memory_fallback)
+        plan.satisfied += len(downloaded - linkable - to_download)
+        plan.settled += len(set(tracks) - downloaded - linkable - to_download)
+
+        for track_key, (title, duration_ms) in tracks.items() :
+            if track_key in linkable :
+                plan.to_link.append(title)
+            elif track_key in to_download :
+                plan.to_download.append(title)
+                plan.download_bytes += _estimate_bytes(duration_ms, bitrate)
+
+    # Clean
+    plan.to_delete = _unused_songs(playlist_path / "AIFF", wanted) + _unused_songs(fallback_path / "AIFF", wanted)
+
+    return plan
+
+
+def print_plan(plan: PlaylistPlan) -> None :
+
+    print(f"-------------- PLAN {plan.playlist} --------------")
+    print(f"{len(plan.to_download)} tracks to download (~{plan.download_bytes / 1e6:.0f} MB).")
+    for title in plan.to_download :
+        print(f"   -> {title}")
+    print(f"{len(plan.to_link)} tracks linked from other playlists.")
+    print(f"{plan.satisfied} tracks already downloaded.")
+    print(f"{plan.settled} tracks missing from Qobuz and Soundcloud, not searched again.")
+    print(f"{len(plan.to_delete)} tracks to delete.")
+    for song in plan.to_delete :
+        print(f"   -> {song.name}")
+    if plan.mass_deletion :
+        print(f"WARNING : {len(plan.to_delete)} of the {plan.downloaded} downloaded tracks would be deleted.")
+    print("")
+
+    return
+
+
+def plan_playlists(cabot_config: CabotConfig, playlists_to_plan: list[str]|None=None) -> list[PlaylistPlan] :
+
+    playlists_to_plan = playlists_to_plan or list(cabot_config.playlists.keys())
+
+    for playlist in playlists_to_plan :
+        assert playlist in cabot_config.playlists, f"{playlist} is not configured, please fill `config.json` correctly."
+
+    plans = []
+    for playlist in playlists_to_plan :
+        plan = plan_one_playlist(cabot_config, playlist)
+        print_plan(plan)
+        plans.append(plan)
+
+    print(f"Total : {sum(len(p.to_download) for p in plans)} tracks to download (~{sum(p.download_bytes for p in plans) / 1e6:.0f} MB), "
+          f"{sum(len(p.to_delete) for p in plans)} tracks to delete.")
+
+    return plans
+
+# endregion
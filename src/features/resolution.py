@@ -0,0 +1,190 @@
+import re
+import json
+import time
+from .config import (
+    DEFAULT_RESOLUTION_TTL_DAYS,
+    DEFAULT_MISSING_RECHECK_DAYS,
+)
+from .database import transaction
+
+
+_RESOLUTIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS qobuz_resolutions (
+    key TEXT PRIMARY KEY,
+    qobuz_id TEXT NOT NULL,
+    found_isrc TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    resolved_at REAL NOT NULL
+)
+"""
+
+_MISSES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS qobuz_misses (
+    key TEXT PRIMARY KEY,
+    first_failed_at REAL NOT NULL,
+    last_checked_at REAL NOT NULL,
+    attempts INTEGER NOT NULL
+)
+"""
+
+_FALLBACK_SEARCHES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS soundcloud_searches (
+    query TEXT PRIMARY KEY,
+    track TEXT,
+    accepted INTEGER NOT NULL,
+    searched_at REAL NOT NULL
+)
+"""
+
+MAX_MISSING_BACKOFF = 8 # Missing tracks are re-checked at least every 8 * recheck days
+DAY = 86400 # seconds
+
+# region Utils
+
+def _normalize(text: str) -> str :
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def resolution_key(isrc: str|None, name: str, artists: list[str]) -> str :
+    """
+    Spotify ISRC, or normalized title - artists for tracks without ISRC.
+    """
+
+    if isrc :
+        return isrc
+
+    return f"{_normalize(name)} - {', '.join(sorted(_normalize(a) for a in artists))}"
+
+# endregion
+
+
+# region Qobuz resolutions
+
+def get_resolution(key: str, ttl_days: float=DEFAULT_RESOLUTION_TTL_DAYS) -> tuple[str, str, str] | None :
+    """
+    Returns :
+        - Qobuz's track id (str)
+        - Found ISRC (Qobuz) (str)
+        - Search strategy that found it (str)
+    None if unknown or older than `ttl_days`.
+    """
+
+    with transaction(_RESOLUTIONS_SCHEMA) as db :
+        row = db.execute("SELECT qobuz_id, found_isrc, strategy FROM qobuz_resolutions WHERE key = ? AND resolved_at >= ?",
+                         (key, time.time() - ttl_days * DAY)).fetchone()
+
+    return row
+
+
+def save_resolution(key: str, qobuz_id: str, found_isrc: str, strategy: str) -> None :
+
+    with transaction(_RESOLUTIONS_SCHEMA) as db :
+        db.execute("INSERT OR REPLACE INTO qobuz_resolutions VALUES (?, ?, ?, ?, ?)",
+                   (key, str(qobuz_id), found_isrc, strategy, time.time()))
+
+    forget_misses([key])
+
+    return
+
+
+def invalidate_resolutions(keys: list[str]|None=None) -> int :
+    """
+    Forgets the given resolutions, all of them if `keys` is None.
+    Returns the number of forgotten resolutions.
+    """
+
+    with transaction(_RESOLUTIONS_SCHEMA) as db :
+        if keys is None :
+            cursor = db.execute("DELETE FROM qobuz_resolutions")
+        else :
+            cursor = db.executemany("DELETE FROM qobuz_resolutions WHERE key = ?", [(key,) for key in keys])
+
+    return cursor.rowcount
+
+# endregion
+
+
+# region Qobuz misses
+
+def is_known_missing(key: str, recheck_days: float=DEFAULT_MISSING_RECHECK_DAYS) -> bool :
+    """
+    Was the track missing from Qobuz recently enough not to search it again ?
+    The delay doubles after each failed check.
+    """
+
+    with transaction(_MISSES_SCHEMA) as db :
+        row = db.execute("SELECT last_checked_at, attempts FROM qobuz_misses WHERE key = ?", (key,)).fetchone()
+
+    if row is None :
+        return False
+
+    last_checked_at, attempts = row
+    backoff = min(2 ** (attempts - 1), MAX_MISSING_BACKOFF)
+
+    return time.time() < last_checked_at + backoff * recheck_days * DAY
+
+
+def record_miss(key: str) -> None :
+
+    now = time.time()
+    with transaction(_MISSES_SCHEMA) as db :
+        db.execute("""INSERT INTO qobuz_misses VALUES (?, ?, ?, 1)
+                      ON CONFLICT(key) DO UPDATE SET last_checked_at = excluded.last_checked_at, attempts = attempts + 1""",
+                   (key, now, now))
+
+    return
+
+
+def forget_misses(keys: list[str]|None=None) -> int :
+    """
+    Forgets the given misses, all of them if `keys` is None.
+    Returns the number of forgotten misses.
+    """
+
+    with transaction(_MISSES_SCHEMA) as db :
+        if keys is None :
+            cursor = db.execute("DELETE FROM qobuz_misses")
+        else :
+            cursor = db.executemany("DELETE FROM qobuz_misses WHERE key = ?", [(key,) for key in keys])
+
+    return cursor.rowcount
+
+# endregion
+
+
+# region Soundcloud fallback searches
+
+def get_fallback_search(
+        query: str,
+        ttl_days: float=DEFAULT_RESOLUTION_TTL_DAYS,
+        recheck_days: float=DEFAULT_MISSING_RECHECK_DAYS) -> tuple[dict | None, bool] | None :
+    """
+    Returns :
+        - First Soundcloud track found for `query`, if any (dict | None)
+        - Did it pass the duration filter (bool)
+    None if never searched, or searched too long ago (`ttl_days` for accepted tracks, `recheck_days` otherwise).
+    """
+
+    with transaction(_FALLBACK_SEARCHES_SCHEMA) as db :
+        row = db.execute("SELECT track, accepted, searched_at FROM soundcloud_searches WHERE query = ?", (query,)).fetchone()
+
+    if row is None :
+        return None
+
+    track, accepted, searched_at = row
+    max_age = ttl_days if accepted else recheck_days
+    if time.time() >= searched_at + max_age * DAY :
+        return None
+
+    return (None if track is None else json.loads(track)), bool(accepted)
+
+
+def save_fallback_search(query: str, track: dict|None, accepted: bool) -> None :
+
+    with transaction(_FALLBACK_SEARCHES_SCHEMA) as db :
+        db.execute("INSERT OR REPLACE INTO soundcloud_searches VALUES (?, ?, ?, ?)",
+                   (query, None if track is None else json.dumps(track), int(accepted), time.time()))
+
+    return
+
+# endregion
@@ -3,20 +3,49 @@ from rich.text import Text
 from pathlib import Path
 import re
 import os
+import shutil
+import json
 import asyncio
-from contextlib import ExitStack
+from contextlib import AsyncExitStack, nullcontext
 from streamrip.console import console
 from streamrip.media.playlist import Playlist, PendingPlaylistTrack
+from streamrip.media.track import Track
+from streamrip.metadata import tag_file
+from streamrip.progress import remove_title
 from streamrip.client import Client
 from streamrip.client.qobuz import QobuzClient
 from streamrip.client.soundcloud import SoundcloudClient
 from streamrip.config import Config
 from streamrip.db import Downloads, Database, Dummy
-from streamrip.config import DEFAULT_DOWNLOADS_DB_PATH
-from .config import (
-    get_cabot_config_value,
+from .config import CabotConfig
+from .database import transaction
+from .resolution import (
+    resolution_key,
+    get_resolution,
+    save_resolution,
+    is_known_missing,
+    record_miss,
+    get_fallback_search,
+    save_fallback_search,
+)
+from .limits import (
+    API_LIMITER,
+    DOWNLOAD_LIMITER,
+)
+from .scheduler import (
+    QOBUZ_SCHEDULER,
+    SOUNDCLOUD_SCHEDULER,
+    RequestError,
+)
+from .convert import (
+    convert_to_flac,
+    sanitize_flac_tags,
+)
+from .trace import span
+from .metrics import (
+    TRACKS_RESOLVED,
+    DOWNLOADED_BYTES,
 )
-from .convert import convert_to_flac
 from spotipy import Spotify
 from spotipy.oauth2 import SpotifyClientCredentials
 from pybalt import download
@@ -25,28 +54,25 @@ from mutagen.aiff import AIFF
 
 MIN_FALLBACK_TRACK_DURATION = 60000 # 1 min
 MAX_FALLBACK_TRACK_DURATION = 1200000 # 20 min
+DOWNLOADS_DB_NAME = "downloads.db"
 
 # region ID TAGGER
 
-def tag_track_id_by_track_isrc(
-        isrc_to_id_dict: dict[str, str],
-        downloads_folder: Path) -> None :
+def tag_track_id(
+        track: Path,
+        track_id: str) -> None :
     """
     Only tag FLAC tracks for now.
+    Sanitizes the metadata in the same save, conversions don't have to rewrite the file again.
     """
 
-    assert downloads_folder.is_dir(), f"{downloads_folder} n'existe pas."
+    assert track.is_file(), f"{track} n'existe pas."
 
-    for track in downloads_folder.glob("*.flac") :
+    with span("tag", "tag", file=track.name) :
         track_data = FLAC(track)
-
-        if "ISRC" in track_data :
-        
-            track_isrc = str(track_data["ISRC"][0])
-
-            if track_isrc in isrc_to_id_dict :
-                track_data["COMMENT"] = isrc_to_id_dict[track_isrc]
-                track_data.save()
+        track_data["COMMENT"] = track_id
+        sanitize_flac_tags(track_data)
+        track_data.save()
     
     return
 
@@ -78,44 +104,356 @@ def extract_track_id(song: Path) -> str | None :
 # endregion
 
 
+# region QOBUZ TRACKS
+
+@dataclass(slots=True)
+class LimitedTrack(Track) :
+    """
+    Track whose download counts against the run-wide download limit,
+    as streamrip's own semaphore can't be shared between event loops.
+    Tagged with `track_id` (the searched ISRC) as soon as it is downloaded.
+    """
+
+    track_id: str = ""
+
+    async def download(self) :
+        async with DOWNLOAD_LIMITER :
+            with span("download", "qobuz", title=self.meta.title) :
+                await Track.download(self)
+
+        if os.path.isfile(self.download_path) :
+            DOWNLOADED_BYTES.inc(os.path.getsize(self.download_path), source="qobuz")
+
+    async def postprocess(self) :
+        """
+        Streamrip's, with the track ID tagged before the track is marked as downloaded :
+        a track of downloads.db always carries its ID.
+        """
+
+        if self.is_single :
+            remove_title(self.meta.title)
+
+        await tag_file(self.download_path, self.meta, self.cover_path)
+        tag_track_id(Path(self.download_path), self.track_id)
+        if self.config.session.conversion.enabled :
+            await self._convert()
+
+        self.db.set_downloaded(self.meta.info.id)
+
+
+@dataclass(slots=True)
+class LimitedPendingPlaylistTrack(PendingPlaylistTrack) :
+
+    track_id: str = ""
+
+    async def resolve(self) -> LimitedTrack | None :
+
+        with span("resolve", "qobuz", qobuz_id=self.id) :
+            track = await PendingPlaylistTrack.resolve(self)
+        if track is None :
+            return None
+
+        return LimitedTrack(track.meta,
+                            track.downloadable,
+                            track.config,
+                            track.folder,
+                            track.cover_path,
+                            track.db,
+                            track_id=self.track_id)
+
+# endregion
+
+
+# region QOBUZ CLIENT
+
+class PersistentQobuzClient(QobuzClient) :
+    """
+    Qobuz client kept logged in for the whole run, logging in again only when its token expired.
+    """
+
+    def __init__(self, config: Config) -> None :
+        super().__init__(config)
+        self._login_lock: asyncio.Lock | None = None
+        self._login_count = 0
+
+    async def login(self) -> None :
+        await super().login()
+        self._login_count += 1
+
+    async def get_session(self, headers: dict|None=None, verify_ssl: bool=True) :
+        """
+        Logging in again keeps the live session, only its auth headers are refreshed :
+        the requests and downloads still running go through it.
+        """
+
+        session = getattr(self, "session", None)
+        if (session is not None) and (not session.closed) :
+            return session
+
+        return await QobuzClient.get_session(headers, verify_ssl)
+
+    async def _relogin(self, expired_login_count: int) -> None :
+
+        if self._login_lock is None :
+            self._login_lock = asyncio.Lock()
+
+        async with self._login_lock :
+
+            # Another request already logged in again
+            if self._login_count != expired_login_count :
+                return
+
+            self.logged_in = False
+            await self.login()
+
+        return
+
+    async def _scheduled_api_request(self, epoint: str, params: dict) -> tuple[int, dict] :
+        return await QOBUZ_SCHEDULER.request(lambda: QobuzClient._api_request(self, epoint, params))
+
+    async def _api_request(self, epoint: str, params: dict) -> tuple[int, dict] :
+
+        login_count = self._login_count
+        status, resp = await self._scheduled_api_request(epoint, params)
+
+        # Expired token
+        if status == 401 and self.logged_in :
+            await self._relogin(login_count)
+            status, resp = await self._scheduled_api_request(epoint, params)
+
+        return status, resp
+
+
+_QOBUZ_CLIENTS: dict[asyncio.AbstractEventLoop, PersistentQobuzClient] = {}
+async def get_qobuz_client(cabot_config: CabotConfig) -> PersistentQobuzClient :
+    """
+    Aiohttp sessions are bound to their event loop, so there is one client per event loop.
+    """
+
+    loop = asyncio.get_running_loop()
+    if loop in _QOBUZ_CLIENTS :
+        return _QOBUZ_CLIENTS[loop]
+
+    config = Config.defaults()
+    config.session.qobuz.email_or_userid = cabot_config.qobuz_email
+    config.session.qobuz.password_or_token = cabot_config.qobuz_token
+    config.session.qobuz.use_auth_token = True
+    config.session.qobuz.quality = cabot_config.qobuz_quality
+    config.session.downloads.max_connections = -1 # Limited by DOWNLOAD_LIMITER instead
+    config.session.downloads.requests_per_minute = 0 # Rate handled by QOBUZ_SCHEDULER instead
+    client = PersistentQobuzClient(config)
+
+    await client.login()
+
+    _QOBUZ_CLIENTS[loop] = client
+
+    return client
+
+
+def close_qobuz_clients() -> None :
+
+    for loop, client in _QOBUZ_CLIENTS.items() :
+        if not loop.is_closed() :
+            loop.run_until_complete(client.session.close())
+    
+    _QOBUZ_CLIENTS.clear()
+
+    return
+
+# endregion
+
+
 # region SPOTIFY
 
+_SPOTIFY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spotify_playlists (
+    url TEXT PRIMARY KEY,
+    snapshot_id TEXT NOT NULL,
+    playlist TEXT NOT NULL
+)
+"""
+SPOTIFY_PAGE_SIZE = 100
+SPOTIFY_ITEMS_FIELDS = "items(track(name,duration_ms,album(name),artists(name),external_ids)),next"
+
+
+def spotify_fallback_query(track: dict) -> str :
+    return f"{track['name']} - {', '.join(a['name'] for a in track['artists'])}"
+
+
+def spotify_track_key(track: dict) -> str :
+    """
+    ISRC if known, else the fallback query (title - artists).
+    """
+
+    if "isrc" in track["external_ids"] :
+        return track["external_ids"]["isrc"]
+
+    return spotify_fallback_query(track)
+
+
+def _is_settled(
+        cabot_config: CabotConfig,
+        track: dict,
+        in_fallback: bool) -> bool :
+    """
+    Is a track missing from Qobuz recently enough not to search it again, and either downloaded from Soundcloud
+    or rejected by the Soundcloud fallback search ?
+    """
+
+    key = resolution_key(track["external_ids"].get("isrc"), track["name"], [a["name"] for a in track["artists"]])
+    if not is_known_missing(key, cabot_config.missing_recheck_days) :
+        return False
+
+    if in_fallback :
+        return True
+
+    fallback_search = get_fallback_search(spotify_fallback_query(track),
+                                          cabot_config.resolution_cache_ttl_days,
+                                          cabot_config.missing_recheck_days)
+
+    return (fallback_search is not None) and (not fallback_search[1])
+
+
+def spotify_tracks_to_sync(
+        cabot_config: CabotConfig,
+        spotify_playlist: dict,
+        memory_success: set[str],
+        memory_fallback: set[str],
+        recheck_missing: bool=False) -> list[dict] :
+    """
+    Playlist items to search and download : not downloaded yet, and either added since the last run
+    or not settled yet (see `_is_settled`, every missing track with `recheck_missing`).
+    """
+
+    added = set(spotify_playlist["added"])
+
+    to_sync = []
+    for item in spotify_playlist["tracks"]["items"] :
+
+        key = spotify_track_key(item["track"])
+        if key in memory_success :
+            continue
+
+        if (key not in added) and (not recheck_missing) and _is_settled(cabot_config, item["track"], key in memory_fallback) :
+            continue
+
+        to_sync.append(item)
+
+    return to_sync
+
+
+def _load_spotify_snapshot(url: str) -> tuple[str, dict] | None :
+
+    with transaction(_SPOTIFY_SCHEMA) as db :
+        row = db.execute("SELECT snapshot_id, playlist FROM spotify_playlists WHERE url = ?", (url,)).fetchone()
+
+    if row is None :
+        return None
+
+    snapshot_id, playlist = row
+    return snapshot_id, json.loads(playlist)
+
+
+def _save_spotify_snapshot(url: str, spotify_playlist: dict) -> None :
+
+    with transaction(_SPOTIFY_SCHEMA) as db :
+        db.execute("INSERT OR REPLACE INTO spotify_playlists VALUES (?, ?, ?)",
+                   (url, spotify_playlist["snapshot_id"], json.dumps(spotify_playlist)))
+
+    return
+
+
 _CACHE_SPOTIFY_PLAYLIST = {}
-def fetch_spotify_playlist(url: str) -> dict :
+def fetch_spotify_playlist(cabot_config: CabotConfig, url: str, persist: bool=True) -> dict :
+    """
+    The playlist (every page of it) is persisted with its snapshot ID, so it is only fetched again when it changed.
+    With `persist` off (plan mode), the new snapshot is neither saved nor memoized.
+    Besides Spotify's fields, the returned dict holds :
+        - "unchanged" : Is the snapshot the same as the last run's (bool)
+        - "added" / "removed" : Track keys added / removed since the last run (list[str])
+    """
 
     if url in _CACHE_SPOTIFY_PLAYLIST :
         return _CACHE_SPOTIFY_PLAYLIST[url]
 
+    with span("fetch_playlist", "spotify", url=url) as trace_args :
+        spotify_playlist = _fetch_spotify_playlist(cabot_config, url, persist)
+        trace_args["unchanged"] = spotify_playlist["unchanged"]
+
+    # Memoize
+    if persist :
+        _CACHE_SPOTIFY_PLAYLIST[url] = spotify_playlist
+
+    return spotify_playlist
+
+
+def _fetch_spotify_playlist(cabot_config: CabotConfig, url: str, persist: bool=True) -> dict :
+
     # Login
-    spotify_client_id = get_cabot_config_value(["spotify", "client_id"])
-    spotify_client_secret = get_cabot_config_value(["spotify", "client_secret"])
     sp = Spotify(client_credentials_manager=SpotifyClientCredentials(
-        client_id=spotify_client_id, 
-        client_secret=spotify_client_secret
+        client_id=cabot_config.spotify_client_id, 
+        client_secret=cabot_config.spotify_client_secret
     ))
 
-    # Fetch
-    spotify_playlist = sp.playlist(url)
+    # Check snapshot
+    with API_LIMITER :
+        spotify_playlist = sp.playlist(url, fields="name,snapshot_id")
 
-    # Memoize
-    _CACHE_SPOTIFY_PLAYLIST[url] = spotify_playlist
+    stored = _load_spotify_snapshot(url)
+    if (stored is not None) and (stored[0] == spotify_playlist["snapshot_id"]) :
 
+        spotify_playlist = stored[1]
+        spotify_playlist |= {"unchanged": True, "added": [], "removed": []}
+    
+    else :
+
+        # Fetch every page
+        items = []
+        next_page = True
+        while next_page :
+            with API_LIMITER :
+                page = sp.playlist_items(url,
+                                         fields=SPOTIFY_ITEMS_FIELDS,
+                                         limit=SPOTIFY_PAGE_SIZE,
+                                         offset=len(items),
+                                         additional_types=("track",))
+            items.extend(page["items"])
+            next_page = (page["next"] is not None) and (len(page["items"]) > 0)
+        
+        # Local files and unavailable tracks have no track data
+        spotify_playlist["tracks"] = {"items": [item for item in items if item["track"] is not None]}
+        if persist :
+            _save_spotify_snapshot(url, spotify_playlist)
+
+        # Delta
+        tracks_keys = [spotify_track_key(item["track"]) for item in spotify_playlist["tracks"]["items"]]
+        previous_tracks_keys = [] if stored is None else [spotify_track_key(item["track"]) for item in stored[1]["tracks"]["items"]]
+        set_tracks_keys, set_previous_tracks_keys = set(tracks_keys), set(previous_tracks_keys)
+
+        spotify_playlist |= {
+            "unchanged": False,
+            "added": [k for k in tracks_keys if k not in set_previous_tracks_keys],
+            "removed": [k for k in previous_tracks_keys if k not in set_tracks_keys],
+        }
 
     return spotify_playlist
 
 
 async def rip_spotify_playlist(
+        cabot_config: CabotConfig,
         spotify_playlist: dict,
         memory: set[str],
         offset: int,
-        limit: int=25) -> tuple[dict[str, str],
-                                dict[str, str],
+        download_folder: Path,
+        limit: int=25,
+        progress: bool=True,
+        recheck_missing: bool=False) -> tuple[dict[str, str],
                                 set[str],
                                 int,
                                 bool] :
     """
+    Downloaded tracks are tagged with their searched ISRC (Spotify), or their fallback query when they have none.
     Returns :
-        - Found (on Qobuz) ISRC -> Searched ISRC (Spotify) corresponding dict (dict[str, str])
         - Failed tracks, storing ISRC as well as title - artists (dict[str, str])
         - Memory match (set[str])
         - Next track index to process (int)
@@ -145,7 +483,7 @@ async def rip_spotify_playlist(
             name: str,
             album: str,
             artists: list[str],
-            isrc: str,
+            isrc: str|None,
             track_idx: int,
             client: Client,
             search_status: Status,
@@ -155,7 +493,7 @@ async def rip_spotify_playlist(
             - Track index in the playlist (int)
             - Qobuz's track id (str), None if not found
             - Found ISRC (Qobuz), query for fallback if not found (str) 
-            - Searched ISRC (Spotify) (str)
+            - Searched ISRC (Spotify), fallback query for tracks without ISRC (str)
         """
 
         async def __get_track_from_album(
@@ -164,7 +502,8 @@ async def rip_spotify_playlist(
                 client: Client=client) -> tuple[str, str] | None :
 
             status, tracklist_request = await client._api_request("album/get", {"album_id": album_id})
-            assert status == 200
+            if status != 200 :
+                return None
 
             tracks = tracklist_request["tracks"]["items"]
             track_id_by_name = {track["title"]: (track["id"], track["isrc"]) for track in tracks}
@@ -190,7 +529,8 @@ async def rip_spotify_playlist(
             # Query artist
             #
             status, artist_request = await client._api_request("artist/search", {"query": artist, "limit": 1})
-            assert status == 200
+            if status != 200 :
+                return None
 
             results = artist_request["artists"]["items"]
             if len(results) == 0 :
@@ -202,7 +542,8 @@ async def rip_spotify_playlist(
             # Fetch artist discography
             #
             status, albums_request = await client._api_request("artist/page", {"artist_id": artist_id})
-            assert status == 200
+            if status != 200 :
+                return None
 
             albums = []
             releases_by_types = albums_request["releases"]
@@ -246,12 +587,37 @@ async def rip_spotify_playlist(
             return await __get_track_from_album(album_id)
 
 
-        with ExitStack() as stack:
+        def __outcome(strategy: str, cached: bool=False) -> None :
 
-            stack.callback(callback)
+            trace_args["strategy"] = strategy
+            trace_args["cached"] = cached
+            TRACKS_RESOLVED.inc(strategy=strategy, cached=str(cached).lower())
+
+            return
+
+
+        def __found(
+                track_id: str,
+                found_isrc: str,
+                strategy: str,
+                cached: bool=False) -> tuple[int, str, str, str] :
+
+            if not cached :
+                save_resolution(key, track_id, found_isrc, strategy)
+
+            __outcome(strategy, cached)
+
+            search_status.found += 1
+            return track_idx, str(track_id), found_isrc, isrc or fallback_query
+
+
+        async def __search() -> tuple[str, str, str] | None :
+            """
+            Returns Qobuz's track id, found ISRC and the strategy that found it, None if not found.
+            """
 
             # Search by ISRC first
-            pages = await client.search("track", isrc, limit=1)
+            pages = await client.search("track", isrc, limit=1) if isrc else []
             if len(pages) > 0:
                 
                 results = pages[0]["tracks"]["items"]
@@ -259,8 +625,7 @@ async def rip_spotify_playlist(
                     found_isrc = results[0]["isrc"]
 
                     if found_isrc == isrc :
-                        search_status.found += 1
-                        return track_idx, results[0]["id"], found_isrc, isrc
+                        return results[0]["id"], found_isrc, "isrc"
             
             # If not conclusive, tries by title - artists
             pages = await client.search("track", f"{name} {' '.join(artists)}", limit=1)
@@ -270,8 +635,7 @@ async def rip_spotify_playlist(
                     found_isrc = results[0]["isrc"]
 
                     if (results[0]["title"] == name) and any(a in results[0]["performers"] for a in artists) :
-                        search_status.found += 1
-                        return track_idx, results[0]["id"], found_isrc, isrc
+                        return results[0]["id"], found_isrc, "title_artists"
             
             # Else, tries by album - artist
             pages = await client.search("album", f"{album} {' '.join(artists)}", limit=1)
@@ -285,50 +649,76 @@ async def rip_spotify_playlist(
                         if not res_from_album is None :
                             track_id, found_isrc = res_from_album
 
-                            search_status.found += 1
-                            return track_idx, track_id, found_isrc, isrc
+                            return track_id, found_isrc, "album_artists"
 
             # Lastly, trie by artist > album > track
             res_from_artist = await __query_by_artist_album_track()
             if not res_from_artist is None :
                 track_id, found_isrc = res_from_artist
 
-                search_status.found += 1
-                return track_idx, track_id, found_isrc, isrc
+                return track_id, found_isrc, "artist_discography"
+
+            return None
+
+
+        key = resolution_key(isrc, name, artists)
+        fallback_query = f"{name} - {', '.join(artists)}"
+
+        async with AsyncExitStack() as stack:
+
+            stack.callback(callback)
+            trace_args = stack.enter_context(span("search", "qobuz", isrc=isrc))
+
+            # Already resolved by a previous run
+            resolution = get_resolution(key, resolution_ttl_days)
+            if resolution is not None :
+                track_id, found_isrc, strategy = resolution
+                return __found(track_id, found_isrc, strategy, cached=True)
+
+            # Recently missing from Qobuz
+            if (not recheck_missing) and is_known_missing(key, missing_recheck_days) :
+                __outcome("known_missing", cached=True)
+                search_status.failed += 1
+                return track_idx, None, fallback_query, isrc or fallback_query
+
+            try :
+                search_result = await __search()
+            except (RequestError, AssertionError) :
+                # The API failed rather than the track being missing, don't remember it as missing
+                __outcome("error")
+                search_status.failed += 1
+                return track_idx, None, fallback_query, isrc or fallback_query
+
+            if search_result is not None :
+                return __found(*search_result)
 
             # Fail
+            record_miss(key)
+            __outcome("not_found")
             search_status.failed += 1
-            fallback_query = f"{name} - {', '.join(artists)}"
-
-            return track_idx, None, fallback_query, isrc
 
+            return track_idx, None, fallback_query, isrc or fallback_query
 
-    # Fetch config values
-    download_folder = Path(get_cabot_config_value(["tmp_folder"]))
-    qobuz_email = get_cabot_config_value(["qobuz", "email"])
-    qobuz_token = get_cabot_config_value(["qobuz", "token"])
-    quality = get_cabot_config_value(["qobuz", "quality"])
 
     playlist_title = spotify_playlist["name"]
     playlist_length = len(spotify_playlist["tracks"]["items"])
 
-    # Log in to qobuz client
-    config = Config.defaults()
-    config.session.qobuz.email_or_userid = qobuz_email
-    config.session.qobuz.password_or_token = qobuz_token
-    config.session.qobuz.use_auth_token = True
-    config.session.qobuz.quality = quality
-    client = QobuzClient(config)
+    resolution_ttl_days = cabot_config.resolution_cache_ttl_days
+    missing_recheck_days = cabot_config.missing_recheck_days
 
-    await client.login()
+    # Logged in qobuz client, shared by the whole run
+    client = await get_qobuz_client(cabot_config)
+    config = client.config
+    config.session.cli.progress_bars = progress
 
 
     # Fetch Qobuz ids
     s = Status(0, 0, playlist_length)
-    with console.status(s.text(), spinner="moon") as status:
+    with (console.status(s.text(), spinner="moon") if progress else nullcontext()) as status:
         
         def callback():
-            status.update(s.text())
+            if status is not None :
+                status.update(s.text())
 
         requests = []
         memory_match = set()
@@ -344,26 +734,22 @@ async def rip_spotify_playlist(
             title = item["track"]["name"]
             album = item["track"]["album"]["name"]
             artists = [a["name"] for a in item["track"]["artists"]]
-            
-            if "isrc" in item["track"]["external_ids"] : 
-                isrc = item["track"]["external_ids"]["isrc"]
-
-                if not isrc in memory :
 
-                    # Query track in Qobuz
-                    requests.append(_make_query(title, album, artists, isrc, next_track, client, s, callback))
-                    requested_tracks += 1
-                
-                else :
+            # Tracks without ISRC are searched by title - artists only
+            isrc = item["track"]["external_ids"].get("isrc")
+            track_key = spotify_track_key(item["track"])
 
-                    # Memorized track in the Spotify playlist
-                    memory_match |= {isrc}
-                    s.found += 1
+            if not track_key in memory :
 
+                # Query track in Qobuz
+                requests.append(_make_query(title, album, artists, isrc, next_track, client, s, callback))
+                requested_tracks += 1
+            
             else :
-                fallback_query = f"{title} - {', '.join(artists)}"
-                failed_tracks[fallback_query] = None
-                s.failed += 1
+
+                # Memorized track in the Spotify playlist
+                memory_match |= {track_key}
+                s.found += 1
             
             next_track += 1
 
@@ -372,17 +758,16 @@ async def rip_spotify_playlist(
 
 
     # Database
-    db = Database(Downloads(DEFAULT_DOWNLOADS_DB_PATH), Dummy())
+    os.makedirs(download_folder, exist_ok=True)
+    db = Database(Downloads(str(download_folder / DOWNLOADS_DB_NAME)), Dummy())
 
 
     # Build qobuz playlist
-    memory_id_by_isrc = {}
     pending_tracks = []
     for pos, qobuz_id, found, searched_isrc in results :
         if not qobuz_id is None :
-            found_isrc = found
             pending_tracks.append(
-                    PendingPlaylistTrack(
+                    LimitedPendingPlaylistTrack(
                         qobuz_id,
                         client,
                         config,
@@ -390,8 +775,8 @@ async def rip_spotify_playlist(
                         playlist_title,
                         pos+1,
                         db,
+                        searched_isrc,
                     ))
-            memory_id_by_isrc[found_isrc] = searched_isrc
         else :
             fallback_query = found
             failed_tracks[fallback_query] = searched_isrc
@@ -400,20 +785,46 @@ async def rip_spotify_playlist(
     
 
     # Rip the playlist
-    await qobuz_playlist.rip()
-
-
-    # Close the session
-    await client.session.close()
+    with span("download_batch", "qobuz", tracks=len(pending_tracks)) :
+        await qobuz_playlist.rip()
 
 
-    return memory_id_by_isrc, failed_tracks, memory_match, next_track, (next_track == playlist_length)
+    return failed_tracks, memory_match, next_track, (next_track == playlist_length)
 
 # endregion
 
 
 # region SOUNDCLOUD
 
+# region |---| Client
+class ScheduledSoundcloudClient(SoundcloudClient) :
+    """
+    Soundcloud client whose API requests go through SOUNDCLOUD_SCHEDULER (bounded and retried).
+    """
+
+    async def _api_request(self, path: str, params: dict|None=None, headers: dict|None=None) -> tuple[dict, int] :
+
+        async def _send() -> tuple[int, dict] :
+            resp, status = await SoundcloudClient._api_request(self, path, params=params, headers=headers)
+            return status, resp
+
+        status, resp = await SOUNDCLOUD_SCHEDULER.request(_send)
+
+        return resp, status
+
+
+async def get_soundcloud_client() -> ScheduledSoundcloudClient :
+
+    config = Config.defaults()
+    config.session.downloads.requests_per_minute = 0 # Rate handled by SOUNDCLOUD_SCHEDULER instead
+    client = ScheduledSoundcloudClient(config)
+
+    await client.login()
+
+    return client
+
+# endregion
+
 # region |---| Fetch
 _CACHE_SOUNDCLOUD_PLAYLIST = {}
 async def fetch_soundcloud_playlist(url: str) -> dict :
@@ -421,18 +832,17 @@ async def fetch_soundcloud_playlist(url: str) -> dict :
     if url in _CACHE_SOUNDCLOUD_PLAYLIST :
         return _CACHE_SOUNDCLOUD_PLAYLIST[url]
 
-    # Log in to soundcloud client
-    config = Config.defaults()
-    client = SoundcloudClient(config)
+    with span("fetch_playlist", "soundcloud", url=url) :
 
-    await client.login()
+        # Log in to soundcloud client
+        client = await get_soundcloud_client()
 
-    # Fetch playlist
-    requested_playlist = await client.resolve_url(url)
-    full_playlist = await client._get_playlist(requested_playlist["id"])
+        # Fetch playlist
+        requested_playlist = await client.resolve_url(url)
+        full_playlist = await client._get_playlist(requested_playlist["id"])
 
     # Memoize
-    _CACHE_SOUNDCLOUD_PLAYLIST[url] = requested_playlist
+    _CACHE_SOUNDCLOUD_PLAYLIST[url] = full_playlist
 
     # Close the session
     await client.session.close()
@@ -443,30 +853,59 @@ async def fetch_soundcloud_playlist(url: str) -> dict :
 
 # region |---| Search and build
 async def build_soundcloud_playlist(
+        cabot_config: CabotConfig,
         fallback_queries: dict[str, str],
-        playlist_title: str) -> tuple[dict,
-                                      list[str]] :
+        playlist_title: str,
+        recheck_missing: bool=False) -> tuple[dict,
+                                              list[str]] :
+    """
+    Search results are cached, rejected ones (nothing found, demo, full set...) for `missing_recheck_days` only.
+    """
     
     async def _make_query(
             query: str,
-            spotify_isrc: str) -> tuple[dict, str] :
-        res = await client.search("track", query, limit=1)
-        return res, query, spotify_isrc
+            spotify_isrc: str) -> tuple[dict | None, str, str] :
 
+        try :
+            with span("search", "soundcloud", query=query) :
+                res = await client.search("track", query, limit=1)
+        except (RequestError, AssertionError) :
+            # Not cached, the search failed rather than found nothing
+            return None, query, spotify_isrc
 
-    # Search tracks
-    config = Config.defaults()
-    client = SoundcloudClient(config)
+        found = res[0]["collection"]
+        track = found[0] if len(found) > 0 else None
 
-    await client.login()
+        # Avoid demo and full sets
+        accepted = (track is not None) and (MIN_FALLBACK_TRACK_DURATION < track["duration"] < MAX_FALLBACK_TRACK_DURATION)
+        save_fallback_search(query, track, accepted)
+
+        return (track if accepted else None), query, spotify_isrc
 
+
+    resolution_ttl_days = cabot_config.resolution_cache_ttl_days
+    missing_recheck_days = 0 if recheck_missing else cabot_config.missing_recheck_days
+
+    # Cached searches
+    res = []
     requests = []
     for query, spotify_isrc in fallback_queries.items() :
-        requests.append(_make_query(query, spotify_isrc))
-    
-    res = await asyncio.gather(*requests)
 
-    await client.session.close()
+        cached = get_fallback_search(query, resolution_ttl_days, missing_recheck_days)
+        if cached is not None :
+            track, accepted = cached
+            res.append(((track if accepted else None), query, spotify_isrc))
+        else :
+            requests.append((query, spotify_isrc))
+
+    # Search tracks
+    if requests :
+
+        client = await get_soundcloud_client()
+
+        res += await asyncio.gather(*[_make_query(query, spotify_isrc) for query, spotify_isrc in requests])
+
+        await client.session.close()
 
     # Build playlist
     playlist = {
@@ -476,11 +915,7 @@ async def build_soundcloud_playlist(
     double_failed = []
     for track, query, spotify_isrc in res :
         
-        found = track[0]["collection"]
-        
-        # Avoid demo and full sets
-        if len(found) > 0 and (MIN_FALLBACK_TRACK_DURATION < found[0]["duration"] < MAX_FALLBACK_TRACK_DURATION) :
-            track = found[0]
+        if track is not None :
             track["isrc"] = spotify_isrc    # This allows to keep track of the originally searched isrc
             playlist["tracks"].append(track)
         else :
@@ -492,9 +927,11 @@ async def build_soundcloud_playlist(
 
 # region |---| Rip
 async def rip_soundcloud_playlist(
+        cabot_config: CabotConfig,
         soundcloud_playlist: dict,
         memory: set[str],
         offset: int,
+        download_folder: Path,
         limit: int=10) -> tuple[list[str],
                                 set[str],
                                 int,
@@ -507,32 +944,21 @@ async def rip_soundcloud_playlist(
         - Is the playlist fully ripped (bool)
     """
 
-    # Fetch config value
-    download_folder = Path(get_cabot_config_value(["tmp_folder"]))
-
     playlist_title = soundcloud_playlist["title"]
     playlist_length = len(soundcloud_playlist["tracks"])
 
     # Downloads foalder
     downloaded_playlist_folder = download_folder / playlist_title
 
-    if not download_folder.exists() :
-        os.mkdir(download_folder)
     if not downloaded_playlist_folder.exists() : 
-        os.mkdir(downloaded_playlist_folder)
+        os.makedirs(downloaded_playlist_folder)
 
     memory_match = set()
 
-    if playlist_length :
-        print("Downloading from Soundcloud...")
-
-    # Extract URLs and RIP
-    memory_id_by_track_name = {}
-    failed_tracks = []
-    tracks_path = []
+    # Select the batch
+    batch = []
     next_track = offset
-    requested_tracks = 0
-    while (requested_tracks < limit) and (next_track < playlist_length) :
+    while (len(batch) < limit) and (next_track < playlist_length) :
 
         track = soundcloud_playlist["tracks"][next_track]
         
@@ -541,38 +967,75 @@ async def rip_soundcloud_playlist(
             track_id = track["isrc"] # Manually added original Spotify ISRC for memory management (fallback)
         
         if not track_id in memory :
-            
-            try :
-                path = await download(track["permalink_url"], audioFormat="wav", filenameStyle="nerdy", folder_path=str(downloaded_playlist_folder))
-            except :
-                failed_tracks.append(track["title"])
-            else :
-                memory_id_by_track_name[path.stem] = track_id
-                
-                tracks_path.append(path)
-                requested_tracks += 1
-
+            batch.append((track, track_id, next_track))
         else :
-
             memory_match |= {track_id}
         
         next_track += 1
     
-    if playlist_length :
+    # RIP concurrently
+    semaphore = asyncio.Semaphore(cabot_config.soundcloud_concurrency)
+
+    async def _download(track: dict, track_id: str, position: int) -> tuple[dict, str, int, Path | None] :
+        """
+        The track ID travels with the download, whatever order they finish in.
+        Each track is downloaded in its own folder, so that tracks with the same title don't overwrite each other.
+        """
+        async with semaphore, DOWNLOAD_LIMITER :
+            with span("download", "soundcloud", title=track["title"]) as trace_args :
+                try :
+                    track_folder = downloaded_playlist_folder / f".{position}"
+                    os.makedirs(track_folder, exist_ok=True)
+                    path = await asyncio.wait_for(download(track["permalink_url"],
+                                                           audioFormat="wav",
+                                                           filenameStyle="nerdy",
+                                                           folder_path=str(track_folder)),
+                                                  cabot_config.soundcloud_timeout)
+                except Exception as e :
+                    trace_args["error"] = type(e).__name__
+                    path = None
+
+        if (path is not None) and os.path.isfile(path) :
+            DOWNLOADED_BYTES.inc(os.path.getsize(path), source="soundcloud")
+
+        return track, track_id, position, path
+
+    if batch :
+        print("Downloading from Soundcloud...")
+
+    downloaded = await asyncio.gather(*[_download(track, track_id, position) for track, track_id, position in batch])
+
+    if batch :
         print("Downloading from Soundcloud...Done.")
 
+    memory_id_by_track_path = {}
+    failed_tracks = []
+    for track, track_id, position, path in downloaded :
+        if (path is None) or (not os.path.isfile(path)) :
+            failed_tracks.append(track["title"])
+        else :
+
+            # Back in the playlist folder, homonyms told apart by their position
+            track_path = downloaded_playlist_folder / Path(path).name
+            if any(track_path.with_suffix(suffix).exists() for suffix in (track_path.suffix, ".flac")) :
+                track_path = track_path.with_stem(f"{track_path.stem} ({position + 1})")
+            shutil.move(path, track_path)
+
+            memory_id_by_track_path[track_path] = track_id
+
+        shutil.rmtree(downloaded_playlist_folder / f".{position}", ignore_errors=True)
+
 
     # Convert to FLAC and tag track ID
-    for track in tracks_path :
+    for track_path, track_id in memory_id_by_track_path.items() :
 
         # In case of double
-        if track.exists() :
-            flac_track = convert_to_flac(track)
-            os.remove(track)
+        if track_path.exists() :
+            with span("to_flac", "convert", file=track_path.name) :
+                flac_track = convert_to_flac(track_path)
+                os.remove(track_path)
 
-            song_data = FLAC(flac_track)
-            song_data["COMMENT"] = str(memory_id_by_track_name[track.stem])
-            song_data.save()
+            tag_track_id(flac_track, str(track_id))
 
     return failed_tracks, memory_match, next_track, (next_track == playlist_length)
 
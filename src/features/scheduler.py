@@ -0,0 +1,209 @@
+import asyncio
+import aiohttp
+import contextlib
+import random
+import threading
+import time
+from typing import Awaitable, Callable
+from .limits import (
+    ConcurrencyLimiter,
+    DEFAULT_MAX_API_REQUESTS,
+    API_LIMITER,
+)
+from .metrics import (
+    API_REQUESTS,
+    API_REQUEST_SECONDS,
+    API_ERRORS,
+)
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RequestError(Exception) :
+    """
+    A request still failing after every retry.
+    """
+
+    def __init__(self, status: int|None, message: str="") -> None :
+        super().__init__(f"Request failed with status {status} {message}".strip())
+        self.status = status
+
+
+class AdaptiveScheduler :
+    """
+    Schedules the requests of an API for the whole run (every thread and event loop) :
+        - Token bucket, whose rate adapts to the API (halved on throttling, slowly increased otherwise),
+        - Concurrency adapting to the observed latency and error rate,
+        - Decreases applied once per window : errors of the requests sent before the last decrease don't decrease again,
+        - Retries with jittered exponential backoff on 429 and 5xx.
+    Each request also holds a slot of `run_limiter`, shared with the other services.
+    """
+
+    def __init__(
+            self,
+            service: str="api",
+            initial_rate: float=10.,
+            min_rate: float=0.5,
+            max_rate: float=50.,
+            initial_concurrency: int=8,
+            max_concurrency: int=DEFAULT_MAX_API_REQUESTS,
+            max_retries: int=5,
+            base_delay: float=0.5,
+            max_delay: float=30.,
+            run_limiter: ConcurrencyLimiter|None=None) -> None :
+
+        self._lock = threading.Lock()
+        self.service = service # Metrics label
+
+        # Token bucket
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self._tokens = 1.
+        self._refilled_at = time.monotonic()
+
+        # Concurrency
+        self.max_concurrency = max_concurrency
+        self._limiter = ConcurrencyLimiter(min(initial_concurrency, max_concurrency))
+        self._run_limiter = run_limiter or contextlib.nullcontext()
+        self._successes = 0
+        self._decreased_at = float("-inf")
+        self._latency = None
+        self._best_latency = None
+
+        # Retries
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        # Stats
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+
+    @property
+    def concurrency(self) -> int :
+        return self._limiter.limit
+
+    def configure(self, max_concurrency: int) -> None :
+
+        with self._lock :
+            self.max_concurrency = max_concurrency
+            self._limiter.set_limit(min(self._limiter.limit, max_concurrency))
+
+        return
+
+    # region |---| Token bucket
+
+    async def _take_token(self) -> None :
+
+        while True :
+            with self._lock :
+                now = time.monotonic()
+                self._tokens = min(max(1., self.rate), self._tokens + (now - self._refilled_at) * self.rate)
+                self._refilled_at = now
+
+                if self._tokens >= 1 :
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            await asyncio.sleep(wait)
+
+    # endregion
+
+    # region |---| Adaptation
+
+    def _on_success(self, latency: float) -> None :
+
+        with self._lock :
+
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+            self._best_latency = latency if self._best_latency is None else min(self._best_latency, latency)
+
+            # Adapt once per "round" of concurrent requests
+            self._successes += 1
+            if self._successes < self._limiter.limit :
+                return
+            self._successes = 0
+
+            # Additive increase, the rate only answers throttling
+            self.rate = min(self.max_rate, self.rate + 1)
+            if self._latency <= 2 * self._best_latency :
+                self._limiter.set_limit(min(self.max_concurrency, self._limiter.limit + 1))
+            else :
+                # The API is slowing down
+                self._limiter.set_limit(max(1, self._limiter.limit - 1))
+
+        return
+
+    def _on_error(self, status: int|None, sent_at: float) -> None :
+
+        with self._lock :
+
+            self.retries += 1
+            if status == 429 :
+                self.throttled += 1
+
+            # A burst of errors from the same window was already answered
+            if sent_at < self._decreased_at :
+                return
+            self._decreased_at = time.monotonic()
+
+            # Multiplicative decrease
+            if status == 429 :
+                self.rate = max(self.min_rate, self.rate / 2)
+            self._limiter.set_limit(max(1, self._limiter.limit // 2))
+            self._successes = 0
+
+        return
+
+    def _backoff(self, attempt: int) -> float :
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    # endregion
+
+    async def request(self, send: Callable[[], Awaitable[tuple[int, dict]]]) -> tuple[int, dict] :
+        """
+        `send` performs the request and returns its status and parsed response.
+        Statuses other than 429 and 5xx are returned as is, RequestError is raised once retries are exhausted.
+        """
+
+        for attempt in range(self.max_retries + 1) :
+
+            await self._take_token()
+
+            async with self._limiter, self._run_limiter :
+                start = time.monotonic()
+                try :
+                    status, resp = await send()
+                except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e :
+                    status, resp, error = None, {}, e
+                else :
+                    error = None
+                latency = time.monotonic() - start
+
+            with self._lock :
+                self.requests += 1
+
+            API_REQUESTS.inc(service=self.service, status="error" if status is None else status)
+            API_REQUEST_SECONDS.observe(latency, service=self.service)
+
+            if (error is None) and (status not in RETRY_STATUSES) :
+                self._on_success(latency)
+                return status, resp
+
+            API_ERRORS.inc(service=self.service, kind={None: "connection", 429: "throttled"}.get(status, "server_error"))
+            self._on_error(status, start)
+            if attempt < self.max_retries :
+                await asyncio.sleep(self._backoff(attempt))
+
+        API_ERRORS.inc(service=self.service, kind="exhausted")
+        raise RequestError(status, "" if error is None else f"({type(error).__name__}: {error})")
+
+
+# Shared by every client of the run, within the run-wide `--max-api-requests`
+QOBUZ_SCHEDULER = AdaptiveScheduler("qobuz", run_limiter=API_LIMITER)
+SOUNDCLOUD_SCHEDULER = AdaptiveScheduler("soundcloud", initial_rate=5., initial_concurrency=4, run_limiter=API_LIMITER)
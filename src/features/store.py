@@ -0,0 +1,185 @@
+import os
+import re
+import shutil
+from pathlib import Path
+from .database import transaction
+from .index import (
+    find_songs,
+    is_indexed,
+)
+from .rip import extract_track_id
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS track_store (
+    track_id TEXT NOT NULL,
+    format TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    PRIMARY KEY (track_id, format)
+)
+"""
+
+STORE_FOLDER_NAME = ".store"
+FOLDER_BY_FORMAT = {
+    ".aiff": "AIFF",
+    ".mp3": "MP3",
+}
+
+# region Utils
+
+def get_store_folder(playlists_folder: Path) -> Path :
+    """
+    Lives in the playlists folder, so that playlists can be hardlinked to it.
+    """
+    return playlists_folder / STORE_FOLDER_NAME
+
+
+def _store_path(store_folder: Path, track_id: str, format: str) -> Path :
+    return store_folder / f"{re.sub(r'[^A-Za-z0-9_-]', '_', track_id)}{format}"
+
+
+def _link_or_copy(source: Path, destination: Path) -> None :
+
+    try :
+        os.link(source, destination)
+    except OSError :
+        shutil.copy2(source, destination)
+
+    return
+
+# endregion
+
+
+# region Store
+
+def add_to_store(store_folder: Path, song: Path, track_id: str) -> None :
+    """
+    Shares `song` (and its variants in the other format folders) with every playlist.
+    """
+
+    if not store_folder.exists() :
+        os.makedirs(store_folder, exist_ok=True)
+
+    playlist_path = song.parent.parent
+
+    stored_rows = []
+    for format, folder_name in FOLDER_BY_FORMAT.items() :
+
+        variant = playlist_path / folder_name / f"{song.stem}{format}"
+        stored = _store_path(store_folder, track_id, format)
+        if (not variant.is_file()) or stored.exists() :
+            continue
+
+        _link_or_copy(variant, stored)
+        stored_rows.append((track_id, format, variant.name))
+
+    with transaction(_SCHEMA) as db :
+        db.executemany("INSERT OR REPLACE INTO track_store VALUES (?, ?, ?)", stored_rows)
+
+    return
+
+
+def add_converted_to_store(store_folder: Path, converted: list[Path]) -> None :
+
+    for song in converted :
+        if song.suffix == ".aiff" :
+            track_id = extract_track_id(song)
+            if track_id is not None :
+                add_to_store(store_folder, song, track_id)
+
+    return
+
+
+def get_stored_track_ids(store_folder: Path) -> set[str] :
+    """
+    IDs of the tracks any playlist can be linked to.
+    """
+
+    with transaction(_SCHEMA) as db :
+        rows = db.execute("SELECT track_id FROM track_store WHERE format = ?", (".aiff",)).fetchall()
+
+    return {track_id for track_id, in rows if _store_path(store_folder, track_id, ".aiff").is_file()}
+
+
+def link_from_store(
+        store_folder: Path,
+        track_ids: set[str],
+        playlist_path: Path,
+        formats: list[str]) -> set[str] :
+    """
+    Links the already downloaded tracks of `track_ids` into the playlist, instead of downloading them again.
+    Tracks downloaded for other playlists before the store existed are added to it on the way.
+    Returns the linked track IDs.
+    """
+
+    if not track_ids :
+        return set()
+
+    # Seed the store from other playlists
+    with transaction(_SCHEMA) as db :
+        rows = db.execute("SELECT track_id, format, file_name FROM track_store").fetchall()
+    stored_ids = {track_id for track_id, format, _ in rows if format == ".aiff"}
+
+    for track_id, song in find_songs(track_ids - stored_ids).items() :
+        add_to_store(store_folder, song, track_id)
+
+    with transaction(_SCHEMA) as db :
+        rows = db.execute("SELECT track_id, format, file_name FROM track_store").fetchall()
+    file_name_by_key = {(track_id, format): file_name for track_id, format, file_name in rows if track_id in track_ids}
+
+    linked = set()
+    for track_id in track_ids :
+
+        # AIFF is mandatory, other formats are linked if available
+        if (track_id, ".aiff") not in file_name_by_key :
+            continue
+
+        for format in formats :
+
+            if (track_id, format) not in file_name_by_key :
+                continue
+
+            stored = _store_path(store_folder, track_id, format)
+            destination = playlist_path / FOLDER_BY_FORMAT[format] / file_name_by_key[(track_id, format)]
+            if (not stored.is_file()) or destination.exists() :
+                continue
+
+            os.makedirs(destination.parent, exist_ok=True)
+            _link_or_copy(stored, destination)
+
+            if format == ".aiff" :
+                linked.add(track_id)
+
+    return linked
+
+
+def collect_store_garbage(store_folder: Path) -> int :
+    """
+    Removes stored tracks no playlist uses anymore.
+    Hardlinked tracks are used as long as they have other links, copied tracks as long as they are indexed.
+    Returns the number of removed files.
+    """
+
+    if not store_folder.is_dir() :
+        return 0
+
+    with transaction(_SCHEMA) as db :
+        rows = db.execute("SELECT track_id, format FROM track_store").fetchall()
+
+    removed_rows = []
+    for track_id, format in rows :
+
+        stored = _store_path(store_folder, track_id, format)
+        if stored.is_file() and ((stored.stat().st_nlink > 1) or is_indexed(track_id)) :
+            continue
+
+        if stored.exists() :
+            os.remove(stored)
+        removed_rows.append((track_id, format))
+
+    with transaction(_SCHEMA) as db :
+        db.executemany("DELETE FROM track_store WHERE track_id = ? AND format = ?", removed_rows)
+
+    return len(removed_rows)
+
+# endregion
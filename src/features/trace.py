@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import defaultdict
+from contextlib import AbstractContextManager, contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+class Tracer :
+    """
+    Collects the timing spans of the run, exported in Chrome's trace event format (Perfetto, chrome://tracing).
+    Spans of concurrent asyncio tasks get a lane of their own, so that every lane stays properly nested.
+    """
+
+    def __init__(self) -> None :
+        self._lock = threading.Lock()
+        self._events: list[dict] = []
+        self._lane_names: dict[tuple[int, int], str] = {}
+
+    def clear(self) -> None :
+
+        with self._lock :
+            self._events.clear()
+            self._lane_names.clear()
+
+        return
+
+    def _lane(self) -> tuple[int, str] :
+
+        try :
+            task = asyncio.current_task()
+        except RuntimeError :
+            task = None
+
+        if task is not None :
+            return id(task), task.get_name()
+
+        thread = threading.current_thread()
+        return thread.ident, thread.name
+
+    def record(
+            self,
+            name: str,
+            category: str,
+            start: float,
+            duration: float,
+            args: dict|None=None,
+            pid: int|None=None,
+            tid: int|None=None,
+            lane_name: str|None=None) -> None :
+        """
+        `start` is a `time.time()` timestamp and `duration` is in seconds.
+        Spans timed in another process (conversion workers) are recorded with its `pid`.
+        """
+
+        if tid is None :
+            tid, lane_name = self._lane()
+        pid = os.getpid() if pid is None else pid
+
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round(start * 1e6),
+            "dur": round(duration * 1e6),
+            "pid": pid,
+            "tid": tid,
+            "args": args or {},
+        }
+
+        with self._lock :
+            self._events.append(event)
+            if lane_name is not None :
+                self._lane_names.setdefault((pid, tid), lane_name)
+
+        return
+
+    @contextmanager
+    def span(self, name: str, category: str="cabot", **args) -> Iterator[dict] :
+        """
+        Yields the span's arguments, so results (strategy, number of files...) can be added to them.
+        """
+
+        start = time.time()
+        counter = time.perf_counter()
+        try :
+            yield args
+        finally :
+            self.record(name, category, start, time.perf_counter() - counter, args)
+
+    def events(self) -> list[dict] :
+
+        with self._lock :
+            events = list(self._events)
+            lane_names = dict(self._lane_names)
+
+        metadata = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": lane_name}}
+                    for (pid, tid), lane_name in lane_names.items()]
+
+        return metadata + events
+
+    def export(self, path: Path) -> None :
+
+        with open(path, "w") as f :
+            json.dump({"traceEvents": self.events(), "displayTimeUnit": "ms"}, f)
+
+        return
+
+    def summary(self) -> dict[tuple[str, str], tuple[int, float, float]] :
+        """
+        Returns (category, name) -> (count, total seconds, longest seconds).
+        """
+
+        with self._lock :
+            events = list(self._events)
+
+        summary = defaultdict(lambda: (0, 0., 0.))
+        for event in events :
+            count, total, longest = summary[(event["cat"], event["name"])]
+            duration = event["dur"] / 1e6
+            summary[(event["cat"], event["name"])] = (count + 1, total + duration, max(longest, duration))
+
+        return dict(summary)
+
+    def print_summary(self) -> None :
+        """
+        Concurrent spans add up, so a stage can total more than the run itself.
+        """
+
+        summary = self.summary()
+        if not summary :
+            return
+
+        print(f"{'Stage':<36} {'Count':>7} {'Total (s)':>10} {'Mean (s)':>9} {'Max (s)':>9}")
+        for (category, name), (count, total, longest) in sorted(summary.items(), key=lambda item: -item[1][1]) :
+            print(f"{f'{category}/{name}':<36} {count:>7} {total:>10.2f} {total / count:>9.3f} {longest:>9.3f}")
+        print("")
+
+        return
+
+
+# Shared by every thread of the run
+TRACER = Tracer()
+
+
+def span(name: str, category: str="cabot", **args) -> AbstractContextManager[dict] :
+    return TRACER.span(name, category, **args)
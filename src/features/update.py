@@ -2,55 +2,86 @@ import os
 import asyncio
 from pathlib import Path
 import shutil
-from .config import (
-    get_cabot_config_value,
-)
-from streamrip.config import DEFAULT_DOWNLOADS_DB_PATH
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Callable
+from mutagen import MutagenError
+from mutagen.flac import FLAC
+from .config import CabotConfig
 from streamrip.progress import (
     _p,
 )
 from .convert import (
-    convert_batch_to_aiff,
-    convert_batch_to_mp3,
+    convert_batch_to_formats,
+    convert_files_to_formats,
 )
 from .rip import (
     rip_spotify_playlist,
     rip_soundcloud_playlist,
     fetch_spotify_playlist,
     fetch_soundcloud_playlist,
-    tag_track_id_by_track_isrc,
+    spotify_track_key,
+    spotify_tracks_to_sync,
     extract_track_id,
     build_soundcloud_playlist,
+    close_qobuz_clients,
+    DOWNLOADS_DB_NAME,
+)
+from .limits import (
+    API_LIMITER,
+    DOWNLOAD_LIMITER,
+)
+from .scheduler import (
+    QOBUZ_SCHEDULER,
+    SOUNDCLOUD_SCHEDULER,
+)
+from .index import (
+    index_folder,
+    remove_song,
+)
+from .store import (
+    get_store_folder,
+    add_converted_to_store,
+    link_from_store,
+    collect_store_garbage,
 )
 from .key import (
-    write_keys_in_flac,
+    analyse_keys_in_flac,
 )
+from .trace import span
+from .journal import (
+    record_staged_batch,
+    complete_batch,
+    get_staged_batches,
+    record_deletions,
+    complete_deletions,
+    get_pending_deletions,
+    clear_journal,
+)
+from .metrics import (
+    TRACKS_DELETED,
+    FALLBACK_TRACKS,
+    DOUBLE_FAILED_TRACKS,
+)
+
+
+STAGING_FOLDER_NAME = ".staging"
+STALE_MP3_TOLERANCE = 2 # seconds, AIFF and MP3 converted from the same source are not written at the exact same time
+MAX_PENDING_BATCHES = 1 # Batches downloaded but not converted yet, caps tmp disk usage
 
 # region SCAN
 
 def scan_playlist(playlist_path: Path) -> set[str] :
-    
-    def _remember_song_id(song: Path, memory: set[str]) -> set[str] :
 
-        if song.suffix != ".aiff" :
-            return memory
-        
-        song_id = extract_track_id(song)
+    memory = set()
+    for song, song_id in index_folder(playlist_path).items() :
+
         if song_id is None :
-            os.remove(song)
+            remove_song(song)
+            continue
 
         memory |= {song_id}
 
-        return memory
-    
-
-    if not playlist_path.is_dir() :
-        return set()
-
-    memory = set()
-    for song in playlist_path.iterdir() :
-        memory = _remember_song_id(song, memory)
-
     return memory
 
 # endregion
@@ -58,68 +89,275 @@ def scan_playlist(playlist_path: Path) -> set[str] :
 
 # region CLEAN
 
-def remove_deleted_tracks(
+def find_deleted_tracks(
         playlist_path: Path,
-        unmatched_tracks: set[str]) -> None :
+        unmatched_tracks: set[str]) -> list[Path] :
+    """
+    Untagged songs, and songs of `unmatched_tracks`.
+    """
     
     assert playlist_path.is_dir(), f"{playlist_path} n'est pas un dossier."
 
     aiff = playlist_path / "AIFF"
     if not aiff.exists() :
-        return
+        return []
     
-    for song in aiff.iterdir() :
+    return [song for song, song_id in index_folder(aiff).items() if (song_id is None) or (song_id in unmatched_tracks)]
 
-        song_id = extract_track_id(song)
-        if (song_id is None) or (song_id in unmatched_tracks) :
 
-            os.remove(song)
-            mp3_track = playlist_path / "MP3" / f"{song.stem}.mp3"
-            if mp3_track.exists() :
-                os.remove(mp3_track)
-    
+def remove_tracks(songs: list[Path]) -> int :
+    """
+    Removes the AIFF `songs` and their MP3 copy.
+    Returns the number of removed tracks, already removed ones are skipped.
+    """
+
+    removed = 0
+    for song in songs :
+
+        if not song.exists() :
+            continue
+
+        remove_song(song)
+        mp3_track = song.parent.parent / "MP3" / f"{song.stem}.mp3"
+        if mp3_track.exists() :
+            os.remove(mp3_track)
+        removed += 1
+
+    return removed
+
+
+def remove_deleted_tracks(
+        playlist_path: Path,
+        unmatched_tracks: set[str]) -> int :
+    """
+    Returns the number of removed tracks.
+    """
+
+    return remove_tracks(find_deleted_tracks(playlist_path, unmatched_tracks))
+
+# endregion
+
+
+# region BACKFILL
+
+def find_missing_mp3(playlist_path: Path) -> list[Path] :
+    """
+    AIFF songs whose MP3 copy is missing, or older than them.
+    """
+
+    aiff = playlist_path / "AIFF"
+    if not aiff.is_dir() :
+        return []
+
+    missing = []
+    for song in aiff.glob("*.aiff") :
+        mp3_track = playlist_path / "MP3" / f"{song.stem}.mp3"
+        if (not mp3_track.exists()) or (mp3_track.stat().st_mtime < song.stat().st_mtime - STALE_MP3_TOLERANCE) :
+            missing.append(song)
+
+    return missing
+
+
+def backfill_mp3(playlist_path: Path, jobs: int|None=None) -> list[Path] :
+    """
+    Converts the AIFF songs of the playlist (and of its fallback folder) missing their MP3 copy, without downloading anything.
+    Returns the created MP3 files.
+    """
+
+    converted = []
+    for folder in (playlist_path, playlist_path / "fallback") :
+        converted += convert_files_to_formats(find_missing_mp3(folder), {".mp3": folder / "MP3"}, jobs)
+
+    return converted
+
+
+def backfill_playlists(cabot_config: CabotConfig, playlists_to_backfill: list[str]|None=None) -> None :
+
+    playlists_to_backfill = playlists_to_backfill or list(cabot_config.playlists.keys())
+
+    for playlist in playlists_to_backfill :
+        assert playlist in cabot_config.playlists, f"{playlist} is not configured, please fill `config.json` correctly."
+
+    for playlist in playlists_to_backfill :
+
+        playlist_path = cabot_config.playlists_folder / playlist.replace("/", " ")
+
+        print(f"Converting missing MP3 copies of {playlist}...", end="\r")
+        converted = backfill_mp3(playlist_path, cabot_config.jobs)
+        print(f"Converting missing MP3 copies of {playlist}...Done ({len(converted)} files).")
+
     return
 
 # endregion
 
 
+# region PIPELINE
+
+class ConversionPipeline :
+    """
+    Runs the conversion stage of a batch in a background thread while the next batch downloads.
+    Submitting blocks as long as `max_pending` batches are still being converted.
+    """
+
+    def __init__(self, process: Callable[..., None], max_pending: int=MAX_PENDING_BATCHES) -> None :
+        self._process = process
+        self._max_pending = max_pending
+        self._pending: deque[Future] = deque()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, *args) -> None :
+
+        while len(self._pending) >= self._max_pending :
+            self._pending.popleft().result()
+
+        self._pending.append(self._executor.submit(self._process, *args))
+
+        return
+
+    def join(self) -> None :
+
+        try :
+            while self._pending :
+                self._pending.popleft().result()
+        finally :
+            self._executor.shutdown()
+
+        return
+
+
+def stage_downloaded_batch(download_path: Path, batch_name: str) -> Path | None :
+    """
+    Moves the freshly downloaded playlist folder aside, so the next batch can be downloaded while this one is converted.
+    """
+
+    if not download_path.exists() :
+        return None
+
+    downloaded = [f for f in download_path.iterdir() if f.is_dir() and f.name != STAGING_FOLDER_NAME]
+    if len(downloaded) == 0 :
+        return None
+
+    staged_batch = download_path / STAGING_FOLDER_NAME / batch_name
+    os.makedirs(staged_batch, exist_ok=True)
+    for folder in downloaded :
+        shutil.move(folder, staged_batch / folder.name)
+
+    return staged_batch
+
+
+def _is_complete_download(track: Path) -> bool :
+    """
+    The track ID is tagged last : once Qobuz tracks are downloaded and tagged by streamrip, once Soundcloud tracks are converted to FLAC.
+    """
+
+    if track.suffix != ".flac" :
+        return False
+
+    try :
+        track_data = FLAC(track)
+    except MutagenError :
+        return False
+
+    return "COMMENT" in track_data
+
+
+def discard_partial_downloads(download_path: Path) -> set[str] :
+    """
+    Removes the audio files of an interrupted run that were not fully downloaded (or converted to FLAC),
+    the other ones are staged with the next batch.
+    Returns the track IDs of the kept tracks.
+    """
+
+    if not download_path.exists() :
+        return set()
+
+    kept = set()
+    for folder in download_path.iterdir() :
+
+        if (not folder.is_dir()) or (folder.name == STAGING_FOLDER_NAME) :
+            continue
+
+        for track in folder.iterdir() :
+            if track.suffix not in (".flac", ".wav") :
+                continue
+
+            if _is_complete_download(track) :
+                kept |= {extract_track_id(track)}
+            else :
+                os.remove(track)
+
+    return kept
+
+# endregion
+
+
 # region UPDATE
 
 def update_one_playlist(
+        cabot_config: CabotConfig,
         playlist: str, 
-        sources: dict[str, str],
         download_path: Path,
-        playlists_folder: Path,
-        duplicate_to_mp3: bool) -> None :
+        progress: bool=True,
+        recheck_missing: bool=False,
+        resume: bool=False) -> None :
+    """
+    With `resume`, the interrupted run's pending deletions are replayed, and the tracks it fully downloaded are converted
+    rather than downloaded again.
+    """
+
+    sources = cabot_config.playlists[playlist]
+    playlists_folder = cabot_config.playlists_folder
+    duplicate_to_mp3 = cabot_config.mp3_copy
+    analyse_key = cabot_config.analyse_key
+    jobs = cabot_config.jobs
+
+    # region |---| Analyse and Convert
+
+    def _convert_staged_batch(
+            playlist_path: Path,
+            staged_batch: Path,
+            duplicate_to_mp3: bool=duplicate_to_mp3,
+            analyse_key: bool=analyse_key,
+            jobs: int|None=jobs) -> None :
+
+        for downloaded_playlist in staged_batch.iterdir() :
+
+            # Write key in FLAC metadata, carried over by the conversion
+            if analyse_key :
+                with span("key_batch", "key", batch=staged_batch.name) as trace_args :
+                    trace_args["files"] = len(analyse_keys_in_flac(downloaded_playlist, jobs))
+
+            # Tracks are tagged and sanitized once downloaded
+            output_folder_by_format = {".aiff": playlist_path / "AIFF"}
+            if duplicate_to_mp3 :
+                output_folder_by_format[".mp3"] = playlist_path / "MP3"
+            with span("convert_batch", "convert", batch=staged_batch.name) as trace_args :
+                converted = convert_batch_to_formats(downloaded_playlist, [".flac"], output_folder_by_format, jobs, sanitize=False)
+                trace_args["files"] = len(converted)
+            print(f"Converting {staged_batch.name}...Done ({len(converted)} files).")
+
+            # Share with other playlists, fallback tracks are only guesses
+            if playlist_path != fallback_path :
+                with span("store", "store", batch=staged_batch.name) :
+                    add_converted_to_store(store_folder, converted)
+
+        shutil.rmtree(staged_batch)
+        complete_batch(staged_batch)
 
-    # region |---| Tag and Convert
+        return
+    
 
-    def _tag_and_convert(
-            found_searched_isrc_dict: dict[str, str],
+    def _stage_and_convert(
             playlist_path: Path,
-            download_path: Path=download_path,
-            duplicate_to_mp3: bool=duplicate_to_mp3) -> None :
+            batch_name: str,
+            download_path: Path=download_path) -> None :
 
-        # Check new downloads
-        if not download_path.exists() :
-            return
-        if len(list(download_path.iterdir())) == 0 :
+        staged_batch = stage_downloaded_batch(download_path, batch_name)
+        if staged_batch is None :
             return
         
-        downloaded_playlist = next(download_path.iterdir()) # Goes inside playlist folder
-
-        # Tag the ID in metadata
-        tag_track_id_by_track_isrc(found_searched_isrc_dict, downloaded_playlist)
-
-        # Convert
-        print("Converting...", end="\r")
-        convert_batch_to_aiff(downloaded_playlist, [".flac"], playlist_path / "AIFF")
-        if duplicate_to_mp3 :
-            # TODO Ensure already existing .aiff as converted in MP3 as well
-            convert_batch_to_mp3(downloaded_playlist, [".flac"], playlist_path / "MP3")
-        print("Converting...Done.")
-
-        shutil.rmtree(download_path)
+        record_staged_batch(playlist, staged_batch, playlist_path)
+        pipeline.submit(playlist_path, staged_batch)
 
         return
     
@@ -139,28 +377,74 @@ def update_one_playlist(
 
         if duplicate_to_mp3 :
             os.mkdir(playlist_path / "MP3")
+
+    # Tracks shared by several playlists are downloaded once
+    store_folder = get_store_folder(playlists_folder)
+    stored_formats = [".aiff", ".mp3"] if duplicate_to_mp3 else [".aiff"]
+
+    # Finish the interrupted run's work
+    resumed_downloads = set()
+    if resume :
+        print(f"Resuming...", end="\r")
+
+        with span("resume", "resume", playlist=playlist) :
+
+            pending_deletions = get_pending_deletions(playlist)
+            removed = remove_tracks(pending_deletions)
+            complete_deletions(pending_deletions)
+
+            resumed_downloads = discard_partial_downloads(download_path)
+
+            staged_batches = get_staged_batches(playlist)
+            for staged_batch, destination in staged_batches :
+                if staged_batch.exists() :
+                    _convert_staged_batch(destination, staged_batch)
+                else :
+                    complete_batch(staged_batch)
+
+        print(f"Resuming...Done ({len(staged_batches)} staged batches converted, {len(resumed_downloads)} downloaded tracks kept, {removed} tracks deleted).")
+    else :
+        clear_journal(playlist)
     
     # Scan already downloaded tracks
     print(f"Scanning downloads...", end="\r")
 
-    memory_success = scan_playlist(playlist_path / "AIFF")
-    memory_fallback = set()
+    with span("scan", "scan", playlist=playlist) :
+        memory_success = scan_playlist(playlist_path / "AIFF")
+        memory_fallback = set()
+
+        # Scan fallback folder as well
+        if fallback_path.is_dir() :
+            memory_fallback |= scan_playlist(fallback_path / "AIFF")
 
-    # Scan fallback folder as well
-    if fallback_path.is_dir() :
-        memory_fallback |= scan_playlist(fallback_path / "AIFF")
+        # Downloaded by the interrupted run, not to be downloaded again
+        memory_success |= resumed_downloads
+        memory_fallback |= resumed_downloads
 
     print(f"Scanning downloads...Done.")
     print("")
 
-    # Clear Downloads database
-    if Path(DEFAULT_DOWNLOADS_DB_PATH).exists() :
-        os.remove(DEFAULT_DOWNLOADS_DB_PATH)
+    # Tracks downloaded before `mp3_copy` was turned on, or whose AIFF changed since
+    if duplicate_to_mp3 :
+        with span("backfill_mp3", "convert", playlist=playlist) as trace_args :
+            backfilled = backfill_mp3(playlist_path, jobs)
+            trace_args["files"] = len(backfilled)
+        if backfilled :
+            print(f"{len(backfilled)} missing MP3 copies converted.")
+            print("")
+
+    # Clear Downloads database, unless resuming : streamrip then skips the tracks it already downloaded
+    downloads_db_path = download_path / DOWNLOADS_DB_NAME
+    if downloads_db_path.exists() and not resume :
+        os.remove(downloads_db_path)
 
     checked_memory = set()
     failed_tracks = {}
     double_failed = []
 
+    # Convert in the background while the next batch downloads
+    pipeline = ConversionPipeline(_convert_staged_batch)
+
     # endregion
     
     # region |---| Ripping
@@ -169,11 +453,37 @@ def update_one_playlist(
     for source, url in sources.items() :
         
         # Downloads by batch
-        found_searched_isrc_dict = {}
         offset = 0
         batch_count = 1
         playlist_fully_downloaded = False
 
+        # Only search and download the tracks added since the last run, or not settled yet
+        if source == "spotify" :
+
+            spotify_playlist = fetch_spotify_playlist(cabot_config, url)
+            spotify_tracks_keys = {spotify_track_key(item["track"]) for item in spotify_playlist["tracks"]["items"]}
+
+            with span("link_from_store", "store", playlist=playlist) :
+                linked = link_from_store(store_folder, spotify_tracks_keys - memory_success, playlist_path, stored_formats)
+            if linked :
+                print(f"{len(linked)} tracks linked from other playlists.")
+                memory_success |= linked
+
+            if not spotify_playlist["unchanged"] :
+                print(f"Spotify playlist changed since last run : {len(spotify_playlist['added'])} added, {len(spotify_playlist['removed'])} removed.")
+
+            # Every track still in the playlist is kept
+            checked_memory |= spotify_tracks_keys
+
+            to_sync = spotify_tracks_to_sync(cabot_config, spotify_playlist, memory_success, memory_fallback, recheck_missing)
+            if not to_sync :
+                print("Spotify playlist fully synchronized, skipping.")
+                print("")
+                continue
+
+            spotify_playlist = spotify_playlist | {"tracks": {"items": to_sync}}
+            print(f"{len(to_sync)} tracks to synchronize.")
+
         while not playlist_fully_downloaded :
             
             print(f"PROCESSING BATCH {batch_count} - {source}")
@@ -181,27 +491,23 @@ def update_one_playlist(
             # region |---|---| Spotify
             if source == "spotify" :
 
-                # Fetch spotify playlist
-                spotify_playlist = fetch_spotify_playlist(url)
-
                 # Rip playlist
                 loop = asyncio.get_event_loop()
-                (batch_found_searched_isrc_dict,
-                 batch_failed_tracks, 
-                 batch_memory_match, 
-                 offset,
-                 playlist_fully_downloaded) = loop.run_until_complete(rip_spotify_playlist(spotify_playlist, memory_success, offset))
+                with span("rip_batch", "spotify", playlist=playlist, batch=batch_count) :
+                    (batch_failed_tracks, 
+                     batch_memory_match, 
+                     offset,
+                     playlist_fully_downloaded) = loop.run_until_complete(rip_spotify_playlist(cabot_config,
+                                                                                               spotify_playlist,
+                                                                                               memory_success,
+                                                                                               offset,
+                                                                                               download_path,
+                                                                                               progress=progress,
+                                                                                               recheck_missing=recheck_missing))
 
-                found_searched_isrc_dict |= batch_found_searched_isrc_dict
                 checked_memory |= batch_memory_match
                 failed_tracks |= batch_failed_tracks
 
-                # Analyse it
-                # TODO when I find a working API
-
-                # Write key in FLAC metadata
-                # write_keys_in_flac(download_path, key_by_id)
-
             # endregion
 
             # region |---|---| Soundcloud
@@ -212,12 +518,15 @@ def update_one_playlist(
                 # Fetch Soundcloud playlist 
                 soundcloud_playlist = loop.run_until_complete(fetch_soundcloud_playlist(url))
 
-                (batch_failed_tracks,
-                 batch_memory_match, 
-                 offset,
-                 playlist_fully_downloaded) = loop.run_until_complete(rip_soundcloud_playlist(soundcloud_playlist,
-                                                                                              memory_success,
-                                                                                              offset))
+                with span("rip_batch", "soundcloud", playlist=playlist, batch=batch_count) :
+                    (batch_failed_tracks,
+                     batch_memory_match, 
+                     offset,
+                     playlist_fully_downloaded) = loop.run_until_complete(rip_soundcloud_playlist(cabot_config,
+                                                                                                  soundcloud_playlist,
+                                                                                                  memory_success,
+                                                                                                  offset,
+                                                                                                  download_path))
 
                 checked_memory |= batch_memory_match
                 double_failed.extend(batch_failed_tracks)
@@ -228,7 +537,7 @@ def update_one_playlist(
             _p.live.stop()
             _p.started = False
 
-            _tag_and_convert(found_searched_isrc_dict, playlist_path)
+            _stage_and_convert(playlist_path, f"{source}_batch_{batch_count}")
             
             batch_count+=1
             print("")
@@ -239,8 +548,12 @@ def update_one_playlist(
 
         print("Fetching failed tracks on Soundcloud...", end="\r")
         loop = asyncio.get_event_loop()
-        (failed_playlist,
-         not_found) = loop.run_until_complete(build_soundcloud_playlist(failed_tracks, playlist))
+        with span("fallback_search", "soundcloud", playlist=playlist, tracks=len(failed_tracks)) :
+            (failed_playlist,
+             not_found) = loop.run_until_complete(build_soundcloud_playlist(cabot_config,
+                                                                                   failed_tracks,
+                                                                                   playlist,
+                                                                                   recheck_missing=recheck_missing))
         
         double_failed.extend(not_found)
 
@@ -258,17 +571,20 @@ def update_one_playlist(
             
             print(f"PROCESSING BATCH {batch_count} - fallback to soundcloud")
             loop = asyncio.get_event_loop()
-            (batch_double_failed,
-             batch_memory_match,
-             offset,
-             playlist_fully_downloaded) = loop.run_until_complete(rip_soundcloud_playlist(failed_playlist,
-                                                                                          memory_fallback,
-                                                                                          offset))
+            with span("rip_batch", "fallback", playlist=playlist, batch=batch_count) :
+                (batch_double_failed,
+                 batch_memory_match,
+                 offset,
+                 playlist_fully_downloaded) = loop.run_until_complete(rip_soundcloud_playlist(cabot_config,
+                                                                                              failed_playlist,
+                                                                                              memory_fallback,
+                                                                                              offset,
+                                                                                              download_path))
 
             double_failed.extend(batch_double_failed)
             checked_memory |= batch_memory_match
 
-            _tag_and_convert({}, fallback_path)
+            _stage_and_convert(fallback_path, f"fallback_batch_{batch_count}")
             
             batch_count += 1
             print("")
@@ -276,6 +592,9 @@ def update_one_playlist(
     # endregion
 
     # region |---| Double failed tracks
+    FALLBACK_TRACKS.set(len(failed_tracks), playlist=playlist)
+    DOUBLE_FAILED_TRACKS.set(len(double_failed), playlist=playlist)
+
     if double_failed :
         print("The following tracks could not be downloaded, neither from Qobuz nor from Soundcloud :")
         for t in double_failed :
@@ -286,11 +605,33 @@ def update_one_playlist(
 
 
     # region |---| Clean
+
+    # Downloads kept by `resume` while no batch was downloaded after them
+    if resumed_downloads :
+        _stage_and_convert(playlist_path, "resumed_batch")
+
+    print(f"Waiting for conversions...", end="\r")
+    with span("wait_conversions", "convert", playlist=playlist) :
+        pipeline.join()
+    print(f"Waiting for conversions...Done.")
+
+    if download_path.exists() :
+        shutil.rmtree(download_path)
+
     print(f"Cleaning playlist folder...", end="\r")
-    remove_deleted_tracks(playlist_path, memory_success - checked_memory)
-    if fallback_path.exists() :
-        remove_deleted_tracks(fallback_path, memory_fallback - checked_memory)
+    with span("clean", "clean", playlist=playlist) :
+        deleted_tracks = find_deleted_tracks(playlist_path, memory_success - checked_memory)
+        if fallback_path.exists() :
+            deleted_tracks += find_deleted_tracks(fallback_path, memory_fallback - checked_memory)
+
+        # Replayed by `--resume` if interrupted
+        record_deletions(playlist, deleted_tracks)
+        removed = remove_tracks(deleted_tracks)
+        complete_deletions(deleted_tracks)
     print(f"Cleaning playlist folder...Done.")
+
+    TRACKS_DELETED.inc(removed, playlist=playlist)
+    clear_journal(playlist)
     
     print("-------------- END --------------")
     print("")
@@ -306,30 +647,89 @@ def update_one_playlist(
 
 # region RUN
 
-def update_playlists(playlists_to_update: list[str]|None=None) -> None :
+def _initialize_thread_event_loop() -> None :
+
+    # Each worker keeps its event loop (and its logged in clients) for the whole run
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+    return
 
-    duplicate_to_mp3 = bool(get_cabot_config_value(["mp3_copy"]))
-    download_path = Path(get_cabot_config_value(["tmp_folder"]))
-    playlists_folder = Path(get_cabot_config_value(["playlists_folder"]))
 
-    playlists = get_cabot_config_value(["playlists"])
+def update_playlists(
+        cabot_config: CabotConfig,
+        playlists_to_update: list[str]|None=None,
+        recheck_missing: bool=False,
+        resume: bool=False) -> None :
+    """
+    With `cabot_config.parallel` > 1, that many playlists are synchronized concurrently.
+    API requests, downloads and ffmpeg workers (`cabot_config.jobs`) are capped for the whole run.
+    """
+
+    tmp_folder = cabot_config.tmp_folder
+    playlists_folder = cabot_config.playlists_folder
+    parallel = cabot_config.parallel
+
+    playlists = cabot_config.playlists
 
     if not playlists_folder.exists() :
         os.mkdir(playlists_folder)
 
+    API_LIMITER.set_limit(cabot_config.max_api_requests)
+    QOBUZ_SCHEDULER.configure(cabot_config.max_api_requests)
+    SOUNDCLOUD_SCHEDULER.configure(cabot_config.max_api_requests)
+    DOWNLOAD_LIMITER.set_limit(cabot_config.max_downloads)
+
     playlists_to_update = playlists_to_update or list(playlists.keys())
 
     for playlist in playlists_to_update :
-
         assert playlist in playlists, f"{playlist} is not configured, please fill `config.json` correctly."
 
-        sources = playlists[playlist]
+    # Each playlist downloads in its own tmp folder
+    def _update(playlist: str, progress: bool=True) -> None :
+        with span("update_playlist", playlist=playlist) :
+            update_one_playlist(cabot_config,
+                                playlist,
+                                tmp_folder / playlist.replace("/", " "),
+                                progress=progress,
+                                recheck_missing=recheck_missing,
+                                resume=resume)
+
+    if parallel <= 1 :
+        try :
+            for playlist in playlists_to_update :
+                _update(playlist)
+        finally :
+            close_qobuz_clients()
+
+        with span("collect_garbage", "store") :
+            collect_store_garbage(get_store_folder(playlists_folder))
+        
+        return
+
+    # Live displays can't be shared between playlists, progress bars are disabled
+    failed_playlists = {}
+    try :
+        with ThreadPoolExecutor(max_workers=parallel, initializer=_initialize_thread_event_loop) as executor :
+
+            futures = {executor.submit(_update, playlist, progress=False): playlist
+                       for playlist in playlists_to_update}
+
+            for future in as_completed(futures) :
+                try :
+                    future.result()
+                except Exception as e :
+                    failed_playlists[futures[future]] = e
+    finally :
+        close_qobuz_clients()
+
+    if failed_playlists :
+        print("The following playlists could not be updated :")
+        for playlist, e in failed_playlists.items() :
+            print(f"   -> {playlist} ({type(e).__name__}: {e})")
+        print("")
 
-        update_one_playlist(playlist,
-                            sources,
-                            download_path,
-                            playlists_folder,
-                            duplicate_to_mp3)
+    with span("collect_garbage", "store") :
+        collect_store_garbage(get_store_folder(playlists_folder))
 
     return
 
@@ -1,25 +1,159 @@
-import sys
+import argparse
+import json
 import shutil
+import sys
+import time
 from pathlib import Path
-from .features.update import update_playlists
 from .features.config import (
+    CabotConfig,
     initialize_config,
-    get_cabot_config_value,
+    load_cabot_config,
 )
 
-if __name__ == '__main__' :
 
-    initialize_config()
+def parse_arguments() -> argparse.Namespace :
+    """
+    Options left unset keep the value of `config.json`.
+    """
+
+    parser = argparse.ArgumentParser(prog="cabot", description="Update your playlists from Spotify and Soundcloud.")
+    parser.add_argument("playlists", nargs="*", help="Playlists to update (all configured playlists by default).")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of parallel conversions (defaults to the number of cores).")
+    parser.add_argument("-p", "--parallel", type=int, default=None, help="Number of playlists synchronized concurrently.")
+    parser.add_argument("--max-api-requests", type=int, default=None, help="Maximum concurrent API requests for the whole run.")
+    parser.add_argument("--max-downloads", type=int, default=None, help="Maximum concurrent track downloads for the whole run.")
+    parser.add_argument("--playlists-folder", default=None, help="Folder holding the playlists.")
+    parser.add_argument("--tmp-folder", default=None, help="Folder holding the downloads in progress.")
+    parser.add_argument("--mp3-copy", action=argparse.BooleanOptionalAction, default=None, help="Keep an MP3 copy of every track.")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run, reusing the tracks it already downloaded.")
+    parser.add_argument("--recheck-missing", action="store_true", help="Search Qobuz again for tracks that were recently missing from it.")
+    parser.add_argument("--forget-resolutions", nargs="*", metavar="ISRC", default=None, help="Forget the cached Qobuz matches of these ISRCs (all of them if none given) before updating.")
+    parser.add_argument("--list-playlists", action="store_true", help="List the configured playlists and exit.")
+    parser.add_argument("--check-config", action="store_true", help="Validate `config.json` and exit.")
+    parser.add_argument("--plan", action="store_true", help="Show what updating would download and delete, without doing it.")
+    parser.add_argument("--backfill-mp3", action="store_true", help="Only convert the AIFF tracks missing their MP3 copy, without downloading anything.")
+    parser.add_argument("--metrics-file", type=Path, metavar="PATH", default=None, help="Write the metrics of the run to PATH at its end (Prometheus text format).")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT", default=None, help="Serve the metrics on http://127.0.0.1:PORT/metrics while the run lasts.")
+    parser.add_argument("--trace", type=Path, metavar="PATH", default=None, help="Write the timing spans of the run to PATH (Chrome trace format, viewable in Perfetto).")
+
+    return parser.parse_args()
+
+
+def list_playlists(cabot_config: CabotConfig) -> None :
+
+    for playlist, sources in cabot_config.playlists.items() :
+        print(playlist)
+        for source, url in sources.items() :
+            print(f"   -> {source} : {url}")
+
+    return
+
+
+def plan(cabot_config: CabotConfig, arguments: argparse.Namespace) -> None :
+
+    from .features.plan import plan_playlists
+
+    plan_playlists(cabot_config, arguments.playlists or None)
+
+    return
+
+
+def backfill(cabot_config: CabotConfig, arguments: argparse.Namespace) -> None :
+
+    from .features.update import backfill_playlists
+    from .features.convert import shutdown_conversion_pools
+
+    try :
+        backfill_playlists(cabot_config, arguments.playlists or None)
+    finally :
+        shutdown_conversion_pools()
+
+    return
+
+
+def update(cabot_config: CabotConfig, arguments: argparse.Namespace) -> None :
+
+    # Streamrip, spotipy, ffmpeg... are only imported when actually updating, for a fast startup otherwise
+    from .features.update import update_playlists
+    from .features.convert import shutdown_conversion_pools
+    from .features.resolution import invalidate_resolutions
+    from .features.journal import clear_journal
+    from .features.trace import TRACER
+    from .features.metrics import (
+        METRICS,
+        RUN_SECONDS,
+        RUN_SUCCESS,
+        RUN_TIMESTAMP,
+    )
+
+    initialize_config(cabot_config)
+
+    if arguments.forget_resolutions is not None :
+        forgotten = invalidate_resolutions(arguments.forget_resolutions or None)
+        print(f"Forgot {forgotten} cached Qobuz matches.")
     
-    # Clear the tmp files
-    tmp_folder = Path(get_cabot_config_value(["tmp_folder"]))
-    if tmp_folder.exists() :
-        shutil.rmtree(tmp_folder)
-
-    argv = sys.argv
-    if len(argv) >= 2 :
-        playlists = (" ".join(argv[1:])).split(";")[1:]
-        update_playlists(playlists)
+    # Clear the tmp files, unless they are to be reused
+    if not arguments.resume :
+        if cabot_config.tmp_folder.exists() :
+            shutil.rmtree(cabot_config.tmp_folder)
+        clear_journal()
+
+    metrics_server = None if cabot_config.metrics_port is None else METRICS.serve(cabot_config.metrics_port)
+
+    start = time.monotonic()
+    success = False
+    try :
+        update_playlists(cabot_config,
+                         arguments.playlists or None,
+                         arguments.recheck_missing,
+                         arguments.resume)
+        success = True
+    finally :
+        shutdown_conversion_pools()
+
+        # Time per stage, even for an interrupted run
+        TRACER.print_summary()
+        if arguments.trace is not None :
+            TRACER.export(arguments.trace)
+            print(f"Trace written to {arguments.trace}.")
+
+        RUN_SECONDS.set(round(time.monotonic() - start, 3))
+        RUN_SUCCESS.set(int(success))
+        RUN_TIMESTAMP.set(int(time.time()))
+        if cabot_config.metrics_file is not None :
+            METRICS.write_textfile(cabot_config.metrics_file)
+        if metrics_server is not None :
+            metrics_server.shutdown()
+
+    return
+
+
+if __name__ == '__main__' :
+
+    arguments = parse_arguments()
+
+    try :
+        cabot_config = load_cabot_config(jobs=arguments.jobs,
+                                         parallel=arguments.parallel,
+                                         max_api_requests=arguments.max_api_requests,
+                                         max_downloads=arguments.max_downloads,
+                                         playlists_folder=arguments.playlists_folder,
+                                         tmp_folder=arguments.tmp_folder,
+                                         mp3_copy=arguments.mp3_copy,
+                                         metrics_file=arguments.metrics_file,
+                                         metrics_port=arguments.metrics_port)
+    except (AssertionError, OSError, json.JSONDecodeError) as e :
+        print(f"Invalid configuration : {e}")
+        sys.exit(1)
+
+    if arguments.check_config :
+        print("Configuration OK.")
+    elif arguments.list_playlists :
+        list_playlists(cabot_config)
+    elif arguments.plan :
+        plan(cabot_config, arguments)
+    elif arguments.backfill_mp3 :
+        backfill(cabot_config, arguments)
     else :
-        update_playlists()
+        update(cabot_config, arguments)
     
@@ -0,0 +1,74 @@
+import json
+import dataclasses
+import pytest
+import toml
+from pathlib import Path
+
+
+from path import CABOT
+from src.features import config
+from src.features.config import (
+    DEFAULT_CABOT_CONFIG_PATH,
+    load_cabot_config,
+    apply_cabot_config_to_streamrip,
+)
+
+
+def write_config(tmp_path: Path, **values) -> Path :
+
+    with open(DEFAULT_CABOT_CONFIG_PATH, 'r') as f :
+        config_data = json.load(f)
+    config_data |= {"tmp_folder": str(tmp_path / "tmp")} | values
+
+    config_path = tmp_path / "config.json"
+    with open(config_path, 'w') as f :
+        json.dump(config_data, f)
+
+    return config_path
+
+
+def test_load_cabot_config(tmp_path) :
+
+    cabot_config = load_cabot_config(write_config(tmp_path, mp3_copy="False", jobs=2))
+
+    # Strings used to be stored as booleans
+    assert cabot_config.mp3_copy is False
+    assert cabot_config.jobs == 2
+    assert cabot_config.tmp_folder == tmp_path / "tmp"
+    assert cabot_config.max_downloads == 6
+
+    # Immutable
+    with pytest.raises(dataclasses.FrozenInstanceError) :
+        cabot_config.jobs = 3
+    with pytest.raises(TypeError) :
+        cabot_config.playlists["other"] = {}
+
+    # CLI overrides, unless unset
+    cabot_config = load_cabot_config(write_config(tmp_path, jobs=2), jobs=None, parallel=3, mp3_copy=False)
+    assert (cabot_config.jobs, cabot_config.parallel, cabot_config.mp3_copy) == (2, 3, False)
+
+    # Validation
+    with pytest.raises(AssertionError) :
+        load_cabot_config(write_config(tmp_path, mp3_copy="yes"))
+    with pytest.raises(AssertionError) :
+        load_cabot_config(write_config(tmp_path, tmp_folder=""))
+    with pytest.raises(AssertionError) :
+        load_cabot_config(write_config(tmp_path), parallel=0)
+
+
+def test_apply_cabot_config_to_streamrip(tmp_path, monkeypatch) :
+
+    streamrip_config_path = tmp_path / "config.toml"
+    streamrip_config_path.write_text(toml.dumps({"qobuz": {"quality": 3}}))
+    monkeypatch.setattr(config, "get_streamrip_config_path", lambda: streamrip_config_path)
+
+    cabot_config = load_cabot_config(write_config(tmp_path))
+
+    assert apply_cabot_config_to_streamrip(cabot_config)
+    assert toml.load(streamrip_config_path) == {
+        "qobuz": {"quality": 3, "email_or_userid": "", "password_or_token": "", "use_auth_token": True},
+        "downloads": {"folder": str(tmp_path / "tmp")},
+    }
+
+    # Nothing changed, nothing written
+    assert not apply_cabot_config_to_streamrip(cabot_config)
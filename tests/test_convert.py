@@ -1,14 +1,25 @@
 import os
+import shutil
 from pathlib import Path
 from pydub import AudioSegment
 from tinytag import TinyTag
+from ffmpeg import FFmpeg
+from mutagen.aiff import AIFF
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3
 import numpy as np
+import soundfile
 
 
 from path import CABOT
+from src.features import convert
 from src.features.convert import (
     _convert_to_xxx,
+    _convert_to_formats,
     _convert_batch_to_xxx,
+    get_conversion_pool,
+    convert_to_aiff,
+    convert_batch_to_formats,
 )
 
 # region Utils
@@ -84,3 +95,135 @@ def test_convert() :
         raise e
 
     clear_test_directory(DUMMY_FOLDER_PATH)
+
+
+def test_convert_batch() :
+
+    batch_folder = DUMMY_FOLDER_PATH / "batch"
+    copied_folder = DUMMY_FOLDER_PATH / "copied"
+    os.mkdir(batch_folder)
+
+    for i in range(4) :
+        shutil.copy(WHITE_NOISE_ABSOLUTE_PATH, batch_folder / f"white_noise_{i}.wav")
+    
+    # A broken file must not abort the batch
+    with open(batch_folder / "broken.wav", "wb") as f :
+        f.write(b"not audio")
+
+    expected_stems = [f.stem for f in batch_folder.iterdir() if f.name != "broken.wav"]
+
+    try :
+        aiff_paths = _convert_batch_to_xxx(".aiff", batch_folder, [".wav"], copied_folder, jobs=2)
+
+        assert [p.stem for p in aiff_paths] == expected_stems
+        assert all(p.is_file() for p in aiff_paths)
+        assert not (copied_folder / "broken.aiff").exists()
+
+        # Spawned workers, the run being multithreaded
+        assert get_conversion_pool(2)._mp_context.get_start_method() == "spawn"
+    
+    # Clean before killing process
+    except AssertionError as e :
+        clear_test_directory(DUMMY_FOLDER_PATH)
+        raise e
+
+    clear_test_directory(DUMMY_FOLDER_PATH)
+
+
+def test_convert_batch_to_formats() :
+
+    batch_folder = DUMMY_FOLDER_PATH / "batch"
+    aiff_folder = DUMMY_FOLDER_PATH / "AIFF"
+    mp3_folder = DUMMY_FOLDER_PATH / "MP3"
+    os.mkdir(batch_folder)
+    shutil.copy(WHITE_NOISE_ABSOLUTE_PATH, batch_folder / "white_noise.wav")
+
+    try :
+        converted_paths = convert_batch_to_formats(batch_folder, [".wav"], {".aiff": aiff_folder, ".mp3": mp3_folder})
+
+        assert converted_paths == [aiff_folder / "white_noise.aiff", mp3_folder / "white_noise.mp3"]
+        assert all(p.is_file() for p in converted_paths)
+
+        reverse_path = _convert_to_xxx(".wav", converted_paths[0], DUMMY_FOLDER_PATH / "copied")
+        assert check_audio_equality(WHITE_NOISE_ABSOLUTE_PATH, reverse_path)
+    
+    # Clean before killing process
+    except AssertionError as e :
+        clear_test_directory(DUMMY_FOLDER_PATH)
+        raise e
+
+    clear_test_directory(DUMMY_FOLDER_PATH)
+
+
+def test_convert_flac_to_aiff_in_process() :
+
+    copied_folder = DUMMY_FOLDER_PATH / "copied"
+    ffmpeg_folder = DUMMY_FOLDER_PATH / "ffmpeg"
+    os.mkdir(ffmpeg_folder)
+
+    flac_path = _convert_to_xxx(".flac", WHITE_NOISE_ABSOLUTE_PATH, copied_folder)
+    song_data = FLAC(flac_path)
+    song_data["TITLE"] = "White noise"
+    song_data["ARTIST"] = ["First", "Second"]
+    song_data["ALBUMARTIST"] = "Cabot"
+    song_data["DATE"] = "2024"
+    song_data["TRACKNUMBER"] = "1"
+    song_data["ISRC"] = "FOUND"
+    song_data["COMMENT"] = "SEARCHED"
+    song_data["DESCRIPTION"] = ""
+    song_data.save()
+
+    # What ffmpeg writes
+    ffmpeg_path = ffmpeg_folder / "white_noise.aiff"
+    FFmpeg().input(flac_path).output(ffmpeg_path, {"write_id3v2": 1}).execute()
+
+    try :
+        aiff_path = convert_to_aiff(flac_path, copied_folder)
+
+        # Bit-exact samples, same ID3 tags (but ffmpeg's own encoder tag)
+        assert soundfile.info(aiff_path).subtype == soundfile.info(ffmpeg_path).subtype
+        assert np.array_equal(soundfile.read(aiff_path, dtype="int16")[0], soundfile.read(ffmpeg_path, dtype="int16")[0])
+        assert {k: str(v) for k, v in AIFF(aiff_path).tags.items()} == {k: str(v) for k, v in AIFF(ffmpeg_path).tags.items() if k != "TSSE"}
+    
+    # Clean before killing process
+    except AssertionError as e :
+        clear_test_directory(DUMMY_FOLDER_PATH)
+        raise e
+
+    clear_test_directory(DUMMY_FOLDER_PATH)
+
+
+def test_convert_flac_to_aiff_and_mp3_decoded_once(tmp_path, monkeypatch) :
+
+    # 24 bits, to check the MP3 is encoded from the full resolution
+    flac_path = tmp_path / "song.flac"
+    soundfile.write(flac_path, np.random.default_rng(0).uniform(-0.5, 0.5, (48000, 2)), 48000, subtype="PCM_24")
+    song_data = FLAC(flac_path)
+    song_data["TITLE"] = "Song"
+    song_data["COMMENT"] = "SEARCHED"
+    song_data.save()
+
+    # What ffmpeg writes from the FLAC itself
+    FFmpeg().input(flac_path).output(tmp_path / "ffmpeg.mp3", {"write_id3v2": 1}).execute()
+
+    inputs = []
+    class RecordingFFmpeg(FFmpeg) :
+        def input(self, url, options=None, **kwargs) :
+            inputs.append((str(url), dict(options or {})))
+            return super().input(url, options, **kwargs)
+
+    monkeypatch.setattr(convert, "FFmpeg", RecordingFFmpeg)
+
+    aiff_path, mp3_path = _convert_to_formats(flac_path, {".aiff": tmp_path / "AIFF", ".mp3": tmp_path / "MP3"}, sanitize=False)
+
+    # ffmpeg reads the samples decoded in-process, and only the tags of the FLAC
+    assert inputs[0][0] == "pipe:0" and inputs[0][1]["f"] == "s32le"
+    assert inputs[1][0] == str(flac_path)
+
+    assert np.array_equal(soundfile.read(aiff_path, dtype="int16")[0], soundfile.read(flac_path, dtype="int16")[0])
+    assert {k: str(v) for k, v in ID3(mp3_path).items()} == {k: str(v) for k, v in ID3(tmp_path / "ffmpeg.mp3").items()}
+
+    # Same MP3 audio
+    for path in (mp3_path, tmp_path / "ffmpeg.mp3") :
+        FFmpeg().input(path).output(path.with_suffix(".wav")).execute()
+    assert np.array_equal(soundfile.read(mp3_path.with_suffix(".wav"))[0], soundfile.read(tmp_path / "ffmpeg.wav")[0])
@@ -0,0 +1,162 @@
+import os
+import threading
+from pathlib import Path
+from mutagen.aiff import AIFF
+from mutagen.id3 import TXXX
+
+
+from path import CABOT
+from src.features import database, index
+from src.features.convert import _convert_to_xxx
+from src.features.store import (
+    get_store_folder,
+    link_from_store,
+    collect_store_garbage,
+)
+from src.features.convert import shutdown_conversion_pools
+from src.features.update import (
+    scan_playlist,
+    remove_deleted_tracks,
+    backfill_mp3,
+)
+
+# region Utils
+
+WHITE_NOISE_ABSOLUTE_PATH = CABOT / "tests" / "dummy_audio" / "white_noise.wav"
+
+
+def make_tagged_aiff(folder: Path, name: str, track_id: str) -> Path :
+
+    aiff_path = _convert_to_xxx(".aiff", WHITE_NOISE_ABSOLUTE_PATH, folder)
+    renamed_path = aiff_path.with_stem(name)
+    os.rename(aiff_path, renamed_path)
+
+    song_data = AIFF(renamed_path)
+    song_data.tags.add(TXXX(encoding=3, desc="COMMENT", text=track_id))
+    song_data.save()
+
+    return renamed_path
+
+# endregion
+
+
+def test_index(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+
+    read_songs = []
+    lock_free = []
+    original_extract_track_id = index.extract_track_id
+    def _counting_extract_track_id(song: Path) -> str | None :
+        read_songs.append(song)
+
+        # Other threads can still reach the database while tags are read
+        def _try_lock() -> None :
+            lock_free.append(database._LOCK.acquire(blocking=False))
+            if lock_free[-1] :
+                database._LOCK.release()
+        thread = threading.Thread(target=_try_lock)
+        thread.start()
+        thread.join()
+
+        return original_extract_track_id(song)
+
+    monkeypatch.setattr(index, "extract_track_id", _counting_extract_track_id)
+
+    playlist_path = tmp_path / "playlist"
+    aiff_folder = playlist_path / "AIFF"
+    aiff_folder.mkdir(parents=True)
+    first = make_tagged_aiff(aiff_folder, "first", "ISRC00000001")
+    second = make_tagged_aiff(aiff_folder, "second", "ISRC00000002")
+
+    try :
+        assert scan_playlist(aiff_folder) == {"ISRC00000001", "ISRC00000002"}
+        assert len(read_songs) == 2
+        assert all(lock_free)
+
+        # Unchanged files are validated by stat only
+        assert scan_playlist(aiff_folder) == {"ISRC00000001", "ISRC00000002"}
+        assert len(read_songs) == 2
+
+        # Changed files are read again
+        song_data = AIFF(second)
+        song_data.tags.add(TXXX(encoding=3, desc="COMMENT", text="ISRC000000030"))
+        song_data.save()
+        assert scan_playlist(aiff_folder) == {"ISRC00000001", "ISRC000000030"}
+        assert read_songs[-1] == second
+
+        # Clean relies on the index as well
+        remove_deleted_tracks(playlist_path, {"ISRC00000001"})
+        assert not first.exists()
+        assert scan_playlist(aiff_folder) == {"ISRC000000030"}
+        assert len(read_songs) == 3
+
+    finally :
+        database.close_connections()
+
+
+def test_store(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+
+    playlists_folder = tmp_path / "playlists"
+    store_folder = get_store_folder(playlists_folder)
+    first_playlist = playlists_folder / "first"
+    second_playlist = playlists_folder / "second"
+    (first_playlist / "AIFF").mkdir(parents=True)
+
+    song = make_tagged_aiff(first_playlist / "AIFF", "song", "ISRC00000001")
+
+    try :
+        # Downloaded before the store existed
+        assert scan_playlist(first_playlist / "AIFF") == {"ISRC00000001"}
+
+        linked = link_from_store(store_folder, {"ISRC00000001", "ISRC00000002"}, second_playlist, [".aiff", ".mp3"])
+        assert linked == {"ISRC00000001"}
+        assert scan_playlist(second_playlist / "AIFF") == {"ISRC00000001"}
+        assert (second_playlist / "AIFF" / song.name).stat().st_ino == song.stat().st_ino
+
+        # Still used by both playlists
+        assert collect_store_garbage(store_folder) == 0
+
+        remove_deleted_tracks(first_playlist, {"ISRC00000001"})
+        remove_deleted_tracks(second_playlist, {"ISRC00000001"})
+        assert collect_store_garbage(store_folder) == 1
+        assert len(list(store_folder.iterdir())) == 0
+
+    finally :
+        database.close_connections()
+
+
+def test_backfill_mp3(tmp_path) :
+
+    playlist_path = tmp_path / "playlist"
+    (playlist_path / "AIFF").mkdir(parents=True)
+    (playlist_path / "MP3").mkdir()
+    (playlist_path / "fallback" / "AIFF").mkdir(parents=True)
+
+    # No MP3 copy, up to date and stale ones, fallback without MP3 folder
+    make_tagged_aiff(playlist_path / "AIFF", "missing", "ISRC00000001")
+    make_tagged_aiff(playlist_path / "AIFF", "fresh", "ISRC00000002")
+    make_tagged_aiff(playlist_path / "AIFF", "stale", "ISRC00000003")
+    make_tagged_aiff(playlist_path / "fallback" / "AIFF", "fallback", "ISRC00000004")
+
+    fresh_mp3 = playlist_path / "MP3" / "fresh.mp3"
+    fresh_mp3.write_bytes(b"fresh")
+    stale_mp3 = playlist_path / "MP3" / "stale.mp3"
+    stale_mp3.write_bytes(b"stale")
+    os.utime(stale_mp3, (0, 0))
+
+    try :
+        converted = backfill_mp3(playlist_path, jobs=2)
+        assert sorted(converted) == sorted([playlist_path / "MP3" / "missing.mp3",
+                                            stale_mp3,
+                                            playlist_path / "fallback" / "MP3" / "fallback.mp3"])
+        assert fresh_mp3.read_bytes() == b"fresh"
+        assert stale_mp3.read_bytes() != b"stale"
+
+        # Nothing left to do
+        assert backfill_mp3(playlist_path, jobs=2) == []
+
+    finally :
+        shutdown_conversion_pools()
@@ -0,0 +1,115 @@
+import os
+import shutil
+from pathlib import Path
+from mutagen.flac import FLAC
+
+
+from path import CABOT
+from src.features import database, update
+from src.features.config import (
+    DEFAULT_CABOT_CONFIG_PATH,
+    load_cabot_config,
+)
+from src.features.convert import _convert_to_xxx
+from src.features.journal import (
+    record_staged_batch,
+    record_deletions,
+    get_staged_batches,
+    get_pending_deletions,
+)
+from src.features.rip import extract_track_id
+from src.features.update import (
+    STAGING_FOLDER_NAME,
+    update_one_playlist,
+)
+from test_index import (
+    WHITE_NOISE_ABSOLUTE_PATH,
+    make_tagged_aiff,
+)
+
+
+def make_downloaded_flac(folder: Path, name: str, **tags) -> Path :
+
+    os.makedirs(folder, exist_ok=True)
+    flac_path = _convert_to_xxx(".flac", WHITE_NOISE_ABSOLUTE_PATH, folder)
+    renamed_path = flac_path.with_stem(name)
+    os.rename(flac_path, renamed_path)
+
+    song_data = FLAC(renamed_path)
+    for tag, value in tags.items() :
+        song_data[tag] = value
+    song_data.save()
+
+    return renamed_path
+
+
+def test_resume(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+
+    cabot_config = load_cabot_config(DEFAULT_CABOT_CONFIG_PATH, tmp_folder=tmp_path / "tmp", playlists_folder=tmp_path / "playlists", mp3_copy=False)
+    playlist = next(iter(cabot_config.playlists))
+    playlist_path = cabot_config.playlists_folder / playlist
+    download_path = cabot_config.tmp_folder / playlist
+
+    # The interrupted run staged a batch, and was about to delete a track
+    (playlist_path / "AIFF").mkdir(parents=True)
+    deleted = make_tagged_aiff(playlist_path / "AIFF", "deleted", "OLD")
+
+    staged_batch = download_path / STAGING_FOLDER_NAME / "spotify_batch_1"
+    make_downloaded_flac(staged_batch / "Playlist", "staged", ISRC="FOUND1", COMMENT="SEARCHED1")
+
+    # Its next batch was being downloaded
+    make_downloaded_flac(download_path / "Playlist", "downloaded", ISRC="FOUND2", COMMENT="SEARCHED2")
+    make_downloaded_flac(download_path / "Playlist", "untagged", ISRC="FOUND3")
+    (download_path / "Playlist" / "partial.flac").write_bytes(b"fLaC" + b"\x00" * 100)
+    shutil.copy(WHITE_NOISE_ABSOLUTE_PATH, download_path / "Playlist" / "soundcloud.wav")
+
+    # Fake Spotify playlist, already resolved : downloads what is not in memory, homonyms renamed
+    ripped = []
+    async def fake_rip_spotify_playlist(cabot_config, spotify_playlist, memory, offset, download_path, **kwargs) :
+        for item in spotify_playlist["tracks"]["items"] :
+            isrc = item["track"]["external_ids"]["isrc"]
+            ripped.append(isrc)
+            name = item["track"]["name"]
+            if (download_path / "Playlist" / f"{name}.flac").exists() :
+                name = f"{name} (2)"
+            make_downloaded_flac(download_path / "Playlist", name, ISRC=isrc, COMMENT=isrc)
+        return {}, set(), len(spotify_playlist["tracks"]["items"]), True
+
+    def _item(name: str, isrc: str) -> dict :
+        return {"track": {"name": name, "artists": [{"name": "Artist"}], "external_ids": {"isrc": isrc}}}
+
+    items = [_item("staged", "SEARCHED1"), _item("downloaded", "SEARCHED2"), _item("new", "NEW")]
+    monkeypatch.setattr(update, "fetch_spotify_playlist", lambda cabot_config, url: {"tracks": {"items": items}, "unchanged": True, "added": [], "removed": []})
+    monkeypatch.setattr(update, "rip_spotify_playlist", fake_rip_spotify_playlist)
+
+    try :
+        record_staged_batch(playlist, staged_batch, playlist_path)
+        record_deletions(playlist, [deleted])
+
+        update_one_playlist(cabot_config, playlist, download_path, progress=False, resume=True)
+
+        # Staged and fully downloaded tracks converted once, partial downloads discarded
+        assert ripped == ["NEW"]
+        converted = {song.stem: extract_track_id(song) for song in (playlist_path / "AIFF").iterdir()}
+        assert converted == {"staged": "SEARCHED1", "downloaded": "SEARCHED2", "new": "NEW"}
+        assert not download_path.exists()
+
+        # Nothing left to resume
+        assert get_staged_batches(playlist) == []
+        assert get_pending_deletions(playlist) == []
+
+        # Interrupted once every track was downloaded : converted without any batch to stage it with
+        ripped.clear()
+        items.append(_item("last", "LAST"))
+        make_downloaded_flac(download_path / "Playlist", "last", ISRC="LAST", COMMENT="LAST")
+
+        update_one_playlist(cabot_config, playlist, download_path, progress=False, resume=True)
+
+        assert ripped == []
+        track_ids = [extract_track_id(song) for song in (playlist_path / "AIFF").iterdir()]
+        assert sorted(track_ids) == ["LAST", "NEW", "SEARCHED1", "SEARCHED2"]
+
+    finally :
+        database.close_connections()
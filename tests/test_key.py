@@ -0,0 +1,117 @@
+from pathlib import Path
+import numpy as np
+import soundfile
+from mutagen.aiff import AIFF
+from mutagen.flac import FLAC
+
+
+from path import CABOT
+from src.features import database, key
+from src.features.convert import convert_to_aiff
+from src.features.key import (
+    PITCH_CLASS_TO_CAMELOT,
+    _load_mono,
+    detect_key,
+    analyse_keys_in_flac,
+)
+
+
+SAMPLE_RATE = 44100
+
+
+def make_progression_flac(path: Path, tonic: int, mode: int) -> Path :
+    """
+    I - IV - V - I (i - iv - v - i in minor) triads over their root, in `tonic` (C = 0).
+    """
+
+    def _note(midi: int) -> np.ndarray :
+        t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+        frequency = 440 * 2 ** ((midi - 69) / 12)
+        return sum(np.sin(2 * np.pi * frequency * harmonic * t) / harmonic for harmonic in range(1, 5))
+
+    third = 4 if mode else 3
+    chords = [(0, third, 7), (5, 5 + third, 12), (7, 11, 14), (0, third, 7)]
+    signal = np.concatenate([sum(_note(48 + tonic + n) for n in chord) + _note(36 + tonic + chord[0]) for chord in chords] * 2)
+    signal = 0.8 * signal / np.abs(signal).max()
+
+    soundfile.write(path, np.stack([signal, signal], axis=1), SAMPLE_RATE)
+
+    return path
+
+
+def test_camelot_wheel() :
+
+    # Relative keys share their number, and fifths are one step apart
+    for pitch_class in range(12) :
+        minor = PITCH_CLASS_TO_CAMELOT[(str(pitch_class), "0")]
+        major = PITCH_CLASS_TO_CAMELOT[(str((pitch_class + 3) % 12), "1")]
+        fifth = PITCH_CLASS_TO_CAMELOT[(str((pitch_class + 7) % 12), "0")]
+
+        assert minor[:-1] == major[:-1]
+        assert int(fifth[:-1]) == int(minor[:-1]) % 12 + 1
+
+    assert len(set(PITCH_CLASS_TO_CAMELOT.values())) == 24
+
+
+def test_load_mono(tmp_path) :
+
+    # A 10 kHz tone would alias at 1025 Hz once decimated to 11025 Hz
+    t = np.arange(10 * SAMPLE_RATE) / SAMPLE_RATE
+    levels = {}
+    for frequency in (440., 10000.) :
+        soundfile.write(tmp_path / "tone.wav", 0.5 * np.sin(2 * np.pi * frequency * t), SAMPLE_RATE)
+        signal, sample_rate = _load_mono(tmp_path / "tone.wav")
+        assert sample_rate == SAMPLE_RATE / 4
+        levels[frequency] = np.sqrt(np.mean(signal ** 2))
+
+    assert levels[10000.] < 0.01 * levels[440.]
+
+
+def test_detect_key(tmp_path) :
+
+    for tonic, mode in [(0, 1), (9, 0), (8, 1), (6, 0)] :
+        song = make_progression_flac(tmp_path / f"{tonic}_{mode}.flac", tonic, mode)
+        assert detect_key(song) == PITCH_CLASS_TO_CAMELOT[(str(tonic), str(mode))]
+
+    silence = tmp_path / "silence.flac"
+    soundfile.write(silence, np.zeros((SAMPLE_RATE, 2)), SAMPLE_RATE)
+    assert detect_key(silence) is None
+
+
+def test_analyse_keys_in_flac(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+
+    playlist_folder = tmp_path / "Playlist"
+    playlist_folder.mkdir()
+    song = make_progression_flac(playlist_folder / "song.flac", 7, 1)
+
+    analysed = []
+    original_try_detect_key = key._try_detect_key
+    def _counting_try_detect_key(song: Path) :
+        analysed.append(song.name)
+        return original_try_detect_key(song)
+
+    monkeypatch.setattr(key, "_try_detect_key", _counting_try_detect_key)
+
+    try :
+        assert analyse_keys_in_flac(playlist_folder, jobs=1) == {song: "9B"}
+        assert FLAC(song)["INITIALKEY"] == ["9B"]
+        assert analysed == ["song.flac"]
+
+        # Carried over by the conversion
+        aiff_path = convert_to_aiff(song, tmp_path / "AIFF")
+        assert str(AIFF(aiff_path)["TXXX:INITIALKEY"]) == "9B"
+
+        # Same audio, retagged or not : read from the cache
+        song_data = FLAC(song)
+        song_data["TITLE"] = "Retagged"
+        song_data.save()
+        copy = playlist_folder / "copy.flac"
+        copy.write_bytes(song.read_bytes())
+
+        assert analyse_keys_in_flac(playlist_folder, jobs=1) == {song: "9B", copy: "9B"}
+        assert analysed == ["song.flac"]
+
+    finally :
+        database.close_connections()
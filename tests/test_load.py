@@ -0,0 +1,26 @@
+from path import CABOT
+from benchmarks.fake_services import FaultConfig
+from benchmarks.load import run_load
+
+
+def test_load(tmp_path) :
+
+    # Some tracks only on Soundcloud, some requests throttled or failing
+    faults = FaultConfig(throttle_rate=0.1, error_rate=0.05, seed=1)
+    stats = run_load(tmp_path, 8, faults, missing_ratio=0.3, duration=0.5, jobs=2)
+
+    assert stats["synchronized"] + stats["fallback"] == 8
+    assert stats["fallback"] > 0
+    assert stats["retries"] == stats["statuses"].get(429, 0) + stats["statuses"].get(503, 0)
+
+    # Nothing leaves the stand-ins
+    assert stats["requests"]["spotify/v1/playlists/fakeplaylist/items"] == 1
+    assert stats["requests"]["qobuz/api.json/0.2/user/login"] == 1
+
+
+def test_load_soundcloud(tmp_path) :
+
+    stats = run_load(tmp_path, 4, duration=0.5, source="soundcloud")
+
+    assert stats["synchronized"] == 4
+    assert stats["requests"]["soundcloud/files"] == 4
@@ -0,0 +1,64 @@
+import asyncio
+import urllib.request
+
+
+from path import CABOT
+from src.features.metrics import (
+    MetricsRegistry,
+    METRICS,
+)
+from src.features.scheduler import AdaptiveScheduler
+
+
+def test_metrics_registry(tmp_path) :
+
+    registry = MetricsRegistry()
+    deleted = registry.counter("deleted_total", "Deleted tracks.", ("playlist",))
+    failed = registry.gauge("failed", "Failed tracks.", ("playlist",))
+    latency = registry.histogram("latency_seconds", "Latency.", ("service",), buckets=(0.1, 1.))
+
+    deleted.inc(2, playlist='my "playlist"')
+    deleted.inc(playlist='my "playlist"')
+    failed.set(4, playlist="other")
+    for value in (0.05, 0.5, 5.) :
+        latency.observe(value, service="qobuz")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE deleted_total counter" in lines
+    assert 'deleted_total{playlist="my \\"playlist\\""} 3.0' in lines
+    assert 'failed{playlist="other"} 4' in lines
+    assert 'latency_seconds_bucket{service="qobuz",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{service="qobuz",le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{service="qobuz",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{service="qobuz"} 3' in lines
+
+    # Textfile collector
+    registry.write_textfile(tmp_path / "cabot.prom")
+    assert (tmp_path / "cabot.prom").read_text() == registry.render()
+    assert [f.name for f in tmp_path.iterdir()] == ["cabot.prom"]
+
+    # HTTP endpoint
+    server = registry.serve(0)
+    try :
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response :
+            assert response.read().decode() == registry.render()
+    finally :
+        server.shutdown()
+
+
+def test_scheduler_metrics() :
+
+    METRICS.clear()
+    scheduler = AdaptiveScheduler("test", initial_rate=1000., base_delay=0.001)
+
+    responses = [(429, {}), (200, {})]
+    async def _send() -> tuple[int, dict] :
+        return responses.pop(0)
+
+    asyncio.run(scheduler.request(_send))
+
+    rendered = METRICS.render()
+    assert 'cabot_api_requests_total{service="test",status="429"} 1.0' in rendered
+    assert 'cabot_api_requests_total{service="test",status="200"} 1.0' in rendered
+    assert 'cabot_api_errors_total{service="test",kind="throttled"} 1.0' in rendered
+    assert 'cabot_api_request_seconds_count{service="test"} 2' in rendered
@@ -0,0 +1,91 @@
+from path import CABOT
+from src.features import database, rip
+from src.features.config import (
+    DEFAULT_CABOT_CONFIG_PATH,
+    load_cabot_config,
+)
+from src.features.plan import plan_one_playlist
+from src.features.resolution import (
+    record_miss,
+    save_fallback_search,
+)
+from src.features.store import (
+    get_store_folder,
+    add_to_store,
+)
+from test_index import make_tagged_aiff
+from test_rip import (
+    FakeSpotify,
+    make_spotify_item,
+)
+
+
+def _database_rows() -> dict[str, list] :
+    """
+    Rows of every non-empty table.
+    """
+
+    with database.transaction() as db :
+        tables = [table for table, in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()]
+        rows = {table: sorted(db.execute(f"SELECT * FROM {table}").fetchall()) for table in tables}
+
+    return {table: table_rows for table, table_rows in rows.items() if table_rows}
+
+
+def test_plan_one_playlist(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+
+    playlists_folder = tmp_path / "playlists"
+    cabot_config = load_cabot_config(DEFAULT_CABOT_CONFIG_PATH, tmp_folder=tmp_path / "tmp", playlists_folder=playlists_folder)
+    playlist = next(iter(cabot_config.playlists))
+
+    # Kept, deleted and untagged songs
+    aiff_folder = playlists_folder / playlist / "AIFF"
+    aiff_folder.mkdir(parents=True)
+    kept = make_tagged_aiff(aiff_folder, "kept", "ISRC00000001")
+    deleted = make_tagged_aiff(aiff_folder, "deleted", "ISRC00000002")
+    untagged = make_tagged_aiff(aiff_folder, "untagged", "")
+
+    # Downloaded by another playlist
+    other_aiff_folder = playlists_folder / "other" / "AIFF"
+    other_aiff_folder.mkdir(parents=True)
+    add_to_store(get_store_folder(playlists_folder), make_tagged_aiff(other_aiff_folder, "shared", "ISRC00000003"), "ISRC00000003")
+
+    monkeypatch.setattr(rip, "Spotify", FakeSpotify)
+    monkeypatch.setattr(rip, "SpotifyClientCredentials", lambda **kwargs: None)
+    monkeypatch.setattr(rip, "_CACHE_SPOTIFY_PLAYLIST", {})
+    monkeypatch.setattr(FakeSpotify, "snapshot_id", "1")
+    monkeypatch.setattr(FakeSpotify, "tracks", ["ISRC00000001", "ISRC00000003", "ISRC00000004", "ISRC00000005"])
+    url = cabot_config.playlists[playlist]["spotify"]
+
+    try :
+        # Last run's snapshot, before "ISRC00000004" was added
+        previous_tracks = ["ISRC00000001", "ISRC00000003", "ISRC00000005"]
+        rip._save_spotify_snapshot(url, {"name": "Playlist", "snapshot_id": "0", "tracks": {"items": [make_spotify_item(isrc) for isrc in previous_tracks]}})
+
+        # Found nowhere during a previous run : settled, not searched again
+        record_miss("ISRC00000005")
+        save_fallback_search("Track ISRC00000005 - Artist", None, False)
+
+        database_before = _database_rows()
+        playlist_plan = plan_one_playlist(cabot_config, playlist)
+
+        assert playlist_plan.to_download == ["Track ISRC00000004"]
+        assert playlist_plan.download_bytes == 180 * 900 * 1000 // 8
+        assert playlist_plan.to_link == ["Track ISRC00000003"]
+        assert playlist_plan.satisfied == 1
+        assert playlist_plan.settled == 1
+        assert sorted(playlist_plan.to_delete) == sorted([deleted, untagged])
+        assert playlist_plan.mass_deletion
+
+        # Nothing touched
+        assert kept.exists() and deleted.exists() and untagged.exists()
+        assert not (playlists_folder / playlist / "AIFF" / "shared.aiff").exists()
+
+        # Neither the Spotify snapshot nor the index saved
+        assert _database_rows() == database_before
+        assert rip._load_spotify_snapshot(url)[0] == "0"
+
+    finally :
+        database.close_connections()
@@ -0,0 +1,96 @@
+import time
+
+
+from path import CABOT
+from src.features import database, resolution
+from src.features.resolution import (
+    DAY,
+    resolution_key,
+    get_resolution,
+    save_resolution,
+    invalidate_resolutions,
+    is_known_missing,
+    record_miss,
+    get_fallback_search,
+    save_fallback_search,
+)
+
+
+def test_resolution_cache(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+
+    try :
+        assert resolution_key("FRX000000001", "Title", ["Artist"]) == "FRX000000001"
+        assert resolution_key(None, " Some  Title", ["b", "A"]) == resolution_key(None, "some title ", ["a", "B"])
+
+        save_resolution("FRX000000001", 42, "FRX000000001", "isrc")
+        assert get_resolution("FRX000000001") == ("42", "FRX000000001", "isrc")
+
+        # Expired
+        assert get_resolution("FRX000000001", ttl_days=0) is None
+
+        assert invalidate_resolutions(["FRX000000001"]) == 1
+        assert get_resolution("FRX000000001") is None
+
+    finally :
+        database.close_connections()
+
+
+def test_missing_backoff(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+
+    now = time.time()
+    monkeypatch.setattr(resolution.time, "time", lambda: now)
+
+    try :
+        assert not is_known_missing("FRX000000002", recheck_days=7)
+
+        record_miss("FRX000000002")
+        assert is_known_missing("FRX000000002", recheck_days=7)
+
+        now += 8 * DAY
+        assert not is_known_missing("FRX000000002", recheck_days=7)
+
+        # Delay doubles after another miss
+        record_miss("FRX000000002")
+        now += 8 * DAY
+        assert is_known_missing("FRX000000002", recheck_days=7)
+        now += 7 * DAY
+        assert not is_known_missing("FRX000000002", recheck_days=7)
+
+        # Found at last
+        record_miss("FRX000000002")
+        save_resolution("FRX000000002", 43, "FRX000000002", "title_artists")
+        assert not is_known_missing("FRX000000002", recheck_days=7)
+
+    finally :
+        database.close_connections()
+
+
+def test_fallback_search_cache(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+
+    now = time.time()
+    monkeypatch.setattr(resolution.time, "time", lambda: now)
+
+    try :
+        assert get_fallback_search("title - artist") is None
+
+        save_fallback_search("title - artist", {"id": 1, "duration": 200000}, True)
+        save_fallback_search("full set - artist", {"id": 2, "duration": 3600000}, False)
+        save_fallback_search("unknown - artist", None, False)
+
+        assert get_fallback_search("title - artist") == ({"id": 1, "duration": 200000}, True)
+        assert get_fallback_search("full set - artist") == ({"id": 2, "duration": 3600000}, False)
+        assert get_fallback_search("unknown - artist") == (None, False)
+
+        # Rejected searches expire sooner
+        now += 8 * DAY
+        assert get_fallback_search("title - artist", recheck_days=7) is not None
+        assert get_fallback_search("unknown - artist", recheck_days=7) is None
+
+    finally :
+        database.close_connections()
@@ -0,0 +1,373 @@
+import asyncio
+import shutil
+from pathlib import Path
+from aiohttp import web
+from mutagen.flac import FLAC
+from streamrip.client.qobuz import QobuzClient
+from streamrip.config import Config
+import streamrip.client.qobuz
+
+
+from path import CABOT
+from src.features import database, rip
+from src.features.config import (
+    DEFAULT_CABOT_CONFIG_PATH,
+    load_cabot_config,
+)
+from src.features.convert import _convert_to_xxx
+from src.features.resolution import (
+    resolution_key,
+    get_resolution,
+    save_resolution,
+    is_known_missing,
+    record_miss,
+    save_fallback_search,
+)
+from src.features.rip import (
+    PersistentQobuzClient,
+    _fetch_spotify_playlist,
+    spotify_tracks_to_sync,
+    rip_spotify_playlist,
+    tag_track_id,
+    rip_soundcloud_playlist,
+    build_soundcloud_playlist,
+)
+from src.features.scheduler import RequestError
+
+
+WHITE_NOISE_ABSOLUTE_PATH = CABOT / "tests" / "dummy_audio" / "white_noise.wav"
+
+
+def make_spotify_item(isrc: str) -> dict :
+    return {"track": {"name": f"Track {isrc}", "duration_ms": 180000, "album": {"name": "Album"},
+                      "artists": [{"name": "Artist"}], "external_ids": {"isrc": isrc}}}
+
+
+class FakeSpotify :
+    """
+    Serves `tracks` page by page, under `snapshot_id`.
+    """
+
+    snapshot_id = "1"
+    tracks: list[str] = []
+    requested_pages = []
+
+    def __init__(self, *args, **kwargs) -> None :
+        return
+
+    def playlist(self, url: str, fields: str) -> dict :
+        return {"name": "Playlist", "snapshot_id": FakeSpotify.snapshot_id}
+
+    def playlist_items(self, url: str, fields: str, limit: int, offset: int, additional_types: tuple) -> dict :
+        FakeSpotify.requested_pages.append(offset)
+        items = [make_spotify_item(isrc) for isrc in FakeSpotify.tracks[offset:offset + limit]]
+        return {"items": items, "next": "next" if offset + limit < len(FakeSpotify.tracks) else None}
+
+
+def test_fetch_spotify_playlist(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+    monkeypatch.setattr(rip, "Spotify", FakeSpotify)
+    monkeypatch.setattr(rip, "SpotifyClientCredentials", lambda **kwargs: None)
+    monkeypatch.setattr(FakeSpotify, "requested_pages", [])
+
+    cabot_config = load_cabot_config(DEFAULT_CABOT_CONFIG_PATH, tmp_folder=tmp_path)
+    url = "https://open.spotify.com/playlist/fake"
+
+    try :
+        # Every page
+        FakeSpotify.snapshot_id, FakeSpotify.tracks = "1", [f"ISRC{i:04d}" for i in range(250)]
+        spotify_playlist = _fetch_spotify_playlist(cabot_config, url)
+        assert FakeSpotify.requested_pages == [0, 100, 200]
+        assert [item["track"]["external_ids"]["isrc"] for item in spotify_playlist["tracks"]["items"]] == FakeSpotify.tracks
+        assert not spotify_playlist["unchanged"]
+
+        # Same snapshot, not fetched again
+        spotify_playlist = _fetch_spotify_playlist(cabot_config, url)
+        assert FakeSpotify.requested_pages == [0, 100, 200]
+        assert spotify_playlist["unchanged"] and len(spotify_playlist["tracks"]["items"]) == 250
+        assert spotify_playlist["added"] == spotify_playlist["removed"] == []
+
+        # Delta with the last snapshot
+        FakeSpotify.snapshot_id, FakeSpotify.tracks = "2", FakeSpotify.tracks[1:] + ["ISRCNEW"]
+        spotify_playlist = _fetch_spotify_playlist(cabot_config, url)
+        assert not spotify_playlist["unchanged"]
+        assert spotify_playlist["added"] == ["ISRCNEW"]
+        assert spotify_playlist["removed"] == ["ISRC0000"]
+
+    finally :
+        database.close_connections()
+
+
+def test_spotify_tracks_to_sync(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+
+    cabot_config = load_cabot_config(DEFAULT_CABOT_CONFIG_PATH, tmp_folder=tmp_path)
+    items = [make_spotify_item(isrc) for isrc in ("DOWNLOADED", "NOWHERE", "FALLBACK", "FAILED")]
+    spotify_playlist = {"tracks": {"items": items}, "unchanged": True, "added": [], "removed": []}
+
+    def _isrcs(to_sync: list[dict]) -> list[str] :
+        return [item["track"]["external_ids"]["isrc"] for item in to_sync]
+
+    try :
+        # Missing from Qobuz, rejected by the Soundcloud fallback search
+        record_miss("NOWHERE")
+        save_fallback_search("Track NOWHERE - Artist", None, False)
+
+        # Missing from Qobuz, downloaded from Soundcloud
+        record_miss("FALLBACK")
+
+        # Only the tracks that failed for another reason are synchronized again
+        assert _isrcs(spotify_tracks_to_sync(cabot_config, spotify_playlist, {"DOWNLOADED"}, {"FALLBACK"})) == ["FAILED"]
+        assert _isrcs(spotify_tracks_to_sync(cabot_config, spotify_playlist, {"DOWNLOADED"}, {"FALLBACK"}, recheck_missing=True)) == ["NOWHERE", "FALLBACK", "FAILED"]
+
+        # Added tracks are always synchronized
+        spotify_playlist |= {"unchanged": False, "added": ["NOWHERE"]}
+        assert _isrcs(spotify_tracks_to_sync(cabot_config, spotify_playlist, {"DOWNLOADED"}, {"FALLBACK"})) == ["NOWHERE", "FAILED"]
+
+    finally :
+        database.close_connections()
+
+
+def test_rip_spotify_playlist_resolution(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+    cabot_config = load_cabot_config(DEFAULT_CABOT_CONFIG_PATH, tmp_folder=tmp_path)
+
+    searched = []
+    ripped = []
+
+    class FakeQobuzClient :
+        config = Config.defaults()
+
+        async def search(self, media_type, query, limit) :
+            searched.append(query)
+            if media_type == "album" :
+                return [{"albums": {"items": []}}]
+            if query == "Some Title Artist" :
+                return [{"tracks": {"items": [{"id": 7, "isrc": "QOBUZ7", "title": "Some Title", "performers": "Artist"}]}}]
+            return [{"tracks": {"items": []}}]
+
+        async def _api_request(self, epoint, params) :
+            return 404, {}
+
+    class FakePlaylist :
+        def __init__(self, name, config, client, tracks) :
+            ripped.append([(track.id, track.track_id) for track in tracks])
+
+        async def rip(self) :
+            return
+
+    async def fake_get_qobuz_client(cabot_config) :
+        return FakeQobuzClient()
+
+    monkeypatch.setattr(rip, "get_qobuz_client", fake_get_qobuz_client)
+    monkeypatch.setattr(rip, "Playlist", FakePlaylist)
+
+    without_isrc = {"track": {"name": "Some Title", "album": {"name": "Album"}, "artists": [{"name": "Artist"}], "external_ids": {}}}
+    spotify_playlist = {"name": "Playlist", "tracks": {"items": [make_spotify_item("CACHED"), make_spotify_item("MISSING"), without_isrc]}}
+
+    def _rip(recheck_missing: bool=False) -> dict :
+        searched.clear()
+        failed_tracks, _, _, _ = asyncio.run(rip_spotify_playlist(cabot_config, spotify_playlist, set(), 0, tmp_path,
+                                                                  progress=False, recheck_missing=recheck_missing))
+        return failed_tracks
+
+    try :
+        save_resolution("CACHED", 5, "CACHED", "isrc")
+
+        # Cache hit, miss, and track without ISRC searched by title - artists
+        assert _rip() == {"Track MISSING - Artist": "MISSING"}
+        assert "CACHED" not in searched
+        assert ripped[-1] == [("5", "CACHED"), ("7", "Some Title - Artist")]
+        assert get_resolution(resolution_key(None, " some  title", ["ARTIST"])) == ("7", "QOBUZ7", "title_artists")
+        assert is_known_missing("MISSING")
+
+        # Nothing searched again while the miss is recent
+        assert _rip() == {"Track MISSING - Artist": "MISSING"}
+        assert searched == []
+        assert ripped[-1] == [("5", "CACHED"), ("7", "Some Title - Artist")]
+
+        # Unless rechecked
+        _rip(recheck_missing=True)
+        assert searched == ["MISSING", "Track MISSING Artist", "Album Artist"]
+
+    finally :
+        database.close_connections()
+
+
+def test_qobuz_relogin_keeps_requests_running(monkeypatch) :
+
+    logins = []
+
+    async def login(request) :
+        logins.append(request.query["user_auth_token"])
+        return web.json_response({"user": {"credential": {"parameters": {"lossless_streaming": True}}},
+                                  "user_auth_token": f"token{len(logins)}"})
+
+    async def slow(request) :
+        # Answers once the other request got its token refreshed
+        for _ in range(100) :
+            if len(logins) > 1 :
+                break
+            await asyncio.sleep(0.02)
+        return web.json_response({"token": request.headers["X-User-Auth-Token"]})
+
+    async def expiring(request) :
+        if request.headers["X-User-Auth-Token"] == "token1" :
+            return web.json_response({"message": "expired"}, status=401)
+        return web.json_response({"token": request.headers["X-User-Auth-Token"]})
+
+    async def _fake_app_id_and_secrets(self) -> tuple[str, list[str]] :
+        return "123456789", ["fakesecret"]
+
+    async def _fake_valid_secret(self, secrets: list[str]) -> str :
+        return secrets[0]
+
+    monkeypatch.setattr(QobuzClient, "_get_app_id_and_secrets", _fake_app_id_and_secrets)
+    monkeypatch.setattr(QobuzClient, "_get_valid_secret", _fake_valid_secret)
+
+    async def run() -> tuple[tuple[int, dict], tuple[int, dict]] :
+
+        app = web.Application()
+        app.router.add_get("/api.json/0.2/user/login", login)
+        app.router.add_get("/api.json/0.2/slow", slow)
+        app.router.add_get("/api.json/0.2/expiring", expiring)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(streamrip.client.qobuz, "QOBUZ_BASE_URL", f"http://127.0.0.1:{port}/api.json/0.2")
+
+        config = Config.defaults()
+        config.session.qobuz.email_or_userid = "fake"
+        config.session.qobuz.password_or_token = "fake"
+        config.session.qobuz.use_auth_token = True
+        client = PersistentQobuzClient(config)
+
+        try :
+            await client.login()
+            return await asyncio.gather(client._api_request("slow", {}), client._api_request("expiring", {}))
+        finally :
+            await client.session.close()
+            await runner.cleanup()
+
+    slow_result, expiring_result = asyncio.run(run())
+
+    # Logged in again once, without cutting the request in flight
+    assert len(logins) == 2
+    assert expiring_result == (200, {"token": "token2"})
+    assert slow_result == (200, {"token": "token1"})
+
+
+def test_tag_track_id(tmp_path, monkeypatch) :
+
+    track = _convert_to_xxx(".flac", WHITE_NOISE_ABSOLUTE_PATH, tmp_path)
+    song_data = FLAC(track)
+    song_data["TITLE"] = "Track – ☆"
+    song_data["description"] = "A long description"
+    song_data.save()
+
+    saves = []
+    original_save = FLAC.save
+    def _counting_save(self, *args, **kwargs) :
+        saves.append(self.filename)
+        return original_save(self, *args, **kwargs)
+
+    monkeypatch.setattr(FLAC, "save", _counting_save)
+
+    tag_track_id(track, "SEARCHED")
+
+    # ID tagged and metadata sanitized in a single save
+    assert len(saves) == 1
+    song_data = FLAC(track)
+    assert song_data["COMMENT"] == ["SEARCHED"]
+    assert song_data["TITLE"] == ["Track  "]
+    assert song_data["DESCRIPTION"] == [""]
+
+
+def test_rip_soundcloud_playlist(tmp_path, monkeypatch) :
+
+    # First tracks finish last, "broken" fails and "stuck" times out, "homonym" is named after "third"
+    delays = {"first": 0.3, "second": 0.2, "third": 0., "homonym": 0., "broken": 0., "stuck": 10.}
+
+    async def fake_download(url, audioFormat, filenameStyle, folder_path) :
+        name = url.split("/")[-1]
+        await asyncio.sleep(delays[name])
+        if name == "broken" :
+            raise RuntimeError("Download failed")
+        path = Path(folder_path) / f"{'third' if name == 'homonym' else name}.wav"
+        shutil.copy(WHITE_NOISE_ABSOLUTE_PATH, path)
+        return path
+
+    monkeypatch.setattr(rip, "download", fake_download)
+
+    cabot_config = load_cabot_config(DEFAULT_CABOT_CONFIG_PATH, tmp_folder=tmp_path, soundcloud_concurrency=5, soundcloud_timeout=1)
+
+    names = ["first", "known", "second", "broken", "stuck", "third", "homonym", "next"]
+    playlist = {
+        "title": "playlist",
+        "tracks": [{"id": i, "title": name, "permalink_url": f"https://soundcloud.com/{name}"} for i, name in enumerate(names)],
+    }
+
+    (failed_tracks,
+     memory_match,
+     next_track,
+     fully_ripped) = asyncio.run(rip_soundcloud_playlist(cabot_config, playlist, {"1"}, 0, tmp_path, limit=6))
+
+    assert sorted(failed_tracks) == ["broken", "stuck"]
+    assert memory_match == {"1"}
+    assert next_track == 7
+    assert not fully_ripped
+
+    # IDs still match their track
+    downloaded = {f.stem: FLAC(f)["COMMENT"][0] for f in (tmp_path / "playlist").glob("*.flac")}
+    assert downloaded == {"first": "0", "second": "2", "third": "5", "third (7)": "6"}
+    assert not list((tmp_path / "playlist").glob("*.wav"))
+    assert [f for f in (tmp_path / "playlist").iterdir() if f.is_dir()] == []
+
+
+def test_build_soundcloud_playlist(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+    cabot_config = load_cabot_config(DEFAULT_CABOT_CONFIG_PATH, tmp_folder=tmp_path)
+
+    searched = []
+
+    class FakeSession :
+        async def close(self) :
+            return
+
+    class FakeClient :
+        session = FakeSession()
+
+        async def search(self, media_type, query, limit) :
+            searched.append(query)
+            if query == "flaky" :
+                raise RequestError(429)
+            duration = {"track": 200000, "set": 3600000}.get(query)
+            return [{"collection": [] if duration is None else [{"id": query, "duration": duration}]}]
+
+    async def fake_get_soundcloud_client() :
+        return FakeClient()
+
+    monkeypatch.setattr(rip, "get_soundcloud_client", fake_get_soundcloud_client)
+
+    queries = {"track": "ISRC1", "set": "ISRC2", "nothing": "ISRC3", "flaky": "ISRC4"}
+
+    try :
+        playlist, double_failed = asyncio.run(build_soundcloud_playlist(cabot_config, queries, "playlist"))
+        assert playlist["tracks"] == [{"id": "track", "duration": 200000, "isrc": "ISRC1"}]
+        assert sorted(double_failed) == ["flaky", "nothing", "set"]
+
+        # Only the failed search is done again
+        searched.clear()
+        playlist, double_failed = asyncio.run(build_soundcloud_playlist(cabot_config, queries, "playlist"))
+        assert searched == ["flaky"]
+        assert playlist["tracks"] == [{"id": "track", "duration": 200000, "isrc": "ISRC1"}]
+        assert sorted(double_failed) == ["flaky", "nothing", "set"]
+
+    finally :
+        database.close_connections()
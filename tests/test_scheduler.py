@@ -0,0 +1,120 @@
+import asyncio
+import pytest
+
+
+from path import CABOT
+from src.features.limits import ConcurrencyLimiter
+from src.features.scheduler import (
+    AdaptiveScheduler,
+    RequestError,
+)
+
+
+def test_scheduler_retries() :
+
+    scheduler = AdaptiveScheduler(initial_rate=1000., base_delay=0.001, max_retries=3)
+
+    responses = [(429, {}), (503, {}), (200, {"ok": True})]
+    async def _send() -> tuple[int, dict] :
+        return responses.pop(0)
+
+    assert asyncio.run(scheduler.request(_send)) == (200, {"ok": True})
+    assert scheduler.retries == 2
+    assert scheduler.throttled == 1
+    assert scheduler.rate == 500.
+
+    # Other statuses are the caller's business
+    async def _not_found() -> tuple[int, dict] :
+        return 404, {}
+
+    assert asyncio.run(scheduler.request(_not_found)) == (404, {})
+
+    # Give up eventually
+    async def _throttled() -> tuple[int, dict] :
+        return 429, {}
+
+    with pytest.raises(RequestError) :
+        asyncio.run(scheduler.request(_throttled))
+
+
+def test_scheduler_decreases_once_per_window() :
+
+    scheduler = AdaptiveScheduler(initial_rate=40., max_rate=100., initial_concurrency=8, max_concurrency=8, max_retries=0)
+
+    async def _throttled() -> tuple[int, dict] :
+        await asyncio.sleep(0.3) # Longer than the burst
+        return 429, {}
+
+    async def _burst() -> None :
+        results = await asyncio.gather(*[scheduler.request(_throttled) for _ in range(8)], return_exceptions=True)
+        assert all(isinstance(result, RequestError) for result in results)
+
+    # The whole burst was sent before the first decrease
+    asyncio.run(_burst())
+    assert scheduler.throttled == 8
+    assert scheduler.rate == 20.
+    assert scheduler.concurrency == 4
+
+    # A request sent afterwards still counts
+    with pytest.raises(RequestError) :
+        asyncio.run(scheduler.request(_throttled))
+    assert scheduler.rate == 10.
+    assert scheduler.concurrency == 2
+
+    # The rate recovers whatever the latency
+    latencies = [0.001] + [0.05] * 5
+    async def _slow() -> tuple[int, dict] :
+        await asyncio.sleep(latencies.pop(0))
+        return 200, {}
+
+    for _ in range(6) :
+        asyncio.run(scheduler.request(_slow))
+    assert scheduler.rate > 10.
+
+
+def test_scheduler_concurrency() :
+
+    scheduler = AdaptiveScheduler(initial_rate=1000., initial_concurrency=2, max_concurrency=4)
+
+    active = 0
+    peak = 0
+    async def _send() -> tuple[int, dict] :
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return 200, {}
+
+    async def _run() -> None :
+        await asyncio.gather(*[scheduler.request(_send) for _ in range(40)])
+
+    asyncio.run(_run())
+
+    assert peak <= 4
+    assert scheduler.concurrency == 4
+
+
+def test_scheduler_run_limiter() :
+
+    # Both services within the same run-wide cap
+    run_limiter = ConcurrencyLimiter(3)
+    qobuz = AdaptiveScheduler("qobuz", initial_rate=1000., initial_concurrency=4, run_limiter=run_limiter)
+    soundcloud = AdaptiveScheduler("soundcloud", initial_rate=1000., initial_concurrency=4, run_limiter=run_limiter)
+
+    active = 0
+    peak = 0
+    async def _send() -> tuple[int, dict] :
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return 200, {}
+
+    async def _run() -> None :
+        await asyncio.gather(*[scheduler.request(_send) for _ in range(20) for scheduler in (qobuz, soundcloud)])
+
+    asyncio.run(_run())
+
+    assert peak == 3
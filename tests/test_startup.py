@@ -0,0 +1,19 @@
+import subprocess
+import sys
+
+
+from path import CABOT
+
+
+HEAVY_MODULES = ["streamrip", "spotipy", "pybalt", "mutagen", "rich", "ffmpeg", "aiohttp", "numpy"]
+
+
+def test_startup_imports() :
+
+    # Fresh interpreter, so that modules imported by other tests don't count
+    result = subprocess.run([sys.executable, "-c", "import sys, src.main ; print(','.join(sorted(sys.modules)))"],
+                            cwd=CABOT, capture_output=True, text=True, check=True)
+
+    imported = set(result.stdout.strip().split(","))
+    for module in HEAVY_MODULES :
+        assert module not in imported, f"{module} is imported at startup."
@@ -0,0 +1,63 @@
+import asyncio
+import json
+import shutil
+
+
+from path import CABOT
+from src.features.convert import (
+    convert_batch_to_aiff,
+    shutdown_conversion_pools,
+)
+from src.features.trace import Tracer, TRACER
+
+
+WHITE_NOISE_ABSOLUTE_PATH = CABOT / "tests" / "dummy_audio" / "white_noise.wav"
+
+
+def test_tracer(tmp_path) :
+
+    tracer = Tracer()
+
+    async def _track(i: int) -> None :
+        with tracer.span("download", "qobuz", track=i) as trace_args :
+            await asyncio.sleep(0.01)
+            trace_args["done"] = True
+
+    async def _batch() -> None :
+        await asyncio.gather(*[_track(i) for i in range(3)])
+
+    with tracer.span("rip_batch", "spotify") :
+        asyncio.run(_batch())
+
+    summary = tracer.summary()
+    assert summary[("qobuz", "download")][0] == 3
+    assert summary[("spotify", "rip_batch")][0] == 1
+    assert summary[("spotify", "rip_batch")][1] >= summary[("qobuz", "download")][2]
+
+    tracer.export(tmp_path / "trace.json")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+
+    spans = [e for e in events if e["ph"] == "X"]
+    downloads = [e for e in spans if e["name"] == "download"]
+    assert all(e["args"]["done"] for e in downloads)
+
+    # Concurrent tasks don't share a lane
+    assert len({e["tid"] for e in downloads}) == 3
+    assert {e["tid"] for e in events if e["ph"] == "M"} == {e["tid"] for e in spans}
+
+
+def test_conversion_spans(tmp_path) :
+
+    for i in range(2) :
+        shutil.copy(WHITE_NOISE_ABSOLUTE_PATH, tmp_path / f"noise_{i}.wav")
+
+    TRACER.clear()
+    try :
+        convert_batch_to_aiff(tmp_path, [".wav"], tmp_path / "AIFF", jobs=2)
+    finally :
+        shutdown_conversion_pools()
+
+    # Timed in the workers
+    conversions = [e for e in TRACER.events() if e.get("name") == "ffmpeg"]
+    assert sorted(e["args"]["file"] for e in conversions) == ["noise_0.wav", "noise_1.wav"]
+    assert all(e["args"]["error"] is None for e in conversions)
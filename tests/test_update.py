@@ -0,0 +1,241 @@
+import asyncio
+import os
+import shutil
+import threading
+import pytest
+
+
+from path import CABOT
+from src.features import database, update
+from src.features.config import (
+    DEFAULT_CABOT_CONFIG_PATH,
+    load_cabot_config,
+)
+from src.features.journal import (
+    record_staged_batch,
+    get_staged_batches,
+)
+from src.features.rip import extract_track_id
+from src.features.store import (
+    get_store_folder,
+    get_stored_track_ids,
+    _store_path,
+)
+from src.features.resolution import (
+    record_miss,
+    save_fallback_search,
+)
+from src.features.update import (
+    MAX_PENDING_BATCHES,
+    ConversionPipeline,
+    stage_downloaded_batch,
+    discard_partial_downloads,
+    update_one_playlist,
+    update_playlists,
+)
+from test_index import make_tagged_aiff
+from test_journal import make_downloaded_flac
+from test_rip import make_spotify_item
+
+
+def test_update_only_synchronizes_delta(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+
+    # As in update_playlists, the thread has its own event loop
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    cabot_config = load_cabot_config(DEFAULT_CABOT_CONFIG_PATH, tmp_folder=tmp_path / "tmp", playlists_folder=tmp_path / "playlists", mp3_copy=False)
+    playlist = next(iter(cabot_config.playlists))
+    playlist_path = cabot_config.playlists_folder / playlist
+    download_path = cabot_config.tmp_folder / playlist
+
+    (playlist_path / "AIFF").mkdir(parents=True)
+    downloaded = make_tagged_aiff(playlist_path / "AIFF", "downloaded", "DOWNLOADED")
+
+    spotify_playlist = {"name": playlist,
+                        "tracks": {"items": [make_spotify_item("DOWNLOADED"), make_spotify_item("NOWHERE")]},
+                        "unchanged": True,
+                        "added": [],
+                        "removed": []}
+
+    ripped = []
+    async def fake_rip_spotify_playlist(cabot_config, spotify_playlist, memory, offset, download_path, **kwargs) :
+        ripped.append([item["track"]["external_ids"]["isrc"] for item in spotify_playlist["tracks"]["items"]])
+        return {}, set(), len(spotify_playlist["tracks"]["items"]), True
+
+    monkeypatch.setattr(update, "fetch_spotify_playlist", lambda cabot_config, url: spotify_playlist)
+    monkeypatch.setattr(update, "rip_spotify_playlist", fake_rip_spotify_playlist)
+
+    try :
+        # Found nowhere during a previous run
+        record_miss("NOWHERE")
+        save_fallback_search("Track NOWHERE - Artist", None, False)
+
+        # Unchanged snapshot, every track downloaded or settled : skipped
+        update_one_playlist(cabot_config, playlist, download_path, progress=False)
+        assert ripped == []
+        assert downloaded.is_file()
+
+        # Changed snapshot : only the added track is synchronized
+        spotify_playlist["tracks"]["items"].append(make_spotify_item("ADDED"))
+        spotify_playlist |= {"unchanged": False, "added": ["ADDED"]}
+        update_one_playlist(cabot_config, playlist, download_path, progress=False)
+        assert ripped == [["ADDED"]]
+        assert downloaded.is_file()
+
+    finally :
+        database.close_connections()
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def test_update_playlists_in_parallel(tmp_path, monkeypatch) :
+
+    monkeypatch.setattr(database, "DATABASE_PATH", tmp_path / "cabot.db")
+
+    isrcs_by_playlist = {"first": ["FIRST1", "FIRST2", "FIRST3"], "second": ["SECOND1", "SECOND2", "SECOND3"]}
+    cabot_config = load_cabot_config(DEFAULT_CABOT_CONFIG_PATH,
+                                     tmp_folder=tmp_path / "tmp",
+                                     playlists_folder=tmp_path / "playlists",
+                                     playlists={playlist: {"spotify": playlist} for playlist in isrcs_by_playlist},
+                                     mp3_copy=False,
+                                     analyse_key=False,
+                                     parallel=2)
+
+    def fake_fetch_spotify_playlist(cabot_config, url) :
+        return {"name": url,
+                "tracks": {"items": [make_spotify_item(isrc) for isrc in isrcs_by_playlist[url]]},
+                "unchanged": False,
+                "added": isrcs_by_playlist[url],
+                "removed": []}
+
+    # Both playlists download at the same time, track by track
+    both_downloading = threading.Barrier(2, timeout=10)
+    async def fake_rip_spotify_playlist(cabot_config, spotify_playlist, memory, offset, download_path, **kwargs) :
+        both_downloading.wait()
+        isrcs = [item["track"]["external_ids"]["isrc"] for item in spotify_playlist["tracks"]["items"]]
+        for isrc in isrcs :
+            make_downloaded_flac(download_path / "Playlist", isrc, ISRC=isrc, COMMENT=isrc)
+            await asyncio.sleep(0.01)
+        return {}, set(), len(isrcs), True
+
+    staged_batches = []
+    def recording_record_staged_batch(playlist, staged_batch, destination) :
+        staged_batches.append((playlist, staged_batch, destination))
+        record_staged_batch(playlist, staged_batch, destination)
+
+    monkeypatch.setattr(update, "fetch_spotify_playlist", fake_fetch_spotify_playlist)
+    monkeypatch.setattr(update, "rip_spotify_playlist", fake_rip_spotify_playlist)
+    monkeypatch.setattr(update, "record_staged_batch", recording_record_staged_batch)
+
+    try :
+        update_playlists(cabot_config)
+
+        store_folder = get_store_folder(cabot_config.playlists_folder)
+        for playlist, isrcs in isrcs_by_playlist.items() :
+            playlist_path = cabot_config.playlists_folder / playlist
+
+            # Each playlist converted its own tracks only
+            converted = {song.stem: extract_track_id(song) for song in (playlist_path / "AIFF").iterdir()}
+            assert converted == {isrc: isrc for isrc in isrcs}
+
+            # Journaled in its own folders, and completed
+            assert [(staged_batch.parent.parent, destination) for p, staged_batch, destination in staged_batches if p == playlist] \
+                == [(cabot_config.tmp_folder / playlist, playlist_path)]
+            assert get_staged_batches(playlist) == []
+
+            # Stored from its own tracks
+            for isrc in isrcs :
+                assert os.path.samefile(_store_path(store_folder, isrc, ".aiff"), playlist_path / "AIFF" / f"{isrc}.aiff")
+
+        assert get_stored_track_ids(store_folder) == set(isrcs_by_playlist["first"] + isrcs_by_playlist["second"])
+
+    finally :
+        database.close_connections()
+
+
+def _download_and_convert(pipeline: ConversionPipeline, download_path, download, batches: list[str]) -> None :
+    """
+    The loop of `update_one_playlist` : each batch is staged and handed to the pipeline once downloaded.
+    """
+
+    try :
+        for batch in batches :
+            download(batch)
+            pipeline.submit(stage_downloaded_batch(download_path, batch))
+    finally :
+        pipeline.join()
+
+    return
+
+
+def test_conversion_pipeline(tmp_path) :
+
+    download_path = tmp_path / "tmp"
+    events = []
+    converted = []
+    second_downloading = threading.Event()
+
+    def _download(batch: str) -> None :
+        events.append(("download", batch, len(converted)))
+        if batch == "batch_2" :
+            second_downloading.set()
+        (download_path / "Playlist").mkdir(parents=True)
+        (download_path / "Playlist" / f"{batch}.flac").touch()
+
+    def _convert(staged_batch) -> None :
+        # Only converted while the next batch downloads
+        if staged_batch.name == "batch_1" :
+            assert second_downloading.wait(timeout=10)
+        converted.append([song.name for song in (staged_batch / "Playlist").iterdir()])
+        shutil.rmtree(staged_batch)
+
+    assert MAX_PENDING_BATCHES == 1
+    batches = ["batch_1", "batch_2", "batch_3", "batch_4"]
+    _download_and_convert(ConversionPipeline(_convert), download_path, _download, batches)
+
+    # In order, each batch on its own
+    assert converted == [[f"{batch}.flac"] for batch in batches]
+
+    # A batch only downloads once the one before the previous one is converted
+    assert [converted_count for _, _, converted_count in events] == [0, 0, 1, 2]
+
+
+def test_conversion_pipeline_errors(tmp_path) :
+
+    download_path = tmp_path / "tmp"
+
+    def _download(batch: str) -> None :
+        (download_path / "Playlist").mkdir(parents=True)
+        (download_path / "Playlist" / f"{batch}.flac").touch()
+
+    # A failed conversion is raised when the next batch is submitted
+    def _failing_convert(staged_batch) -> None :
+        raise RuntimeError(staged_batch.name)
+
+    with pytest.raises(RuntimeError, match="batch_1") :
+        _download_and_convert(ConversionPipeline(_failing_convert), download_path, _download, ["batch_1", "batch_2", "batch_3"])
+
+    shutil.rmtree(download_path)
+
+    # Aborted while downloading : the staged batch is still converted, the partial download discarded on resume
+    converted = []
+    def _convert(staged_batch) -> None :
+        converted.append(staged_batch.name)
+        shutil.rmtree(staged_batch)
+
+    def _aborted_download(batch: str) -> None :
+        if batch == "batch_1" :
+            return _download(batch)
+        make_downloaded_flac(download_path / "Playlist", "complete", ISRC="FOUND", COMMENT="SEARCHED")
+        (download_path / "Playlist" / "partial.flac").write_bytes(b"fLaC" + b"\x00" * 100)
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt) :
+        _download_and_convert(ConversionPipeline(_convert), download_path, _aborted_download, ["batch_1", "batch_2"])
+
+    assert converted == ["batch_1"]
+    assert discard_partial_downloads(download_path) == {"SEARCHED"}
+    assert [song.name for song in (download_path / "Playlist").iterdir()] == ["complete.flac"]